@@ -0,0 +1,197 @@
+# bench_download.py
+"""
+Benchmark download_images against the local mock API (mock_foodlog_api.py).
+
+The mock runs in its own process (sharing the GIL with the downloader would
+make it the bottleneck). Each mode runs on a fresh CSV of synthetic
+FoodLogIds and a fresh images directory, and rows/s, MB/s and p95 latencies
+are read from the run's --stats-json summary.
+
+Before the runs, check_hedging() hedges slow in-process requests through
+AsyncDownloader and checks that hedged duplicates stay within the
+concurrency limit and give their limiter slots back.
+
+Usage:
+    python bench_download.py --rows 500 --latency 0.05 --concurrency 8 32
+    python bench_download.py --rows 2000 --modes async --concurrency 16 64 --error-rate 0.02 --json bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import httpx
+import pandas as pd
+
+import download_images
+from mock_foodlog_api import add_mock_arguments
+
+MOCK_SCRIPT = pathlib.Path(__file__).with_name("mock_foodlog_api.py")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_process(mock_argv: list, timeout: float = 10.0):
+    """Run mock_foodlog_api.py in a subprocess and wait until it answers; returns (process, api_base)."""
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, str(MOCK_SCRIPT), "--port", str(port)] + mock_argv,
+                            stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            break
+        except httpx.TransportError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError("mock_foodlog_api.py did not start")
+            time.sleep(0.1)
+    return proc, f"http://127.0.0.1:{port}/v1/uc/food-log"
+
+
+def mock_argv_from_args(args) -> list:
+    argv = []
+    for name in ("latency", "image_latency", "error_rate", "truncate_rate", "bandwidth",
+                 "image_size", "shared_rate", "slow_rate", "slow_latency", "seed"):
+        value = getattr(args, name)
+        if value is not None:
+            argv += ["--" + name.replace("_", "-"), str(value)]
+    return argv
+
+
+class _FixedHedge(download_images.HedgePolicy):
+    """Hedges every request after a fixed delay (no latency samples needed)."""
+
+    def delay(self, stats):
+        return self.min_delay
+
+
+async def _hedging_run(limit: int, requests: int) -> tuple:
+    limiter = download_images.ConcurrencyLimiter(limit)
+    run = types.SimpleNamespace(out_path=None, store=None, cache=None, stats=download_images.DownloadStats())
+    downloader = download_images.AsyncDownloader(types.SimpleNamespace(api=None, cdn=None), run, limiter,
+                                                 download_images.RetryPolicy(0), hedge=_FixedHedge(min_delay=0.01))
+    rng = random.Random(0)
+    active = peak = 0
+
+    async def attempt():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            # A slow tail, so that many requests outlast the hedge delay
+            await asyncio.sleep(0.1 if rng.random() < 0.3 else 0.002)
+        finally:
+            active -= 1
+
+    async def worker():
+        for _ in range(requests // (limit - 1)):
+            await downloader._call(lambda: downloader._hedged(attempt))
+
+    # One worker fewer than the limit leaves slots free to hedge into, but not one per slow request
+    await asyncio.gather(*(worker() for _ in range(limit - 1)))
+    await asyncio.sleep(0.01)  # cancelled duplicates release their slots on their next step
+    return peak, limiter.inflight, run.stats.hedges
+
+
+def check_hedging(limit: int = 4, requests: int = 200):
+    """Hedged duplicates take a limiter slot of their own: in-flight requests never exceed the limit."""
+    peak, inflight, hedges = asyncio.run(_hedging_run(limit, requests))
+    assert hedges, "no request was hedged"
+    assert peak <= limit, f"{peak} requests in flight with a limit of {limit}"
+    assert inflight == 0, f"{inflight} limiter slots still taken after the run"
+
+
+def run_once(work_dir: pathlib.Path, label: str, rows: int, mode: str, concurrency: int, options: dict) -> dict:
+    csv_file = work_dir / f"{label}.csv"
+    stats_file = work_dir / f"{label}.stats.json"
+    pd.DataFrame({"FoodLogId": [f"bench{i:07d}" for i in range(rows)]}).to_csv(csv_file, index=False)
+    kwargs = dict(options, stats_json=str(stats_file), stats_every=0)
+
+    # Per-row [OK] lines would dominate the timing on a fast mock
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if mode == "sequential":
+            download_images.main(str(csv_file), str(work_dir / f"{label}_images"), "bench-token", **kwargs)
+        else:
+            asyncio.run(download_images.main_async(str(csv_file), str(work_dir / f"{label}_images"), "bench-token",
+                                                   concurrency=concurrency, pipeline=mode == "pipeline", **kwargs))
+
+    with open(stats_file, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    return {
+        "label": label,
+        "mode": mode,
+        "concurrency": concurrency if mode != "sequential" else 1,
+        "rows_per_s": stats["rows_per_s"],
+        "mb_per_s": round(stats["bytes_per_s"] / 1e6, 3),
+        "elapsed_s": stats["elapsed_s"],
+        "failed": stats["rows"]["failed"],
+        "metadata_p95_s": stats["stages"]["metadata"]["p95_s"],
+        "image_p95_s": stats["stages"]["image"]["p95_s"],
+    }
+
+
+def main(rows: int, modes: list, concurrencies: list, options: dict, mock_argv: list) -> list:
+    check_hedging()
+    proc, api_base = start_mock_process(mock_argv)
+    download_images.API_BASE = api_base
+    print(f"[INFO] Mock API on {api_base}, {rows} rows per run")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_download_") as tmp:
+            work_dir = pathlib.Path(tmp)
+            runs = []
+            if "sequential" in modes:
+                runs.append(("sequential", "sequential", 1))
+            for mode in ("async", "pipeline"):
+                if mode in modes:
+                    runs.extend((f"{mode}_c{c}", mode, c) for c in concurrencies)
+            for label, mode, concurrency in runs:
+                result = run_once(work_dir, label, rows, mode, concurrency, options)
+                results.append(result)
+                print(f"{label:<14} {result['rows_per_s']:>9.1f} rows/s {result['mb_per_s']:>8.2f} MB/s "
+                      f"metadata p95 {(result['metadata_p95_s'] or 0) * 1000:>7.1f}ms "
+                      f"image p95 {(result['image_p95_s'] or 0) * 1000:>7.1f}ms "
+                      f"failed {result['failed']}")
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark download_images modes against a local mock API")
+    parser.add_argument("--rows", type=int, default=300, help="Synthetic FoodLogIds per run (default: 300)")
+    parser.add_argument("--modes", nargs="+", choices=["sequential", "async", "pipeline"],
+                        default=["sequential", "async", "pipeline"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16],
+                        help="Concurrency levels to run in async and pipeline modes (default: 16)")
+    parser.add_argument("--dedupe", action="store_true", help="Pass --dedupe to the downloader")
+    parser.add_argument("--stream", action="store_true", help="Pass --stream to the downloader")
+    parser.add_argument("--http2", action="store_true", help="Pass --http2 to the downloader")
+    parser.add_argument("--retries", type=int, default=3, help="Downloader retries (default: 3)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    results = main(args.rows, args.modes, args.concurrency,
+                   {"dedupe": args.dedupe, "stream": args.stream, "retries": args.retries, "http2": args.http2},
+                   mock_argv_from_args(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.json}")
@@ -0,0 +1,380 @@
+# bench_gallery.py
+"""
+Benchmark gallery card rendering on a synthetic wide CSV.
+
+Cards are built without images (ImgName is empty), so the timings are the
+per-cell formatting and HTML assembly of show_foodlog_gallery.py and
+server_review.py. Each benchmark compares a baseline with the optimized path:
+- cells, cards: resolving every column's formatter per row (what
+  build_card_html does when called without formatters) vs. the formatters
+  compiled once per DataFrame
+- frame: df.iterrows() + build_card_html per row vs. the column-wise
+  PreformattedCards stage + card_html by position (whole frame, all cards)
+  Card benchmarks also report cards/s of the optimized path (cards_per_s)
+- json_cells: parsing and formatting every RD Comments / Ingredients cell
+  vs. the (column, value) LRU cache, cleared before each run
+- json_codec: stdlib json.loads vs. json_codec.loads (orjson if installed)
+  on each real cell shape: empty lists, Ingredients, RD Comments, RD Feedback
+  lists and questionnaire answers
+- humanize: the previous recursive humanize_json vs. humanize.humanize_json
+  on nested AI payloads (the Ai* column cells, a large raw payload, 200
+  levels deep, 300 keys wide), uncapped; the output is first checked
+  against the recursive version, and a 200k-key payload with a small
+  max_chars must stop after its first values
+- nutrition: parsing every Ingredients cell (0-5 ingredients, distinct
+  grams per row) and summing its nutrients row by row vs. nutrition.meal_totals (distinct cells parsed into matrices,
+  summed in one pass), cold cache and warm cache (next gallery request)
+
+Usage:
+    python bench_gallery.py --rows 2000 --extra-columns 60
+    python bench_gallery.py --rows 500 --extra-columns 200 --repeat 5 --json bench_gallery.json
+"""
+import argparse
+import json
+import pathlib
+import random
+import time
+import timeit
+
+import pandas as pd
+
+import humanize
+import json_codec
+import nutrition
+import server_review
+import show_foodlog_gallery
+
+RENDERERS = {"show_foodlog_gallery": show_foodlog_gallery, "server_review": server_review}
+
+COMMENTS = ['[]', '[{"text": "Looks great, nice protein choice!", "commentedAt": "2025-10-01T12:00:00Z"}]',
+            '[{"text": "Try adding vegetables", "commentedAt": "2025-10-02T08:30:00Z"}]']
+INGREDIENTS = ['[]', json.dumps([{"name": "egg", "estimatedPortion": "2 large",
+                                  "nutrition": [{"nutrition": "PROTEIN", "gram": 12}], "kcalPer100g": 155}]),
+               json.dumps([{"name": "rice", "estimatedPortion": "1 cup",
+                            "nutrition": [{"nutrition": "CARB", "gram": 45}], "kcalPer100g": 130}])]
+QUESTIONNAIRE = json.dumps({"q1_most_important": "Agree", "q2_action_makes_sense": "Neutral",
+                            "q3_clinically_appropriate": "Strongly agree",
+                            "q4_what_worked": "Clear, friendly tone", "q5_what_felt_off": ""})
+FEEDBACK = json.dumps([{"rd_name": "Alex", "feedback": QUESTIONNAIRE, "feedbackedAt": "2025-10-03T09:15:00"},
+                       {"rd_name": "Sam", "feedback": "Looks right", "feedbackedAt": "2025-10-04T10:00:00"}],
+                      ensure_ascii=False)
+# Real cell shapes for the json_codec benchmark
+JSON_CELLS = {
+    "empty_list": "[]",
+    "ingredients_large": json.dumps([{"name": f"ingredient {i}", "estimatedPortion": f"{i + 1} oz",
+                                      "nutrition": [{"nutrition": n, "gram": i * 1.5} for n in
+                                                    ("PROTEIN", "FAT", "CARB", "SUGAR", "FIBER", "SODIUM")],
+                                      "kcalPer100g": 100 + i} for i in range(8)]),
+    "ingredients": INGREDIENTS[1],
+    "rd_comments": COMMENTS[1],
+    "rd_feedback": FEEDBACK,
+    "questionnaire": QUESTIONNAIRE,
+}
+
+# Nested AI payloads for the humanize benchmark; each shape is a list of cells rendered one by one
+HUMANIZE_PAYLOADS = {
+    # The JSON cells of make_wide_frame's Ai*/metric columns (AiIdentifyRawData, AiScore*, ...)
+    "ai_columns": [{"foods": [{"name": "egg", "confidence": 0.93}]}, {"score": 7, "tags": ["a", "b"]},
+                   ["high protein"], json.loads(QUESTIONNAIRE)],
+    "ai_raw_data": [json.loads(JSON_CELLS["ingredients_large"]) + [json.loads(QUESTIONNAIRE)]],
+    "deep": [json.loads("".join(['{"note": "step", "next": '] * 200 + [JSON_CELLS["ingredients_large"]]
+                                + ["}"] * 200))],
+    "wide": [{f"food {i}": {"name": f"item {i}", "tags": ["a", "b"],
+                            "nutrition": [{"nutrition": "PROTEIN", "gram": i}]} for i in range(300)}],
+}
+# Shapes where the iterative renderer once differed from the recursive one (newlines inside keys)
+HUMANIZE_REGRESSIONS = [
+    [{"d\ne0": 1}],
+    {"a\nb": {"c": 1}},
+    {"k": {"x\ny": 1}},
+    {"k": [{"\n": None}], "z": {"y": {"x\n": [{"w": 1}]}}},
+]
+
+
+def humanize_recursive(obj, *, indent_level: int = 0) -> str:
+    """The recursive humanize_json the gallery scripts used before humanize.py (benchmark baseline)."""
+    indent = "  " * indent_level
+    if obj is None:
+        return ""
+    if isinstance(obj, dict):
+        lines = []
+        for k, v in obj.items():
+            v_str = humanize_recursive(v, indent_level=indent_level + 1)
+            lines.append(f"{indent}{str(k).strip()}：\n{v_str}" if "\n" in v_str else f"{indent}{str(k).strip()}：{v_str}")
+        return "\n".join(lines)
+    if isinstance(obj, (list, tuple, set)):
+        if not obj:
+            return ""
+        if any(isinstance(x, dict) for x in obj):
+            out_lines = []
+            for i, x in enumerate(obj, 1):
+                x_str = humanize_recursive(x, indent_level=indent_level + 1)
+                prefix = f"{indent}- 项{i}: "
+                out_lines.append(prefix + "\n" + x_str if "\n" in x_str else prefix + x_str)
+            return "\n".join(out_lines)
+        return "，".join(str(x) for x in obj)
+    return str(obj)
+
+
+def make_wide_frame(rows: int, extra_columns: int, seed: int = 0) -> pd.DataFrame:
+    """Food-log-like rows: the known columns plus extra_columns of Ai*/metric text and small JSON values."""
+    rng = random.Random(seed)
+    data = {
+        "MemberId": [f"m{i % 50}" for i in range(rows)],
+        "FoodLogId": [f"bench{i:07d}" for i in range(rows)],
+        "ImgName": [""] * rows,
+        "MealTitle": [rng.choice(["Breakfast", "Lunch", "Dinner", "Snack"]) for _ in range(rows)],
+        "Description": [f"Meal number {i} with some free text" for i in range(rows)],
+        "RD Comments": [rng.choice(COMMENTS) for _ in range(rows)],
+        "Ingredients": [rng.choice(INGREDIENTS) for _ in range(rows)],
+        "AiInsight": ["Balanced plate, moderate carbs." for _ in range(rows)],
+        "AiIdentifyRawData": ['{"foods": [{"name": "egg", "confidence": 0.93}]}'] * rows,
+        "FoodLogLabels": [rng.choice(["", '["high protein"]']) for _ in range(rows)],
+        "MicroAction": [rng.choice(["", "Add a side salad"]) for _ in range(rows)],
+        "ActionFamily": [""] * rows,
+        "BestAnchor": ["lunch"] * rows,
+        "RD Feedback": [rng.choice(["", FEEDBACK]) for _ in range(rows)],
+    }
+    for k in range(extra_columns):
+        name = f"AiScore{k}" if k % 2 else f"Metric{k}"
+        if k % 3 == 0:
+            data[name] = [json.dumps({"score": rng.randint(0, 10), "tags": ["a", "b"]}) for _ in range(rows)]
+        else:
+            data[name] = [f"value {rng.randint(0, 999)}" for _ in range(rows)]
+    return pd.DataFrame(data)
+
+
+def best_of(repeat: int, fn, setup=None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_renderer(module, df: pd.DataFrame, repeat: int) -> list:
+    images_dir = pathlib.Path("images")
+    display_columns = module.get_display_columns(df)
+    rows = list(df.iterrows())
+    cells = [(row[col], col) for _, row in rows for col in display_columns if col != "ImgName"]
+
+    def cells_per_call():
+        for value, col in cells:
+            module.format_field_value(value, col)
+
+    def cells_compiled():
+        formatters = {f.name: f.format for f in module.compile_formatters(display_columns)}
+        for value, col in cells:
+            formatters[col](value)
+
+    def cards_per_row():
+        for idx, row in rows:
+            module.build_card_html(row, images_dir, display_columns, row_idx=idx)
+
+    def cards_compiled():
+        formatters = module.compile_formatters(display_columns)
+        for idx, row in rows:
+            module.build_card_html(row, images_dir, display_columns, row_idx=idx, formatters=formatters)
+
+    def frame_iterrows():
+        formatters = module.compile_formatters(display_columns)
+        for idx, row in df.iterrows():
+            module.build_card_html(row, images_dir, display_columns, row_idx=idx, formatters=formatters)
+
+    def frame_preformatted():
+        cards = module.PreformattedCards(df, display_columns)
+        for pos in range(len(cards)):
+            cards.card_html(pos, images_dir)
+
+    json_cells = [(value, col) for value, col in cells if col in ("RD Comments", "Ingredients")]
+
+    def json_cells_uncached():
+        for value, col in json_cells:
+            text = module.cell_text(value)
+            if not text:
+                continue
+            if col == "Ingredients":
+                module.format_ingredients(text)
+            else:
+                module.format_rd_comments(text)
+
+    def json_cells_cached():
+        for value, col in json_cells:
+            module.format_field_value(value, col)
+
+    results = []
+    for label, baseline, optimized, count in (("cells", cells_per_call, cells_compiled, len(cells)),
+                                              ("cards", cards_per_row, cards_compiled, len(rows)),
+                                              ("frame", frame_iterrows, frame_preformatted, len(rows)),
+                                              ("json_cells", json_cells_uncached, json_cells_cached,
+                                               len(json_cells))):
+        before = best_of(repeat, baseline, setup=module.cached_format.cache_clear)
+        after = best_of(repeat, optimized, setup=module.cached_format.cache_clear)
+        results.append({
+            "renderer": module.__name__,
+            "benchmark": label,
+            "count": count,
+            "baseline_s": round(before, 4),
+            "optimized_s": round(after, 4),
+            "speedup": round(before / after, 2) if after else None,
+        })
+        if label in ("cards", "frame"):
+            results[-1]["cards_per_s"] = round(count / after, 1) if after else None
+    results[-1]["format_cache"] = module.format_cache_stats()
+    return results
+
+
+def bench_json_codec(number: int, repeat: int) -> list:
+    results = []
+    for shape, cell in JSON_CELLS.items():
+        # timeit runs with the garbage collector off, so parsed objects do not skew the comparison
+        before = min(timeit.repeat(lambda: json.loads(cell), number=number, repeat=repeat))
+        after = min(timeit.repeat(lambda: json_codec.loads(cell), number=number, repeat=repeat))
+        results.append({
+            "renderer": f"json_codec[{json_codec.BACKEND}]",
+            "benchmark": shape,
+            "count": number,
+            "baseline_s": round(before, 4),
+            "optimized_s": round(after, 4),
+            "speedup": round(before / after, 2) if after else None,
+        })
+    return results
+
+
+class _CountedValue:
+    """A leaf value that counts how often it is written out (str())."""
+    written = 0
+
+    def __str__(self):
+        _CountedValue.written += 1
+        return "value"
+
+
+def check_humanize():
+    """humanize_json must match the recursive version, and max_chars must stop the rendering early."""
+    for payload in HUMANIZE_REGRESSIONS + [p for cells in HUMANIZE_PAYLOADS.values() for p in cells]:
+        expected = humanize_recursive(payload)
+        assert humanize.humanize_json(payload) == expected, payload
+        for cap in (1, 5, 100):
+            capped = expected if len(expected) <= cap else expected[:cap] + humanize.TRUNCATION_MARKER
+            assert humanize.humanize_json(payload, max_chars=cap) == capped, (payload, cap)
+    # A huge shallow payload is cut off after about max_chars worth of values, not rendered in full
+    leaf = _CountedValue()
+    huge = {f"key {i}": {"name": leaf, "gram": leaf} for i in range(200_000)}
+    _CountedValue.written = 0
+    text = humanize.humanize_json(huge, max_chars=2000)
+    assert text.endswith(humanize.TRUNCATION_MARKER) and len(text) == 2000 + len(humanize.TRUNCATION_MARKER)
+    assert _CountedValue.written < 1000, _CountedValue.written
+
+
+def bench_humanize(number: int, repeat: int) -> list:
+    check_humanize()
+    results = []
+    for shape, cells in HUMANIZE_PAYLOADS.items():
+        def baseline():
+            for payload in cells:
+                humanize_recursive(payload)
+
+        def optimized():
+            for payload in cells:
+                humanize.humanize_json(payload)
+
+        before = min(timeit.repeat(baseline, number=number, repeat=repeat))
+        after = min(timeit.repeat(optimized, number=number, repeat=repeat))
+        results.append({
+            "renderer": "humanize",
+            "benchmark": shape,
+            "count": number,
+            "baseline_s": round(before, 4),
+            "optimized_s": round(after, 4),
+            "speedup": round(before / after, 2) if after else None,
+        })
+    return results
+
+
+def nutrition_per_row(cells: list) -> list:
+    """Baseline for the nutrition benchmark: parse each cell and add up its grams in Python."""
+    totals = []
+    for cell in cells:
+        row = dict.fromkeys(nutrition.NUTRIENTS, 0.0)
+        try:
+            ingredients = json.loads(cell)
+        except Exception:
+            ingredients = []
+        for ingredient in ingredients if isinstance(ingredients, list) else []:
+            for item in ingredient.get("nutrition", []) if isinstance(ingredient, dict) else []:
+                name = str(item.get("nutrition", "")).upper()
+                if name in row:
+                    row[name] += float(item.get("gram") or 0)
+        totals.append(row)
+    return totals
+
+
+def bench_nutrition(df: pd.DataFrame, repeat: int) -> list:
+    # Real exports rarely repeat an Ingredients cell, so every row gets its own grams
+    cells = [json.dumps([{"name": f"ingredient {j}", "estimatedPortion": "1 cup",
+                          "nutrition": [{"nutrition": n, "gram": round(pos * 0.01 + j + k, 2)}
+                                        for k, n in enumerate(nutrition.NUTRIENTS)],
+                          "kcalPer100g": 120} for j in range(pos % 6)]) for pos in range(len(df))]
+    before = best_of(repeat, lambda: nutrition_per_row(cells))
+    cold = best_of(repeat, lambda: nutrition.meal_totals(cells), setup=nutrition.ingredient_matrix.cache_clear)
+    warm = best_of(repeat, lambda: nutrition.meal_totals(cells))
+    return [{
+        "renderer": "nutrition",
+        "benchmark": label,
+        "count": len(cells),
+        "baseline_s": round(before, 4),
+        "optimized_s": round(after, 4),
+        "speedup": round(before / after, 2) if after else None,
+    } for label, after in (("cold", cold), ("warm", warm))]
+
+
+def main(rows: int, extra_columns: int, repeat: int, renderers: list, json_parses: int = 20000) -> list:
+    df = make_wide_frame(rows, extra_columns)
+    print(f"[INFO] {rows} rows x {len(df.columns)} columns, best of {repeat}; JSON backend: {json_codec.BACKEND}")
+    results = []
+    for result in bench_json_codec(json_parses, repeat) if json_parses else []:
+        results.append(result)
+        print(f"{result['renderer']:<22} {result['benchmark']:<17} {result['count']:>8} "
+              f"json {result['baseline_s'] * 1000:>9.1f}ms "
+              f"json_codec {result['optimized_s'] * 1000:>9.1f}ms  x{result['speedup']}")
+    for result in bench_humanize(max(json_parses // 200, 1), repeat) if json_parses else []:
+        results.append(result)
+        print(f"{result['renderer']:<22} {result['benchmark']:<17} {result['count']:>8} "
+              f"recursive {result['baseline_s'] * 1000:>9.1f}ms "
+              f"iterative {result['optimized_s'] * 1000:>9.1f}ms  x{result['speedup']}")
+    for result in bench_nutrition(df, repeat):
+        results.append(result)
+        print(f"{result['renderer']:<22} {result['benchmark']:<10} {result['count']:>8} "
+              f"per-row {result['baseline_s'] * 1000:>9.1f}ms "
+              f"vectorized {result['optimized_s'] * 1000:>9.1f}ms  x{result['speedup']}")
+    for name in renderers:
+        for result in bench_renderer(RENDERERS[name], df, repeat):
+            results.append(result)
+            print(f"{name:<22} {result['benchmark']:<10} {result['count']:>8} "
+                  f"baseline {result['baseline_s'] * 1000:>9.1f}ms "
+                  f"optimized {result['optimized_s'] * 1000:>9.1f}ms  x{result['speedup']}"
+                  + (f"  {result['cards_per_s']:.0f} cards/s" if result.get("cards_per_s") else ""))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark gallery card rendering on a synthetic wide CSV")
+    parser.add_argument("--rows", type=int, default=1000, help="Synthetic rows (default: 1000)")
+    parser.add_argument("--extra-columns", type=int, default=60,
+                        help="Extra Ai*/metric columns on top of the usual ones (default: 60)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best is kept (default: 3)")
+    parser.add_argument("--renderers", nargs="+", choices=sorted(RENDERERS), default=sorted(RENDERERS))
+    parser.add_argument("--json-parses", type=int, default=20000,
+                        help="Parses per cell shape in the json_codec benchmark, 0 to skip it (default: 20000)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = main(args.rows, args.extra_columns, args.repeat, args.renderers, args.json_parses)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.json}")
@@ -0,0 +1,194 @@
+# card_templates.py
+"""
+Precompiled HTML templates for the gallery cards, shared by
+show_foodlog_gallery.py and server_review.py (and, through server_review,
+generate_static_gallery_from_sheet.py).
+
+Templates use str.format field syntax ("{foodlog_id}") but are parsed once
+at import into literal chunks and field names, and each review form is
+embedded into the card template up front, so a whole card renders with a
+single join. Values are inserted as-is: render_card_html() escapes each one
+once (the FoodLogId alone appears up to ten times in a card). The per-field
+and per-image snippets are rendered by small helpers instead, since they are
+too short for a template to pay off.
+"""
+import functools
+import html
+import string
+
+
+class CardTemplate:
+    """A str.format-style template (plain {name} fields only) split into chunks once."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.literals = []
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            if spec or conversion:
+                raise ValueError(f"Unsupported field {{{field}!{conversion}:{spec}}} in card template")
+            self.literals.append(literal)
+            if field is not None:
+                self.fields.append(field)
+        if len(self.literals) == len(self.fields):
+            self.literals.append("")
+
+    def embed(self, name: str, other: "CardTemplate") -> "CardTemplate":
+        """A new template with other's source in place of the {name} field."""
+        return CardTemplate(self.source.replace("{" + name + "}", other.source))
+
+    def render(self, record: dict) -> str:
+        parts = [None] * (2 * len(self.fields) + 1)
+        parts[0::2] = self.literals
+        parts[1::2] = [record[field] for field in self.fields]
+        return "".join(parts)
+
+
+NO_IMAGES = '<div class="img-missing">未提供图片文件名</div>'
+FEEDBACK_ITEM = CardTemplate(
+    '<div class="review-display-item">'
+    '<div class="review-display-header">RD Feedback:</div>'
+    '<div class="review-display-content">{content}</div>'
+    '<div class="review-display-meta">By: {name} | {timestamp}</div>'
+    '</div>'
+)
+
+CARD = CardTemplate("""
+    <div class="card" data-foodlog-id="{foodlog_id}">
+        <div class="images">
+            {images}
+        </div>
+        <div class="meta">
+            {fields}
+        </div>
+        {review_form}
+    </div>
+    """)
+
+# "Add RD Review" form of show_foodlog_gallery.py
+REVIEW_FORM = CardTemplate("""
+        <div class="review-form">
+            <div class="review-form-title">Add RD Review</div>
+            <div class="review-form-hint">For labeling the quality of AI-generated content</div>
+            <form class="rd-review-form" data-foodlog-id="{foodlog_id}">
+                <div class="form-group">
+                    <label for="rd-name-{foodlog_id}">RD Name:</label>
+                    <input type="text" id="rd-name-{foodlog_id}" name="rd_name" class="form-input" required />
+                </div>
+                <div class="form-group">
+                    <label for="rd-review-{foodlog_id}">Review (AI Content Quality Assessment):</label>
+                    <textarea id="rd-review-{foodlog_id}" name="rd_review" class="form-textarea" rows="3" placeholder="Please assess the quality of AI-generated content..." required></textarea>
+                </div>
+                <button type="submit" class="submit-btn">Submit</button>
+                <div class="form-status"></div>
+            </form>
+            <div class="review-display" id="review-display-{foodlog_id}"></div>
+        </div>
+    """)
+
+# Questionnaire feedback form of server_review.py; {feedback} holds the rendered existing feedback
+FEEDBACK_FORM = CardTemplate("""
+        <div class="review-form">
+            <div class="review-form-title">Feedback</div>
+            <div class="review-form-hint">For labeling the quality of AI-generated content</div>
+            <form class="rd-feedback-form" data-foodlog-id="{foodlog_id}">
+                <div class="form-group">
+                    <label for="rd-name-{foodlog_id}">RD Name:</label>
+                    <input type="text" id="rd-name-{foodlog_id}" name="rd_name" class="form-input" required />
+                </div>
+                
+                <div class="form-group">
+                    <div class="question-item">
+                        <div class="question-text">The insight correctly identifies and focuses on the most important thing about this meal.<span class="required-asterisk">*</span></div>
+                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
+                        <div class="rating-group">
+                            <label><input type="radio" name="q1_most_important" value="1" required> 1</label>
+                            <label><input type="radio" name="q1_most_important" value="2" required> 2</label>
+                            <label><input type="radio" name="q1_most_important" value="3" required> 3</label>
+                            <label><input type="radio" name="q1_most_important" value="4" required> 4</label>
+                            <label><input type="radio" name="q1_most_important" value="5" required> 5</label>
+                        </div>
+                    </div>
+                </div>
+                
+                <div class="form-group">
+                    <div class="question-item">
+                        <div class="question-text">The suggested action (if any) makes sense as a secondary step for this meal and its timing.<span class="required-asterisk">*</span></div>
+                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
+                        <div class="rating-group">
+                            <label><input type="radio" name="q2_action_makes_sense" value="1" required> 1</label>
+                            <label><input type="radio" name="q2_action_makes_sense" value="2" required> 2</label>
+                            <label><input type="radio" name="q2_action_makes_sense" value="3" required> 3</label>
+                            <label><input type="radio" name="q2_action_makes_sense" value="4" required> 4</label>
+                            <label><input type="radio" name="q2_action_makes_sense" value="5" required> 5</label>
+                        </div>
+                    </div>
+                </div>
+                
+                <div class="form-group">
+                    <div class="question-item">
+                        <div class="question-text">This insight is clinically appropriate, safe, patient-friendly and something I would feel comfortable sending to a patient.<span class="required-asterisk">*</span></div>
+                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
+                        <div class="rating-group">
+                            <label><input type="radio" name="q3_clinically_appropriate" value="1" required> 1</label>
+                            <label><input type="radio" name="q3_clinically_appropriate" value="2" required> 2</label>
+                            <label><input type="radio" name="q3_clinically_appropriate" value="3" required> 3</label>
+                            <label><input type="radio" name="q3_clinically_appropriate" value="4" required> 4</label>
+                            <label><input type="radio" name="q3_clinically_appropriate" value="5" required> 5</label>
+                        </div>
+                    </div>
+                </div>
+                
+                <div class="form-group">
+                    <label for="q4_what_worked-{foodlog_id}">What worked well here? (optional)</label>
+                    <textarea id="q4_what_worked-{foodlog_id}" name="q4_what_worked" class="form-textarea" rows="2" placeholder="Short text"></textarea>
+                </div>
+                
+                <div class="form-group">
+                    <label for="q5_what_felt_off-{foodlog_id}">What felt off or risky? (if you rated anything neutral and below, please add more details) (optional)</label>
+                    <textarea id="q5_what_felt_off-{foodlog_id}" name="q5_what_felt_off" class="form-textarea" rows="2" placeholder="Short text"></textarea>
+                </div>
+                
+                <button type="submit" class="submit-btn">Submit</button>
+                <div class="form-status"></div>
+            </form>
+            <div class="review-display" id="review-display-{foodlog_id}">{feedback}</div>
+        </div>
+    """)
+
+
+# Whole cards, one per renderer
+REVIEW_CARD = CARD.embed("review_form", REVIEW_FORM)
+FEEDBACK_CARD = CARD.embed("review_form", FEEDBACK_FORM)
+
+
+@functools.lru_cache(maxsize=1024)
+def escaped_label(label: str) -> str:
+    """Field labels come from column names, so each is escaped once."""
+    return html.escape(label)
+
+
+def image_html(name: str, data_uri: str) -> str:
+    """<img> tag for an inlined image, or the missing-image placeholder if data_uri is empty."""
+    if data_uri:
+        return f'<img src="{data_uri}" alt="{html.escape(name)}" />'
+    return f'<div class="img-missing">缺失：{html.escape(name)}</div>'
+
+
+def field_html(label: str, text: str, escape_html: bool = True) -> str:
+    """A label/value field; newlines become <br/>, and text is escaped unless it is already HTML."""
+    if not text:
+        return ""
+    safe = (html.escape(text) if escape_html else text).replace("\n", "<br/>")
+    return f'<div class="field"><div class="label">{escaped_label(label)}</div><div class="value">{safe}</div></div>'
+
+
+def render_card_html(card: CardTemplate, foodlog_id: str, img_tags: list, fields: list,
+                     feedback_html: str = "") -> str:
+    """The whole card (REVIEW_CARD or FEEDBACK_CARD), with foodlog_id escaped once."""
+    return card.render({
+        "foodlog_id": html.escape(foodlog_id),
+        "images": "".join(img_tags),
+        "fields": "".join(fields),
+        "feedback": feedback_html,
+    })
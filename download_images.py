@@ -1,10 +1,44 @@
 # download_images.py
+import argparse
+import asyncio
+import email.utils
+import json
 import os
 import pathlib
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import httpx
 
+from image_store import (LAYOUTS, VARIANTS, AtomicFileWriter, ContentStore, DerivativeManifest,
+                         atomic_write_bytes, derivatives_available, ensure_layout, find_image, image_path,
+                         make_derivatives, migrate_layout)
+from download_stats import DownloadStats
+from http_clients import DownloadClients
+from metadata_cache import MetadataCache
+from show_foodlog_gallery import GalleryStreamWriter
+
 API_BASE = "https://uc-prod.ihealth-eng.com/v1/uc/food-log"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class IncompleteDownloadError(IOError):
+    """Response body length does not match its Content-Length header."""
+
+class RetryableStatusError(Exception):
+    """Server answered with a status worth retrying (429 or 5xx gateway errors)."""
+
+    def __init__(self, resp: httpx.Response):
+        super().__init__(f"HTTP {resp.status_code} from {resp.url}")
+        self.status_code = resp.status_code
+        self.retry_after = parse_retry_after(resp.headers.get("retry-after"))
+
+# Failures that are retried with backoff; anything else fails the row immediately
+TRANSIENT_ERRORS = (RetryableStatusError, IncompleteDownloadError, httpx.TimeoutException,
+                    httpx.NetworkError, httpx.RemoteProtocolError)
 
 # Generate request headers (only x-session-token needs to be correct)
 def make_headers(session_token: str):
@@ -41,7 +75,12 @@ def extract_links(payload: dict):
         links.append(images)
     return links
 
-def main(csv_path: str, out_dir: str, session_token: str):
+def image_filename(fid: str, i: int, links: list) -> str:
+    # Single image keeps the bare FoodLogId, multiple images get an index suffix
+    ext = guess_ext_from_url(links[i])
+    return f"{fid}_{i}{ext}" if len(links) > 1 else f"{fid}{ext}"
+
+def load_foodlog_csv(csv_path: str):
     csv_file = pathlib.Path(csv_path)
     if not csv_file.exists():
         raise FileNotFoundError(f"CSV file does not exist: {csv_file}")
@@ -51,40 +90,1013 @@ def main(csv_path: str, out_dir: str, session_token: str):
         raise ValueError("CSV must contain FoodLogId column")
     if "ImgName" not in df.columns:
         df["ImgName"] = ""
+    else:
+        # An all-empty ImgName column is read as float64, which rejects file names
+        df["ImgName"] = df["ImgName"].astype(object)
+    return csv_file, df
+
+def iter_foodlog_ids(df):
+    for idx, value in df["FoodLogId"].items():
+        fid = str(value).strip()
+        if not fid or fid.lower() == "nan":
+            continue
+        yield idx, fid
+
+class DownloadJournal:
+    """Append-only JSONL log of completed FoodLogIds and the files saved for them.
+
+    One line per completed food log: {"FoodLogId": ..., "ImgName": [...]}.
+    Lines are flushed as they are written, so a crash loses at most the row in flight.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.entries = {}
+        self._fh = None
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line may be truncated if the previous run was killed
+                        continue
+                    self.entries[entry["FoodLogId"]] = entry["ImgName"]
+
+    def __contains__(self, fid):
+        return fid in self.entries
+
+    def get(self, fid):
+        return self.entries.get(fid)
+
+    def record(self, fid: str, saved_files: list):
+        if self._fh is None:
+            self._fh = self.path.open("a", encoding="utf-8")
+        self._fh.write(json.dumps({"FoodLogId": fid, "ImgName": saved_files}) + "\n")
+        self._fh.flush()
+        self.entries[fid] = saved_files
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+def default_journal_path(csv_file: pathlib.Path, shard: tuple = None) -> pathlib.Path:
+    if shard is not None:
+        index, count = shard
+        return csv_file.with_name(f"{csv_file.name}.shard-{index}-of-{count}.journal.jsonl")
+    return csv_file.with_name(csv_file.name + ".journal.jsonl")
+
+def parse_shard(value: str) -> tuple:
+    """Parse "i/N" (0-based shard i of N) for --shard."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got {value!r}")
+    return index, count
+
+def shard_of(fid: str, count: int) -> int:
+    # crc32 is stable across processes and hosts, unlike the salted built-in hash()
+    return zlib.crc32(fid.encode("utf-8")) % count
 
-    out_path = pathlib.Path(out_dir)
-    out_path.mkdir(parents=True, exist_ok=True)
+def in_shard(fid: str, shard: tuple = None) -> bool:
+    return shard is None or shard_of(fid, shard[1]) == shard[0]
 
-    with httpx.Client(timeout=15) as client:
-        for idx, row in df.iterrows():
-            fid = str(row["FoodLogId"]).strip()
-            if not fid or fid.lower() == "nan":
+def write_csv_checkpoint(df, csv_file: pathlib.Path):
+    # Write to a temp file and rename, so an interrupted checkpoint never corrupts the CSV
+    tmp_file = csv_file.with_name(csv_file.name + ".tmp")
+    df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, csv_file)
+
+def pending_foodlog_ids(df, journal: DownloadJournal, out_path: pathlib.Path, stats: DownloadStats = None,
+                        shard: tuple = None, on_skip=None):
+    """Yield (idx, fid) rows that still need downloading.
+
+    Rows already in the journal get their ImgName restored from it; rows whose
+    ImgName files all exist in out_path are treated as done and skipped (and
+    passed to on_skip(idx), if given). With a shard (i, N), rows belonging to
+    other shards are ignored.
+    """
+    skipped = 0
+    for idx, fid in iter_foodlog_ids(df):
+        if not in_shard(fid, shard):
+            continue
+        if fid in journal:
+            df.at[idx, "ImgName"] = ";".join(journal.get(fid))
+        else:
+            existing = str(df.at[idx, "ImgName"]).strip()
+            names = [x.strip() for x in existing.split(";") if x.strip()] if existing.lower() != "nan" else []
+            if not names or not all(find_image(out_path, name).exists() for name in names):
+                yield idx, fid
                 continue
+        skipped += 1
+        if stats is not None:
+            stats.row_skipped()
+        if on_skip is not None:
+            on_skip(idx)
+    if skipped:
+        print(f"[INFO] Skipped {skipped} already downloaded rows")
+
+class DownloadRun:
+    """State shared by every download mode during one run.
+
+    Holds the output directory, the journal, and the optional content store,
+    metadata cache and derivative builder. record() stores a finished row
+    everywhere it needs to go and checkpoints checkpoint_file (the whole CSV)
+    every `checkpoint_every` rows; chunked runs pass no checkpoint_file since
+    the journal is their checkpoint. A sharded run only handles its shard's
+    rows and leaves the CSV alone; its journal is the shard's result file.
+    With a gallery (show_foodlog_gallery.GalleryStreamWriter), every finished
+    or already downloaded row is rendered as a card as soon as it is known.
+    Timings and counters go to `stats`, whose
+    summary close() prints (and writes to stats_json, if given).
+    """
+
+    def __init__(self, out_dir: str, journal_path, dedupe: bool = False, metadata_cache: str = None,
+                 metadata_ttl: float = 7 * 24 * 3600, derivatives: bool = False,
+                 checkpoint_file: pathlib.Path = None, checkpoint_every: int = 500,
+                 stats_json: str = None, stats_every: float = 10.0, shard: tuple = None,
+                 layout: str = None, gallery: GalleryStreamWriter = None):
+        self.out_path = pathlib.Path(out_dir)
+        self.out_path.mkdir(parents=True, exist_ok=True)
+        if layout:
+            ensure_layout(self.out_path, layout)
+        self.journal = DownloadJournal(journal_path)
+        self.store = ContentStore(self.out_path) if dedupe else None
+        self.cache = MetadataCache(metadata_cache, ttl=metadata_ttl) if metadata_cache else None
+        self.builder = DerivativeBuilder(self.out_path) if derivatives else None
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_every = checkpoint_every
+        self.stats = DownloadStats(report_every=stats_every)
+        self.stats_json = stats_json
+        self.shard = shard
+        self.gallery = gallery
+        self.completed = 0
+
+    def pending(self, df):
+        on_skip = (lambda idx: self.gallery.add(df, idx)) if self.gallery is not None else None
+        return pending_foodlog_ids(df, self.journal, self.out_path, self.stats, self.shard, on_skip=on_skip)
+
+    def record(self, df, idx, fid: str, saved_files: list):
+        df.at[idx, "ImgName"] = ";".join(saved_files)
+        self.journal.record(fid, saved_files)
+        if self.store is not None:
+            self.store.record_foodlog(fid, saved_files)
+        if self.builder is not None:
+            self.builder.submit(saved_files)
+        print(f"[OK] {fid} -> {saved_files}")
+        if self.gallery is not None:
+            self.gallery.add(df, idx)
+        self.completed += 1
+        self.stats.row_done()
+        if self.checkpoint_file and self.checkpoint_every and self.completed % self.checkpoint_every == 0:
+            write_csv_checkpoint(df, self.checkpoint_file)
+
+    def fail(self, fid: str, error: Exception):
+        print(f"[ERROR] {fid}: {error}")
+        self.stats.row_failed(error)
+
+    def unfinished(self, fids: list):
+        """Report rows a batch deadline cut off; they are not journaled, so the next run retries them."""
+        if not fids:
+            return
+        self.stats.rows_left(fids)
+        shown = ", ".join(fids[:10]) + (" ..." if len(fids) > 10 else "")
+        print(f"[WARN] Batch deadline reached, {len(fids)} rows unfinished: {shown}")
+
+    def close(self, extra: dict = None):
+        self.journal.close()
+        extra = dict(extra or {})
+        if self.cache is not None:
+            self.cache.close()
+            print(f"[INFO] {self.cache.summary()}")
+            extra["metadata_cache"] = {"hits": self.cache.hits, "stale": self.cache.stale,
+                                       "revalidated": self.cache.revalidated, "misses": self.cache.misses}
+        if self.builder is not None:
+            self.builder.close()
+        if self.gallery is not None:
+            self.gallery.close()
+        self.stats.report()
+        if self.stats_json:
+            self.stats.write_json(self.stats_json, extra)
+            print(f"[INFO] Stats summary written to {self.stats_json}")
+
+def load_foodlog_frames(csv_path: str, chunksize: int = None, all_columns: bool = False):
+    """Return (csv_file, frames) for the download loop.
+
+    Without chunksize this is the whole CSV as a single frame. With chunksize
+    only the FoodLogId and ImgName columns are read, `chunksize` rows at a time,
+    so the large analysis columns never reach memory (unless all_columns is
+    set, as the streamed gallery needs them for its cards).
+    """
+    if not chunksize:
+        csv_file, df = load_foodlog_csv(csv_path)
+        return csv_file, [df]
+
+    csv_file = pathlib.Path(csv_path)
+    if not csv_file.exists():
+        raise FileNotFoundError(f"CSV file does not exist: {csv_file}")
+    if "FoodLogId" not in pd.read_csv(csv_file, nrows=0).columns:
+        raise ValueError("CSV must contain FoodLogId column")
 
-            url = f"{API_BASE}/{fid}"
+    def chunks():
+        usecols = None if all_columns else (lambda c: c in ("FoodLogId", "ImgName"))
+        reader = pd.read_csv(csv_file, usecols=usecols, dtype=str, keep_default_na=False, chunksize=chunksize)
+        for chunk in reader:
+            if "ImgName" not in chunk.columns:
+                chunk["ImgName"] = ""
+            yield chunk
+    return csv_file, chunks()
+
+def merge_imgnames(csv_file: pathlib.Path, results: dict, chunksize: int, out_file: pathlib.Path = None):
+    """Stream the CSV chunk by chunk, set ImgName for every FoodLogId in results
+    ({FoodLogId: [file names]}), and atomically replace out_file (default: csv_file).
+
+    All columns are read as text, so untouched cells are written back unchanged.
+    """
+    out_file = out_file or csv_file
+    joined = {fid: ";".join(names) for fid, names in results.items()}
+    tmp_file = out_file.with_name(out_file.name + ".tmp")
+    first = True
+    for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunksize):
+        if "ImgName" not in chunk.columns:
+            chunk["ImgName"] = ""
+        merged = chunk["FoodLogId"].str.strip().map(joined)
+        chunk["ImgName"] = merged.fillna(chunk["ImgName"])
+        chunk.to_csv(tmp_file, mode="w" if first else "a", header=first, index=False)
+        first = False
+    os.replace(tmp_file, out_file)
+
+def write_results(csv_file: pathlib.Path, frames, run: DownloadRun, chunksize: int = None):
+    if run.shard is not None:
+        index, count = run.shard
+        print(f"[INFO] Shard {index}/{count} results are in {run.journal.path}; "
+              f"combine them with --merge-shards {count} once every shard has finished")
+        return
+    if chunksize:
+        merge_imgnames(csv_file, run.journal.entries, chunksize)
+    else:
+        write_csv_checkpoint(frames[0], csv_file)
+    print(f"Processing complete, results written back to {csv_file}")
+
+def merge_shards(csv_path: str, shard_count: int, chunksize: int = 50_000):
+    """Combine the journals of shards 0..N-1 into the CSV's ImgName column (streamed in chunks)."""
+    csv_file = pathlib.Path(csv_path)
+    results = {}
+    missing = []
+    for index in range(shard_count):
+        path = default_journal_path(csv_file, (index, shard_count))
+        if not path.exists():
+            missing.append(index)
+            continue
+        results.update(DownloadJournal(path).entries)
+    if len(missing) == shard_count:
+        raise FileNotFoundError(f"No shard journals found next to {csv_file} for --merge-shards {shard_count}")
+    if missing:
+        print(f"[WARN] No results for shard(s) {missing}; their rows keep their current ImgName")
+    merge_imgnames(csv_file, results, chunksize)
+    print(f"[INFO] Merged {len(results)} rows from {shard_count - len(missing)} shard(s) into {csv_file}")
+
+def count_rows(df, shard: tuple = None) -> int:
+    return sum(1 for _, fid in iter_foodlog_ids(df) if in_shard(fid, shard))
+
+def check_content_length(resp: httpx.Response):
+    # num_bytes_downloaded counts raw (still encoded) bytes, same as Content-Length
+    expected = resp.headers.get("content-length")
+    if expected is not None and int(expected) != resp.num_bytes_downloaded:
+        raise IncompleteDownloadError(
+            f"{resp.url}: expected {expected} bytes, got {resp.num_bytes_downloaded}")
+
+def parse_retry_after(value):
+    """Retry-After header as seconds to wait (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def raise_for_retryable_status(resp: httpx.Response):
+    if resp.status_code in RETRY_STATUSES:
+        raise RetryableStatusError(resp)
+
+class RetryPolicy:
+    """Retry transient failures with full-jitter exponential backoff.
+
+    A server-provided Retry-After always wins over the computed backoff.
+    """
+
+    def __init__(self, retries: int = 3, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay_for(self, attempt: int, error: Exception) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, attempt_fn, on_retry=None):
+        for attempt in range(self.retries + 1):
+            try:
+                return attempt_fn()
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(self.delay_for(attempt, e))
+
+class HedgePolicy:
+    """Duplicate an image request that is still pending past the `percentile` of observed
+    image latencies; whichever response arrives first wins and the other is cancelled.
+
+    Hedging starts after min_samples image requests, never fires sooner than
+    min_delay seconds, and at most `budget` (a fraction) of image requests
+    get a duplicate, so a CDN that is slow across the board is not doubled.
+    """
+
+    def __init__(self, percentile: float = 0.95, min_delay: float = 0.05, min_samples: int = 20,
+                 budget: float = 0.1):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget
+
+    def delay(self, stats: DownloadStats):
+        """Seconds to wait before hedging, or None if this request should not be hedged."""
+        observed = stats.stages["image"]
+        if observed.count < self.min_samples or stats.hedges >= self.budget * observed.count:
+            return None
+        return max(self.min_delay, observed.quantile(self.percentile))
+
+class DerivativeBuilder:
+    """Resizes downloaded images in a process pool while the download continues.
+
+    Finished jobs are recorded in the images directory's DerivativeManifest;
+    images already in the manifest (reruns, deduplicated names) are skipped.
+    """
+
+    def __init__(self, out_path: pathlib.Path, workers: int = None):
+        if not derivatives_available():
+            raise RuntimeError("Pillow is required for --derivatives (pip install pillow)")
+        self.out_path = out_path
+        self.manifest = DerivativeManifest(out_path)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self._pending = {}
+
+    def submit(self, names: list):
+        for name in names:
+            if name in self.manifest or name in self._pending:
+                continue
+            self._pending[name] = self.pool.submit(make_derivatives, str(self.out_path), name)
+        self.drain()
+
+    def drain(self, wait: bool = False):
+        for name, future in list(self._pending.items()):
+            if not wait and not future.done():
+                continue
+            del self._pending[name]
             try:
-                resp = client.get(url, headers=make_headers(session_token))
-                resp.raise_for_status()
-                payload = resp.json()
-                links = extract_links(payload)
-
-                saved_files = []
-                for i, link in enumerate(links):
-                    img_resp = client.get(link)
-                    if img_resp.status_code == 200:
-                        ext = guess_ext_from_url(link)
-                        fname = f"{fid}_{i}{ext}" if len(links) > 1 else f"{fid}{ext}"
-                        fpath = out_path / fname
-                        fpath.write_bytes(img_resp.content)
-                        saved_files.append(fname)
-
-                df.at[idx, "ImgName"] = ";".join(saved_files)
-                print(f"[OK] {fid} -> {saved_files}")
+                self.manifest.record(name, future.result())
             except Exception as e:
-                print(f"[ERROR] {fid}: {e}")
+                print(f"[WARN] derivatives for {name}: {e}")
 
-    df.to_csv(csv_file, index=False)
-    print(f"Processing complete, results written back to {csv_file}")
+    def close(self):
+        self.drain(wait=True)
+        self.pool.shutdown()
+
+def save_image(out_path: pathlib.Path, store: ContentStore, fid: str, i: int, links: list, content: bytes) -> str:
+    # With a content store the file is named by its hash, otherwise by FoodLogId
+    if store is not None:
+        return store.put(content, guess_ext_from_url(links[i]), url=links[i])
+    fname = image_filename(fid, i, links)
+    atomic_write_bytes(image_path(out_path, fname), content)
+    return fname
+
+def commit_streamed_image(writer: AtomicFileWriter, resp: httpx.Response, started: float, stats: DownloadStats,
+                          out_path: pathlib.Path, store: ContentStore, fid: str, i: int, links: list) -> str:
+    # Chunk writes are interleaved with the transfer: they count as disk time, the rest as image time
+    stats.add_time("image", time.perf_counter() - started - writer.write_seconds)
+    stats.add_image(resp.num_bytes_downloaded)
+    commit_started = time.perf_counter()
+    if store is not None:
+        fname = store.commit(writer, guess_ext_from_url(links[i]), url=links[i])
+    else:
+        fname = image_filename(fid, i, links)
+        writer.commit(image_path(out_path, fname))
+    stats.add_time("write", writer.write_seconds + time.perf_counter() - commit_started)
+    return fname
+
+def metadata_request_headers(cache: MetadataCache = None, entry=None):
+    # Session headers are set once on the API client; only revalidation headers vary per request
+    if entry is None:
+        return None
+    return cache.conditional_headers(entry)
+
+def handle_metadata_response(resp: httpx.Response, fid: str, cache: MetadataCache = None, entry=None) -> dict:
+    if resp.status_code == 304 and entry is not None:
+        cache.touch(fid)
+        return entry.payload
+    raise_for_retryable_status(resp)
+    resp.raise_for_status()
+    payload = resp.json()
+    if cache is not None:
+        cache.put(fid, resp.text, resp.headers.get("etag"), resp.headers.get("last-modified"))
+    return payload
+
+def fetch_metadata(client: httpx.Client, stats: DownloadStats, fid: str,
+                   cache: MetadataCache = None, entry=None) -> dict:
+    headers = metadata_request_headers(cache, entry)
+    with stats.timer("metadata"):
+        resp = client.get(f"{API_BASE}/{fid}", headers=headers)
+    return handle_metadata_response(resp, fid, cache, entry)
+
+def cached_metadata(cache: MetadataCache, fid: str):
+    """(payload, None) for a fresh cache hit, (None, entry) for a stale entry worth
+    revalidating, (None, None) when the API has to be asked."""
+    if cache is None:
+        return None, None
+    entry = cache.lookup(fid)
+    if entry is not None and cache.is_fresh(entry):
+        return entry.payload, None
+    return None, entry
+
+def fetch_image(client: httpx.Client, stats: DownloadStats, out_path: pathlib.Path, store: ContentStore,
+                fid: str, i: int, links: list, stream: bool = False):
+    """Download links[i] and save it; returns the saved file name, or None on non-200.
+
+    In stream mode the body is written chunk by chunk to a temp file and only
+    renamed into place once complete, so memory stays flat for large images.
+    """
+    if not stream:
+        with stats.timer("image"):
+            img_resp = client.get(links[i])
+        raise_for_retryable_status(img_resp)
+        if img_resp.status_code != 200:
+            return None
+        check_content_length(img_resp)
+        stats.add_image(img_resp.num_bytes_downloaded)
+        with stats.timer("write"):
+            return save_image(out_path, store, fid, i, links, img_resp.content)
+
+    started = time.perf_counter()
+    with client.stream("GET", links[i]) as img_resp:
+        raise_for_retryable_status(img_resp)
+        if img_resp.status_code != 200:
+            return None
+        with AtomicFileWriter(out_path) as writer:
+            for chunk in img_resp.iter_bytes(STREAM_CHUNK_SIZE):
+                writer.write(chunk)
+            check_content_length(img_resp)
+            return commit_streamed_image(writer, img_resp, started, stats, out_path, store, fid, i, links)
+
+def download_foodlog(clients: DownloadClients, run: DownloadRun, fid: str,
+                     retry: RetryPolicy, stream: bool = False) -> list:
+    payload, entry = cached_metadata(run.cache, fid)
+    if payload is None:
+        payload = retry.call(lambda: fetch_metadata(clients.api, run.stats, fid, run.cache, entry),
+                             on_retry=run.stats.retry)
+    links = extract_links(payload)
+
+    saved_files = []
+    for i, link in enumerate(links):
+        known = run.store.lookup_url(link) if run.store is not None else None
+        if known:
+            saved_files.append(known)
+            continue
+        fname = retry.call(lambda: fetch_image(clients.cdn, run.stats, run.out_path, run.store, fid, i, links,
+                                               stream=stream), on_retry=run.stats.retry)
+        if fname:
+            saved_files.append(fname)
+    return saved_files
+
+def download_frame(df, clients: DownloadClients, run: DownloadRun,
+                   retry: RetryPolicy, stream: bool = False, deadline: float = None):
+    # A request in flight cannot be interrupted here, so the deadline is checked between rows
+    ends_at = time.monotonic() + deadline if deadline else None
+    rows = run.pending(df)
+    for idx, fid in rows:
+        if ends_at is not None and time.monotonic() >= ends_at:
+            run.unfinished([fid] + [rest for _, rest in rows])
+            return
+        try:
+            saved_files = download_foodlog(clients, run, fid, retry, stream=stream)
+            run.record(df, idx, fid, saved_files)
+        except Exception as e:
+            run.fail(fid, e)
+
+def main(csv_path: str, out_dir: str, session_token: str,
+         journal_path: str = None, checkpoint_every: int = 500, dedupe: bool = False,
+         stream: bool = False, retries: int = 3, metadata_cache: str = None,
+         metadata_ttl: float = 7 * 24 * 3600, derivatives: bool = False, chunksize: int = None,
+         stats_json: str = None, stats_every: float = 10.0, shard: tuple = None,
+         http2: bool = False, keepalive_expiry: float = 30.0, batch_deadline: float = None,
+         layout: str = None, gallery: GalleryStreamWriter = None):
+    """Download every pending row one request at a time.
+
+    batch_deadline (seconds) bounds each batch (the whole CSV, or each chunk
+    with chunksize); rows not reached in time are reported as unfinished.
+    layout ("flat" or "nested") is set on a new images directory; existing
+    directories keep theirs (see image_store.migrate_layout). gallery renders
+    each row's card as soon as its images are saved.
+    """
+    csv_file, frames = load_foodlog_frames(csv_path, chunksize, all_columns=gallery is not None)
+    run = DownloadRun(out_dir, journal_path or default_journal_path(csv_file, shard), dedupe=dedupe,
+                      metadata_cache=metadata_cache, metadata_ttl=metadata_ttl, derivatives=derivatives,
+                      checkpoint_file=None if chunksize or shard else csv_file, checkpoint_every=checkpoint_every,
+                      stats_json=stats_json, stats_every=stats_every, shard=shard, layout=layout,
+                      gallery=gallery)
+    if not chunksize:
+        run.stats.total_rows = count_rows(frames[0], shard)
+    retry = RetryPolicy(retries)
+
+    clients = DownloadClients(make_headers(session_token), http2=http2, api_connections=1, cdn_connections=1,
+                              keepalive_expiry=keepalive_expiry)
+    with clients:
+        for df in frames:
+            download_frame(df, clients, run, retry, stream=stream, deadline=batch_deadline)
+
+    write_results(csv_file, frames, run, chunksize)
+    clients.report()
+    run.close(extra={"connections": clients.summary()})
+
+class ConcurrencyLimiter:
+    """Caps the number of in-flight requests at a fixed limit.
+
+    release() reports each request's latency and whether the server signalled
+    overload; the fixed limiter ignores that, AdaptiveLimiter acts on it.
+    defer() pauses new requests, e.g. until a Retry-After has passed.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.inflight = 0
+        self._cond = asyncio.Condition()
+        self._resume_at = 0.0
+
+    def _has_slot(self) -> bool:
+        return self.inflight < max(1, int(self.limit))
+
+    async def acquire(self):
+        while True:
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            async with self._cond:
+                await self._cond.wait_for(self._has_slot)
+                if self._resume_at > time.monotonic():
+                    continue
+                self.inflight += 1
+                return
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now (no waiting); True if taken."""
+        if self._resume_at > time.monotonic() or not self._has_slot():
+            return False
+        self.inflight += 1
+        return True
+
+    async def release(self, latency: float, overloaded: bool = False):
+        async with self._cond:
+            self.inflight -= 1
+            self.on_sample(latency, overloaded)
+            self._cond.notify_all()
+
+    def defer(self, delay: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def on_sample(self, latency: float, overloaded: bool):
+        pass
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    """AIMD concurrency limit driven by observed latency and overload signals.
+
+    Every healthy response adds increase/limit (about +increase per window of
+    `limit` requests); a 429/5xx/timeout, or a smoothed latency above
+    target_latency, multiplies the limit by `decrease`, at most once per
+    cooldown so one burst of failures does not collapse it to the minimum.
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 64, target_latency: float = 2.0,
+                 increase: float = 1.0, decrease: float = 0.5, cooldown: float = 1.0):
+        super().__init__(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.peak_limit = self.limit
+        self._latency_ewma = None
+        self._last_decrease = 0.0
+
+    def on_sample(self, latency: float, overloaded: bool):
+        now = time.monotonic()
+        if not overloaded:
+            if self._latency_ewma is None:
+                self._latency_ewma = latency
+            else:
+                self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+        if overloaded or self._latency_ewma > self.target_latency:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+class AsyncDownloader:
+    """Downloads food logs over the async API and CDN clients of a DownloadClients.
+
+    Every request (metadata and images) takes a slot from `limiter` and is
+    retried per `retry`; overload signals feed back into the limiter.
+    """
+
+    def __init__(self, clients: DownloadClients, run: DownloadRun,
+                 limiter: ConcurrencyLimiter, retry: RetryPolicy, stream: bool = False,
+                 hedge: HedgePolicy = None):
+        self.api = clients.api
+        self.cdn = clients.cdn
+        self.out_path = run.out_path
+        self.store = run.store
+        self.cache = run.cache
+        self.stats = run.stats
+        self.limiter = limiter
+        self.retry = retry
+        self.stream = stream
+        self.hedge = hedge
+        self._inflight = {}
+
+    async def _call(self, attempt_fn):
+        for attempt in range(self.retry.retries + 1):
+            await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = await attempt_fn()
+            except TRANSIENT_ERRORS as e:
+                await self.limiter.release(time.monotonic() - started, overloaded=True)
+                if attempt == self.retry.retries:
+                    raise
+                self.stats.retry(e)
+                delay = self.retry.delay_for(attempt, e)
+                if getattr(e, "retry_after", None) is not None:
+                    # The server asked everyone to back off, not just this request
+                    self.limiter.defer(delay)
+                await asyncio.sleep(delay)
+            except BaseException:
+                await self.limiter.release(time.monotonic() - started)
+                raise
+            else:
+                await self.limiter.release(time.monotonic() - started)
+                return result
+
+    async def _hedged(self, attempt_fn):
+        """Run attempt_fn, starting a duplicate if it outlasts the hedge delay; first success wins."""
+        delay = self.hedge.delay(self.stats) if self.hedge is not None else None
+        if delay is None:
+            return await attempt_fn()
+        tasks = [asyncio.ensure_future(attempt_fn())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # The duplicate needs a limiter slot of its own; skip it while the limiter is full
+            if not done and self.limiter.try_acquire():
+                self.stats.hedges += 1
+                tasks.append(asyncio.ensure_future(self._hedge_attempt(attempt_fn)))
+                # Let it start before anything can cancel it, so its finally always gives the slot back
+                await asyncio.sleep(0)
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    if winners[0] is not tasks[0]:
+                        self.stats.hedge_wins += 1
+                    return winners[0].result()
+                if not pending:
+                    # Every attempt failed: surface one of the errors to the retry loop
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _hedge_attempt(self, attempt_fn):
+        """A hedged duplicate: runs in the slot _hedged took for it and releases it with its own latency."""
+        started = time.monotonic()
+        overloaded = False
+        try:
+            return await attempt_fn()
+        except TRANSIENT_ERRORS:
+            overloaded = True
+            raise
+        finally:
+            await self.limiter.release(time.monotonic() - started, overloaded=overloaded)
+
+    async def _fetch_metadata_once(self, fid: str, entry=None) -> dict:
+        headers = metadata_request_headers(self.cache, entry)
+        with self.stats.timer("metadata"):
+            resp = await self.api.get(f"{API_BASE}/{fid}", headers=headers)
+        return handle_metadata_response(resp, fid, self.cache, entry)
+
+    async def fetch_metadata(self, fid: str) -> dict:
+        payload, entry = cached_metadata(self.cache, fid)
+        if payload is not None:
+            return payload
+        return await self._call(lambda: self._fetch_metadata_once(fid, entry))
+
+    async def _fetch_bytes_once(self, link: str):
+        with self.stats.timer("image"):
+            img_resp = await self.cdn.get(link)
+        raise_for_retryable_status(img_resp)
+        if img_resp.status_code != 200:
+            return None
+        check_content_length(img_resp)
+        self.stats.add_image(img_resp.num_bytes_downloaded)
+        return img_resp.content
+
+    async def fetch_image_bytes(self, link: str):
+        """Image body for link (retried), or None on a non-200 response; nothing is written."""
+        return await self._call(lambda: self._hedged(lambda: self._fetch_bytes_once(link)))
+
+    async def _fetch_image_once(self, fid: str, i: int, links: list):
+        if not self.stream:
+            content = await self._fetch_bytes_once(links[i])
+            if content is None:
+                return None
+            with self.stats.timer("write"):
+                return save_image(self.out_path, self.store, fid, i, links, content)
+
+        started = time.perf_counter()
+        async with self.cdn.stream("GET", links[i]) as img_resp:
+            raise_for_retryable_status(img_resp)
+            if img_resp.status_code != 200:
+                return None
+            with AtomicFileWriter(self.out_path) as writer:
+                async for chunk in img_resp.aiter_bytes(STREAM_CHUNK_SIZE):
+                    writer.write(chunk)
+                check_content_length(img_resp)
+                return commit_streamed_image(writer, img_resp, started, self.stats,
+                                             self.out_path, self.store, fid, i, links)
+
+    async def fetch_image(self, fid: str, i: int, links: list):
+        if self.store is None:
+            return await self._call(lambda: self._hedged(lambda: self._fetch_image_once(fid, i, links)))
+
+        # Concurrent food logs referencing the same URL share a single request
+        link = links[i]
+        known = self.store.lookup_url(link)
+        if known:
+            return known
+        task = self._inflight.get(link)
+        if task is None:
+            task = self._inflight[link] = asyncio.ensure_future(
+                self._call(lambda: self._hedged(lambda: self._fetch_image_once(fid, i, links))))
+            task.add_done_callback(lambda _: self._inflight.pop(link, None))
+        return await task
+
+    async def download_foodlog(self, fid: str) -> list:
+        payload = await self.fetch_metadata(fid)
+        links = extract_links(payload)
+
+        # Images of one food log are fetched in parallel, but saved in link order
+        # so ImgName matches the sequential mode exactly
+        names = await asyncio.gather(*(self.fetch_image(fid, i, links) for i in range(len(links))))
+        return [name for name in names if name]
+
+class PipelineRow:
+    """A food log moving through DownloadPipeline; names[i] is filled in as links[i] is saved."""
+
+    __slots__ = ("idx", "fid", "links", "names", "remaining", "failed")
+
+    def __init__(self, idx, fid: str):
+        self.idx = idx
+        self.fid = fid
+        self.links = []
+        self.names = []
+        self.remaining = 0
+        self.failed = False
+
+class DownloadPipeline:
+    """Download rows through bounded-queue stages: resolve links -> fetch bytes -> persist -> record.
+
+    Each stage has its own worker count, and the bounded queues between them
+    apply backpressure: a slow disk holds at most `queue_size` image bodies in
+    memory while metadata and image requests keep flowing, and a slow CDN
+    does not stop links from being resolved ahead. Disk writes run in worker
+    threads so the event loop stays on the network; journal/CSV bookkeeping
+    runs in a single record stage.
+    """
+
+    def __init__(self, downloader: AsyncDownloader, run: DownloadRun, resolve_workers: int = 8,
+                 fetch_workers: int = 16, persist_workers: int = 4, queue_size: int = 64):
+        self.downloader = downloader
+        self.run = run
+        self.resolve_workers = resolve_workers
+        self.fetch_workers = fetch_workers
+        self.persist_workers = persist_workers
+        self.queue_size = queue_size
+
+    async def process(self, df, deadline: float = None):
+        """Run every pending row of df through the stages; with a deadline (seconds),
+        rows not finished in time are cancelled and reported as unfinished."""
+        active = set()
+        rows = asyncio.Queue(self.queue_size)
+        fetches = asyncio.Queue(self.queue_size)
+        writes = asyncio.Queue(self.queue_size)
+        finished = asyncio.Queue(self.queue_size)
+
+        def fail(row: PipelineRow, error: Exception):
+            if not row.failed:
+                row.failed = True
+                active.discard(row)
+                self.run.fail(row.fid, error)
+
+        async def image_done(row: PipelineRow, i: int, name):
+            row.names[i] = name
+            row.remaining -= 1
+            if row.remaining == 0 and not row.failed:
+                await finished.put(row)
+
+        async def resolve():
+            while True:
+                row = await rows.get()
+                try:
+                    payload = await self.downloader.fetch_metadata(row.fid)
+                    row.links = extract_links(payload)
+                    row.names = [None] * len(row.links)
+                    row.remaining = len(row.links)
+                    if not row.links:
+                        await finished.put(row)
+                    store = self.run.store
+                    for i, link in enumerate(row.links):
+                        known = store.lookup_url(link) if store is not None else None
+                        if known:
+                            await image_done(row, i, known)
+                        else:
+                            await fetches.put((row, i))
+                except Exception as e:
+                    fail(row, e)
+                finally:
+                    rows.task_done()
+
+        async def fetch():
+            while True:
+                row, i = await fetches.get()
+                try:
+                    if not row.failed:
+                        content = await self.downloader.fetch_image_bytes(row.links[i])
+                        if content is None:
+                            await image_done(row, i, None)
+                        else:
+                            await writes.put((row, i, content))
+                except Exception as e:
+                    fail(row, e)
+                finally:
+                    fetches.task_done()
+
+        async def persist():
+            while True:
+                row, i, content = await writes.get()
+                try:
+                    if not row.failed:
+                        started = time.perf_counter()
+                        name = await asyncio.to_thread(save_image, self.run.out_path, self.run.store,
+                                                       row.fid, i, row.links, content)
+                        self.run.stats.add_time("write", time.perf_counter() - started)
+                        await image_done(row, i, name)
+                except Exception as e:
+                    fail(row, e)
+                finally:
+                    writes.task_done()
+
+        async def record():
+            while True:
+                row = await finished.get()
+                try:
+                    self.run.record(df, row.idx, row.fid, [name for name in row.names if name])
+                    active.discard(row)
+                except Exception as e:
+                    fail(row, e)
+                finally:
+                    finished.task_done()
+
+        workers = ([asyncio.create_task(resolve()) for _ in range(self.resolve_workers)]
+                   + [asyncio.create_task(fetch()) for _ in range(self.fetch_workers)]
+                   + [asyncio.create_task(persist()) for _ in range(self.persist_workers)]
+                   + [asyncio.create_task(record())])
+        pending = self.run.pending(df)
+
+        async def feed_and_drain():
+            for idx, fid in pending:
+                row = PipelineRow(idx, fid)
+                active.add(row)
+                await rows.put(row)
+            # Each stage only feeds later ones, so draining them in order drains the pipeline
+            for queue in (rows, fetches, writes, finished):
+                await queue.join()
+
+        try:
+            await asyncio.wait_for(feed_and_drain(), timeout=deadline)
+        except asyncio.TimeoutError:
+            self.run.unfinished([row.fid for row in active] + [fid for _, fid in pending])
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+async def download_frame_async(df, downloader: AsyncDownloader, run: DownloadRun, deadline: float = None):
+    async def process(idx, fid):
+        try:
+            saved_files = await downloader.download_foodlog(fid)
+            run.record(df, idx, fid, saved_files)
+        except Exception as e:
+            run.fail(fid, e)
+
+    tasks = {asyncio.ensure_future(process(idx, fid)): fid for idx, fid in run.pending(df)}
+    if not tasks:
+        return
+    _, unfinished = await asyncio.wait(tasks, timeout=deadline)
+    if unfinished:
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+        run.unfinished([tasks[task] for task in unfinished])
+
+async def main_async(csv_path: str, out_dir: str, session_token: str, concurrency: int = 16,
+                     journal_path: str = None, checkpoint_every: int = 500, dedupe: bool = False,
+                     stream: bool = False, retries: int = 3, adaptive: bool = False,
+                     max_concurrency: int = 64, target_latency: float = 2.0,
+                     metadata_cache: str = None, metadata_ttl: float = 7 * 24 * 3600,
+                     derivatives: bool = False, chunksize: int = None,
+                     stats_json: str = None, stats_every: float = 10.0, shard: tuple = None,
+                     pipeline: bool = False, resolve_workers: int = 8, fetch_workers: int = 16,
+                     persist_workers: int = 4, queue_size: int = 64, http2: bool = False,
+                     api_connections: int = None, cdn_connections: int = None, keepalive_expiry: float = 30.0,
+                     hedge: HedgePolicy = None, batch_deadline: float = None, layout: str = None,
+                     gallery: GalleryStreamWriter = None):
+    """Concurrent variant of main(): every HTTP request (metadata and images) shares
+    one global limit of `concurrency` in-flight requests.
+
+    With adaptive=True, `concurrency` is only the starting point and an AIMD
+    controller moves the limit between 1 and `max_concurrency`. With
+    pipeline=True rows go through DownloadPipeline's staged workers instead of
+    one task per row (image bodies are buffered there, so stream is ignored).
+
+    API and CDN requests use separate connection pools of api_connections /
+    cdn_connections (default: the request limit) kept alive for
+    keepalive_expiry seconds, over HTTP/2 if http2=True and h2 is installed.
+
+    hedge duplicates slow image requests (see HedgePolicy). batch_deadline
+    (seconds) bounds each batch; rows still running are cancelled and
+    reported as unfinished instead of holding up the run. gallery renders
+    each row's card as soon as it is recorded (on the event loop, so very
+    large images slow the downloads a little).
+    """
+    csv_file, frames = load_foodlog_frames(csv_path, chunksize, all_columns=gallery is not None)
+    run = DownloadRun(out_dir, journal_path or default_journal_path(csv_file, shard), dedupe=dedupe,
+                      metadata_cache=metadata_cache, metadata_ttl=metadata_ttl, derivatives=derivatives,
+                      checkpoint_file=None if chunksize or shard else csv_file, checkpoint_every=checkpoint_every,
+                      stats_json=stats_json, stats_every=stats_every, shard=shard, layout=layout,
+                      gallery=gallery)
+    if not chunksize:
+        run.stats.total_rows = count_rows(frames[0], shard)
+
+    if adaptive:
+        limiter = AdaptiveLimiter(concurrency, max_limit=max_concurrency, target_latency=target_latency)
+    else:
+        limiter = ConcurrencyLimiter(concurrency)
+    request_limit = max(1, max_concurrency if adaptive else concurrency)
+    clients = DownloadClients(make_headers(session_token), asynchronous=True, http2=http2,
+                              api_connections=api_connections or request_limit,
+                              cdn_connections=cdn_connections or request_limit,
+                              keepalive_expiry=keepalive_expiry)
+    async with clients:
+        downloader = AsyncDownloader(clients, run, limiter, RetryPolicy(retries), stream=stream, hedge=hedge)
+        if pipeline:
+            if stream:
+                print("[WARN] --stream is ignored in pipeline mode: bodies are handed from the fetch to the persist stage")
+            stages = DownloadPipeline(downloader, run, resolve_workers=resolve_workers, fetch_workers=fetch_workers,
+                                      persist_workers=persist_workers, queue_size=queue_size)
+        for df in frames:
+            if pipeline:
+                await stages.process(df, deadline=batch_deadline)
+            else:
+                await download_frame_async(df, downloader, run, deadline=batch_deadline)
+
+    write_results(csv_file, frames, run, chunksize)
+    clients.report()
+    run.close(extra={"connections": clients.summary()})
+    if adaptive:
+        print(f"[INFO] Adaptive concurrency ended at {limiter.limit:.1f} (peak {limiter.peak_limit:.1f})")
 
 if __name__ == "__main__":
     # Use environment variable SESSION_TOKEN, or you can directly hardcode the string
@@ -96,9 +1108,134 @@ if __name__ == "__main__":
     if not token:
         raise RuntimeError("Please set SESSION_TOKEN environment variable first, or modify the code to directly enter the token")
 
-    # Modify to your CSV path
+    # Modify to your CSV path (or pass --csv)
     # csv_path = "foodlog_ai_analysis_img_name.csv"
     csv_path = "foodlog_ai_analysis_v3.csv"
     out_dir = "./images"
 
-    main(csv_path, out_dir, token)
+    parser = argparse.ArgumentParser(description="Download FoodLog images and write ImgName back to the CSV")
+    parser.add_argument("--csv", default=csv_path, help=f"CSV file with FoodLogId column (default: {csv_path})")
+    parser.add_argument("--out", default=out_dir, help=f"Images output directory (default: {out_dir})")
+    parser.add_argument("--mode", choices=["sequential", "async", "pipeline"], default="sequential",
+                        help="sequential: one request at a time; async: concurrent downloads with httpx.AsyncClient; "
+                             "pipeline: async with separate resolve/fetch/persist/record stages and bounded queues")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="Global limit of in-flight requests in async mode (default: 16)")
+    parser.add_argument("--resolve-workers", type=int, default=8,
+                        help="Pipeline mode: workers fetching food-log metadata (default: 8)")
+    parser.add_argument("--fetch-workers", type=int, default=16,
+                        help="Pipeline mode: workers downloading image bytes (default: 16)")
+    parser.add_argument("--persist-workers", type=int, default=4,
+                        help="Pipeline mode: threads writing images to disk (default: 4)")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="Pipeline mode: capacity of each queue between stages (default: 64)")
+    parser.add_argument("--journal", default=None,
+                        help="Download journal path used to resume interrupted runs (default: <csv>.journal.jsonl)")
+    parser.add_argument("--checkpoint-every", type=int, default=500,
+                        help="Write ImgName back to the CSV every N completed rows, 0 to disable (default: 500)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Store images content-addressed as <sha256><ext>: identical images are saved and fetched once")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream image bodies to disk in chunks instead of buffering each response in memory")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Retries for 429/5xx/timeouts with jittered backoff, honouring Retry-After (default: 3)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Async mode: adjust concurrency with an AIMD controller, starting from --concurrency")
+    parser.add_argument("--max-concurrency", type=int, default=64,
+                        help="Upper bound for --adaptive (default: 64)")
+    parser.add_argument("--target-latency", type=float, default=2.0,
+                        help="Smoothed request latency in seconds above which --adaptive backs off (default: 2.0)")
+    parser.add_argument("--metadata-cache", default=None,
+                        help="SQLite file caching food-log API payloads across runs, e.g. foodlog_metadata.sqlite")
+    parser.add_argument("--metadata-ttl", type=float, default=168,
+                        help="Hours a cached payload is used without revalidation (default: 168)")
+    parser.add_argument("--derivatives", action="store_true",
+                        help="Also write thumb/medium JPEG variants (needs Pillow) for the gallery's --variant option")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="Read only FoodLogId/ImgName, N rows at a time, and merge ImgName back chunk by chunk "
+                             "(for exports too large for memory; 0 loads the whole CSV)")
+    parser.add_argument("--api-base", default=API_BASE,
+                        help="Food-log API base URL, e.g. a local mock_foodlog_api.py (default: prod)")
+    parser.add_argument("--stats-json", default=None,
+                        help="Write a JSON summary (stage latencies p50/p95/p99, bytes/s, errors by class) to this file")
+    parser.add_argument("--stats-every", type=float, default=10.0,
+                        help="Seconds between [STATS] progress lines with rows/s and ETA (0 disables them)")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="Only download rows whose FoodLogId hashes to shard i of N (0-based), writing results "
+                             "to <csv>.shard-i-of-N.journal.jsonl instead of the CSV; shards can run on several "
+                             "processes or hosts sharing --out")
+    parser.add_argument("--merge-shards", type=int, default=None, metavar="N",
+                        help="Write ImgName from the N shard journals into the CSV and exit")
+    parser.add_argument("--http2", action="store_true",
+                        help="Use HTTP/2 (multiplexed requests over one connection per host; needs httpx[http2])")
+    parser.add_argument("--api-connections", type=int, default=None,
+                        help="Async modes: connection pool size for the food-log API (default: request limit)")
+    parser.add_argument("--cdn-connections", type=int, default=None,
+                        help="Async modes: connection pool size for the image CDN (default: request limit)")
+    parser.add_argument("--keepalive-expiry", type=float, default=30.0,
+                        help="Seconds an idle pooled connection is kept open for reuse (default: 30)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Async modes: send a duplicate image request when one is slower than the observed "
+                             "--hedge-percentile latency, and keep the first response")
+    parser.add_argument("--hedge-percentile", type=float, default=0.95,
+                        help="Latency percentile after which an image request is hedged (default: 0.95)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1,
+                        help="Max fraction of image requests that may be duplicated (default: 0.1)")
+    parser.add_argument("--batch-deadline", type=float, default=None,
+                        help="Seconds allowed per batch (whole CSV, or each --chunksize chunk); unfinished rows "
+                             "are reported and left for the next run")
+    parser.add_argument("--layout", choices=LAYOUTS, default=None,
+                        help="Image directory layout for a new --out: flat (<name>) or nested (ab/cd/<name>, for "
+                             "hundreds of thousands of files); existing directories keep their layout")
+    parser.add_argument("--migrate-layout", choices=LAYOUTS, default=None,
+                        help="Move the images in --out to this layout and exit (safe to rerun if interrupted)")
+    parser.add_argument("--gallery-out", default=None,
+                        help="Also render each row's gallery card as soon as its images are saved, appending to this "
+                             "HTML file (cards in completion order; replaces running show_foodlog_gallery.py afterwards)")
+    parser.add_argument("--gallery-title", default="FoodLog Gallery", help="Title of the --gallery-out page")
+    parser.add_argument("--gallery-variant", choices=VARIANTS, default="original",
+                        help="Image size embedded in --gallery-out cards (medium/thumb need --derivatives and fall "
+                             "back to the original while a variant is still being built)")
+    parser.add_argument("--gallery-page-size", type=int, default=0,
+                        help="Split --gallery-out into <name>-0001.html, ... of N cards each, every page complete "
+                             "once full (default: 0, one file)")
+    args = parser.parse_args()
+    API_BASE = args.api_base.rstrip("/")
+
+    hedge = HedgePolicy(args.hedge_percentile, budget=args.hedge_budget) if args.hedge else None
+    if hedge is not None and args.mode == "sequential":
+        print("[WARN] --hedge needs --mode async or pipeline; ignored in sequential mode")
+
+    gallery = None
+    if args.gallery_out and not (args.migrate_layout or args.merge_shards):
+        gallery = GalleryStreamWriter(args.gallery_out, args.out, title=args.gallery_title,
+                                      variant=args.gallery_variant, page_size=args.gallery_page_size)
+
+    if args.migrate_layout:
+        moved = migrate_layout(args.out, args.migrate_layout)
+        print(f"[INFO] Moved {moved} images in {args.out} to the {args.migrate_layout} layout")
+    elif args.merge_shards:
+        merge_shards(args.csv, args.merge_shards, chunksize=args.chunksize or 50_000)
+    elif args.mode in ("async", "pipeline"):
+        asyncio.run(main_async(args.csv, args.out, token, concurrency=args.concurrency,
+                               journal_path=args.journal, checkpoint_every=args.checkpoint_every,
+                               dedupe=args.dedupe, stream=args.stream, retries=args.retries,
+                               adaptive=args.adaptive, max_concurrency=args.max_concurrency,
+                               target_latency=args.target_latency, metadata_cache=args.metadata_cache,
+                               metadata_ttl=args.metadata_ttl * 3600, derivatives=args.derivatives,
+                               chunksize=args.chunksize, stats_json=args.stats_json,
+                               stats_every=args.stats_every, shard=args.shard,
+                               pipeline=args.mode == "pipeline", resolve_workers=args.resolve_workers,
+                               fetch_workers=args.fetch_workers, persist_workers=args.persist_workers,
+                               queue_size=args.queue_size, http2=args.http2,
+                               api_connections=args.api_connections, cdn_connections=args.cdn_connections,
+                               keepalive_expiry=args.keepalive_expiry, hedge=hedge,
+                               batch_deadline=args.batch_deadline, layout=args.layout, gallery=gallery))
+    else:
+        main(args.csv, args.out, token, journal_path=args.journal, checkpoint_every=args.checkpoint_every,
+             dedupe=args.dedupe, stream=args.stream, retries=args.retries,
+             metadata_cache=args.metadata_cache, metadata_ttl=args.metadata_ttl * 3600,
+             derivatives=args.derivatives, chunksize=args.chunksize,
+             stats_json=args.stats_json, stats_every=args.stats_every, shard=args.shard,
+             http2=args.http2, keepalive_expiry=args.keepalive_expiry, batch_deadline=args.batch_deadline,
+             layout=args.layout, gallery=gallery)
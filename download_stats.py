@@ -0,0 +1,212 @@
+# download_stats.py
+"""
+Throughput and latency instrumentation for download_images.
+
+DownloadStats times every metadata request, image transfer and disk write
+into log-bucketed histograms (constant memory however long the run), and
+reports:
+- rows/s, MB/s and an ETA as a periodic [STATS] progress line
+- p50/p95/p99 latency per stage, to tell whether the API, the image CDN or
+  the local disk is the bottleneck
+- errors by exception class, for failed rows and for retried attempts
+- hedged image requests and rows left unfinished by a batch deadline
+- a machine-readable JSON summary (write_json) for comparing runs
+"""
+import collections
+import contextlib
+import json
+import math
+import time
+
+STAGES = ("metadata", "image", "write")
+
+
+class LatencyHistogram:
+    """Latency histogram with geometric buckets (2% wide) from 0.1 ms upwards."""
+
+    GROWTH = 1.02
+    MIN_SECONDS = 1e-4
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if seconds <= self.MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = 1 + int(math.log(seconds / self.MIN_SECONDS, self.GROWTH))
+        self.buckets[bucket] += 1
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the q-quantile, or None if empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** bucket)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 3),
+            "mean_s": round(self.total / self.count, 4) if self.count else None,
+            "p50_s": _round(self.quantile(0.50)),
+            "p95_s": _round(self.quantile(0.95)),
+            "p99_s": _round(self.quantile(0.99)),
+            "max_s": round(self.max, 4),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class DownloadStats:
+    """Counters and stage timings for one download run.
+
+    total_rows enables the ETA; leave it None when the row count is unknown
+    (chunked mode). A progress line is printed at most every `report_every`
+    seconds as rows finish (0 disables it).
+    """
+
+    def __init__(self, total_rows: int = None, report_every: float = 10.0):
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        self.total_rows = total_rows
+        self.report_every = report_every
+        self.rows_ok = 0
+        self.rows_failed = 0
+        self.rows_skipped = 0
+        self.rows_unfinished = 0
+        self.unfinished_sample = []
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.images = 0
+        self.bytes = 0
+        self.errors = collections.Counter()
+        self.retried = collections.Counter()
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        """Time a block into `stage`; cancelled blocks (e.g. a losing hedged request) are not counted."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.stages[stage].add(time.perf_counter() - started)
+            raise
+        else:
+            self.stages[stage].add(time.perf_counter() - started)
+
+    def add_time(self, stage: str, seconds: float):
+        self.stages[stage].add(seconds)
+
+    def add_image(self, num_bytes: int):
+        self.images += 1
+        self.bytes += num_bytes
+
+    def row_skipped(self):
+        self.rows_skipped += 1
+
+    def row_done(self):
+        self.rows_ok += 1
+        self.maybe_report()
+
+    def row_failed(self, error: BaseException):
+        self.rows_failed += 1
+        self.errors[type(error).__name__] += 1
+        self.maybe_report()
+
+    def rows_left(self, fids: list, sample_size: int = 100):
+        self.rows_unfinished += len(fids)
+        self.unfinished_sample.extend(fids[:max(0, sample_size - len(self.unfinished_sample))])
+
+    def retry(self, error: BaseException):
+        self.retried[type(error).__name__] += 1
+
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-9)
+
+    def eta(self):
+        """Seconds left at the current row rate, or None if unknown."""
+        done = self.rows_ok + self.rows_failed
+        if self.total_rows is None or not done:
+            return None
+        remaining = self.total_rows - done - self.rows_skipped
+        return max(0.0, remaining) / (done / self.elapsed())
+
+    def maybe_report(self):
+        if not self.report_every:
+            return
+        now = time.monotonic()
+        if now - self._last_report >= self.report_every:
+            self._last_report = now
+            print(self.progress_line())
+
+    def progress_line(self) -> str:
+        elapsed = self.elapsed()
+        done = self.rows_ok + self.rows_failed
+        line = (f"[STATS] {done} rows ({self.rows_failed} failed, {self.rows_skipped} skipped), "
+                f"{done / elapsed:.1f} rows/s, {self.bytes / elapsed / 1e6:.2f} MB/s")
+        eta = self.eta()
+        if eta is not None:
+            line += f", ETA {format_duration(eta)}"
+        return line
+
+    def summary(self) -> dict:
+        elapsed = self.elapsed()
+        done = self.rows_ok + self.rows_failed
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "rows": {"ok": self.rows_ok, "failed": self.rows_failed, "skipped": self.rows_skipped,
+                     "unfinished": self.rows_unfinished},
+            "unfinished_sample": self.unfinished_sample,
+            "rows_per_s": round(done / elapsed, 3),
+            "images": self.images,
+            "bytes": self.bytes,
+            "bytes_per_s": round(self.bytes / elapsed, 1),
+            "stages": {stage: hist.summary() for stage, hist in self.stages.items()},
+            "errors": dict(self.errors),
+            "retried": dict(self.retried),
+            "hedges": {"sent": self.hedges, "won": self.hedge_wins},
+        }
+
+    def report(self):
+        print(self.progress_line())
+        for stage, hist in self.stages.items():
+            s = hist.summary()
+            if s["count"]:
+                print(f"[STATS] {stage:<8} n={s['count']} p50={s['p50_s'] * 1000:.1f}ms "
+                      f"p95={s['p95_s'] * 1000:.1f}ms p99={s['p99_s'] * 1000:.1f}ms "
+                      f"total={s['total_s']:.1f}s")
+        if self.errors:
+            print(f"[STATS] errors: {dict(self.errors)}")
+        if self.retried:
+            print(f"[STATS] retried: {dict(self.retried)}")
+        if self.hedges:
+            print(f"[STATS] hedged image requests: {self.hedges} sent, {self.hedge_wins} won")
+        if self.rows_unfinished:
+            print(f"[STATS] unfinished rows (batch deadline): {self.rows_unfinished}")
+
+    def write_json(self, path, extra: dict = None):
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,218 @@
+# export_ingredients.py
+"""
+Export the Ingredients JSON of an analysis CSV as a long-form columnar table.
+
+Every Ingredients cell is flattened into one row per (ingredient, nutrient):
+
+    foodlog_id, ingredient_index, name, estimatedPortion, nutrient, gram, kcalPer100g
+
+ingredient_index counts from 1 (as on the gallery cards). An ingredient
+without nutrition entries keeps one row with nutrient and gram empty.
+Nutrient names are upper-cased (PROTEIN, FAT, CARB, ...), gram and
+kcalPer100g are numbers (empty if missing or not numeric).
+
+The CSV is read `--chunksize` rows at a time (FoodLogId and Ingredients
+only) and each chunk is written as one Parquet row group / Arrow record
+batch, so memory stays bounded however large the export is. The output is
+written to a temp file and renamed when complete.
+
+Requires pyarrow (pip install pyarrow).
+
+Usage:
+    python export_ingredients.py foodlog_ai_analysis_v3.csv --out ingredients.parquet
+    python export_ingredients.py foodlog_ai_analysis_v3.csv --out ingredients.arrow --chunksize 20000
+"""
+import argparse
+import math
+import os
+import pathlib
+import sys
+from typing import Any
+
+import pandas as pd
+
+import json_codec
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for this export
+    pa = None
+
+FORMATS = ("parquet", "arrow")
+# Output format by file suffix when --format is not given
+SUFFIX_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".ipc": "arrow",
+                  ".feather": "arrow"}
+COLUMNS = ("foodlog_id", "ingredient_index", "name", "estimatedPortion", "nutrient", "gram", "kcalPer100g")
+
+
+def schema():
+    return pa.schema([
+        ("foodlog_id", pa.string()),
+        ("ingredient_index", pa.int32()),
+        ("name", pa.string()),
+        ("estimatedPortion", pa.string()),
+        ("nutrient", pa.string()),
+        ("gram", pa.float64()),
+        ("kcalPer100g", pa.float64()),
+    ])
+
+
+def _number(value: Any):
+    """A gram / kcalPer100g entry as a float, None if missing or not numeric."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _text(value: Any):
+    if value is None:
+        return None
+    return str(value).strip()
+
+
+class ExportStats:
+    """Counters printed at the end of an export."""
+
+    def __init__(self):
+        self.cells = 0
+        self.ingredients = 0
+        self.rows = 0
+        self.invalid = 0
+
+
+def flatten_chunk(foodlog_ids: list, cells: list, stats: ExportStats) -> dict:
+    """Long-form columns (name -> list) for one chunk of FoodLogId / Ingredients cells."""
+    columns = {name: [] for name in COLUMNS}
+    add = [columns[name].append for name in COLUMNS]
+    add_id, add_index, add_name, add_portion, add_nutrient, add_gram, add_kcal = add
+    for foodlog_id, cell in zip(foodlog_ids, cells):
+        cell = cell.strip()
+        if not cell:
+            continue
+        stats.cells += 1
+        try:
+            obj = json_codec.loads(cell)
+        except Exception:
+            stats.invalid += 1
+            continue
+        ingredients = [obj] if isinstance(obj, dict) else obj if isinstance(obj, list) else []
+        foodlog_id = foodlog_id.strip()
+        for index, ingredient in enumerate(ingredients, 1):
+            if not isinstance(ingredient, dict):
+                continue
+            stats.ingredients += 1
+            name = _text(ingredient.get("name"))
+            portion = _text(ingredient.get("estimatedPortion", ingredient.get("Portion")))
+            kcal = _number(ingredient.get("kcalPer100g"))
+            nutrition = ingredient.get("nutrition")
+            entries = [item for item in nutrition if isinstance(item, dict)] if isinstance(nutrition, list) else []
+            # Ingredients without nutrition keep one row, so they can still be counted and filtered
+            for item in entries or [{}]:
+                nutrient = _text(item.get("nutrition"))
+                add_id(foodlog_id)
+                add_index(index)
+                add_name(name)
+                add_portion(portion)
+                add_nutrient(nutrient.upper() if nutrient else None)
+                add_gram(_number(item.get("gram")))
+                add_kcal(kcal)
+    stats.rows += len(columns["foodlog_id"])
+    return columns
+
+
+class TableWriter:
+    """Writes record batches to a Parquet or Arrow IPC file under a temp name, renamed on close()."""
+
+    def __init__(self, out_file: pathlib.Path, fmt: str, compression: str = "zstd"):
+        self.out_file = out_file
+        self.tmp_file = out_file.with_name(out_file.name + ".tmp")
+        self.schema = schema()
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(str(self.tmp_file), self.schema, compression=compression)
+        else:
+            self.sink = pa.OSFile(str(self.tmp_file), "wb")
+            options = pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+            self.writer = pa.ipc.new_file(self.sink, self.schema, options=options)
+        self.fmt = fmt
+
+    def write(self, columns: dict):
+        self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        if self.fmt == "arrow":
+            self.sink.close()
+        os.replace(self.tmp_file, self.out_file)
+
+    def abort(self):
+        try:
+            self.writer.close()
+            if self.fmt == "arrow":
+                self.sink.close()
+        finally:
+            self.tmp_file.unlink(missing_ok=True)
+
+
+def export_ingredients(csv_path: str, out_path: str, fmt: str = None, chunksize: int = 10_000,
+                       compression: str = "zstd") -> ExportStats:
+    """Flatten every Ingredients cell of csv_path into out_path (see the module docstring)."""
+    if pa is None:
+        raise RuntimeError("pyarrow is required for the ingredient export (pip install pyarrow)")
+    csv_file = pathlib.Path(csv_path)
+    out_file = pathlib.Path(out_path)
+    if not csv_file.exists():
+        raise FileNotFoundError(f"CSV file does not exist: {csv_file}")
+    fmt = fmt or SUFFIX_FORMATS.get(out_file.suffix.lower())
+    if fmt not in FORMATS:
+        raise ValueError(f"Cannot tell the output format from {out_file.name}; use --format parquet or arrow")
+    header = pd.read_csv(csv_file, nrows=0).columns
+    missing = [name for name in ("FoodLogId", "Ingredients") if name not in header]
+    if missing:
+        raise ValueError(f"CSV must contain {' and '.join(missing)} column")
+
+    stats = ExportStats()
+    writer = TableWriter(out_file, fmt, compression)
+    try:
+        reader = pd.read_csv(csv_file, usecols=["FoodLogId", "Ingredients"], dtype=str, keep_default_na=False,
+                             chunksize=chunksize)
+        for chunk in reader:
+            columns = flatten_chunk(chunk["FoodLogId"].tolist(), chunk["Ingredients"].tolist(), stats)
+            if columns["foodlog_id"]:
+                writer.write(columns)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Ingredients JSON of an analysis CSV as a long-form "
+                                                 "Parquet / Arrow IPC table")
+    parser.add_argument("csv", help="Analysis CSV with FoodLogId and Ingredients columns")
+    parser.add_argument("--out", default="ingredients.parquet",
+                        help="Output file; .parquet or .arrow/.ipc/.feather picks the format (default: ingredients.parquet)")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Output format (default: from --out suffix)")
+    parser.add_argument("--chunksize", type=int, default=10_000,
+                        help="CSV rows read and written per batch (default: 10000)")
+    parser.add_argument("--compression", choices=("zstd", "lz4", "none"), default="zstd",
+                        help="Column compression (default: zstd)")
+    args = parser.parse_args()
+
+    try:
+        stats = export_ingredients(args.csv, args.out, args.format, args.chunksize, args.compression)
+    except (RuntimeError, FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[OK] Wrote {stats.rows} rows ({stats.ingredients} ingredients from {stats.cells} Ingredients cells) "
+          f"to {pathlib.Path(args.out).resolve()}")
+    if stats.invalid:
+        print(f"[WARN] {stats.invalid} Ingredients cells were not valid JSON and were skipped", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
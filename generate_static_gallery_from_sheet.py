@@ -15,7 +15,6 @@ This script:
 """
 import argparse
 import base64
-import json
 import os
 import pickle
 import re
@@ -51,9 +50,13 @@ from server_review import (
     get_display_columns,
     format_field_name,
     _build_collapsible_raw_data,
-    build_card_html,
-    build_html
+    PreformattedCards,
+    build_html,
+    raw_data_script_path,
+    write_raw_data_script
 )
+from image_store import VARIANTS
+import json_codec
 
 # Google API configuration
 # Google API 配置
@@ -208,7 +211,7 @@ def read_sheet_as_dataframe(spreadsheet_id: str, sheet_name: str = None, api_key
         error_details = str(e)
         if hasattr(e, 'content'):
             try:
-                error_json = json.loads(e.content.decode('utf-8'))
+                error_json = json_codec.loads(e.content)
                 error_details = error_json.get('error', {}).get('message', error_details)
             except:
                 pass
@@ -222,8 +225,8 @@ def get_client_id_from_credentials() -> str:
     Prefers 'web' type over 'installed' type for browser-based OAuth.
     """
     try:
-        with open(CREDENTIALS_FILE, 'r') as f:
-            creds_data = json.load(f)
+        with open(CREDENTIALS_FILE, 'rb') as f:
+            creds_data = json_codec.loads(f.read())
             # Prefer 'web' type for browser-based OAuth (required for static HTML)
             # 优先使用 'web' 类型用于基于浏览器的 OAuth（静态 HTML 需要）
             if 'web' in creds_data:
@@ -242,7 +245,7 @@ def get_client_id_from_credentials() -> str:
     return None
 
 
-def generate_static_gallery_html(spreadsheet_id: str, sheet_name: str = None, images_dir: Path = None, client_id: str = None, api_key: str = None) -> str:
+def generate_static_gallery_html(spreadsheet_id: str, sheet_name: str = None, images_dir: Path = None, client_id: str = None, api_key: str = None, variant: str = "original", raw_data_script: str = None, raw_data_sink: dict = None) -> str:
     """Generate static HTML gallery from Google Sheet data.
     
     Args:
@@ -251,6 +254,9 @@ def generate_static_gallery_html(spreadsheet_id: str, sheet_name: str = None, im
         images_dir: Directory containing images
         client_id: OAuth 2.0 Client ID for browser-based feedback submission
         api_key: Google API Key for reading public sheets (optional, if not provided will use OAuth)
+        variant: Image size to embed: original, medium or thumb (needs download_images --derivatives)
+        raw_data_script: Lazy AI Identified Data: side file the page loads the sections from on first expand
+        raw_data_sink: Dict receiving those sections ({key: html}, one key per card), to be written to raw_data_script
     """
     try:
         # Read data from Google Sheet
@@ -273,18 +279,20 @@ def generate_static_gallery_html(spreadsheet_id: str, sheet_name: str = None, im
             return f"<html><body><h1>Error</h1><p>Google Sheet does not have ImgName column</p></body></html>"
         
         display_columns = get_display_columns(df)
+        cards = PreformattedCards(df, display_columns)
         cards_html = []
         
-        for idx, row in df.iterrows():
+        for pos, idx in enumerate(cards.index):
             try:
-                cards_html.append(build_card_html(row, images_dir, display_columns, row_idx=idx))
+                cards_html.append(cards.card_html(pos, images_dir, variant=variant, raw_data_sink=raw_data_sink))
             except Exception as e:
                 print(f"[WARN] Failed to render row {idx}: {e}", file=sys.stderr)
                 continue
         
         # Build HTML with dynamic header (will be updated by JavaScript)
         # 构建带有动态头部的 HTML（将由 JavaScript 更新）
-        html_content = build_html("".join(cards_html), title="Foodlog Review Tool")
+        raw_data_source = {"script": raw_data_script} if raw_data_script else None
+        html_content = build_html("".join(cards_html), title="Foodlog Review Tool", raw_data_source=raw_data_source)
         
         # Replace the static hint with a placeholder that will be updated by JavaScript
         # 将静态提示替换为将由 JavaScript 更新的占位符
@@ -1137,6 +1145,9 @@ function toggleRawData(id) {{
         content.classList.remove('expanded');
         icon.classList.add('collapsed');
     }} else {{
+        // Lazy sections are loaded from the side file on first expand (loadRawData comes from build_html)
+        // 延迟加载的部分在首次展开时从附带文件加载（loadRawData 来自 build_html）
+        loadRawData(content);
         content.classList.add('expanded');
         icon.classList.remove('collapsed');
     }}
@@ -1885,11 +1896,23 @@ def main():
         default='./images',
         help='Images directory (default: ./images)'
     )
+    parser.add_argument(
+        '--variant',
+        choices=VARIANTS,
+        default='original',
+        help='Image size to embed: original, medium or thumb (needs download_images --derivatives)'
+    )
     parser.add_argument(
         '--output',
         default='gallery.html',
         help='Output HTML file (default: gallery.html)'
     )
+    parser.add_argument(
+        '--lazy-raw-data',
+        action='store_true',
+        help='Write the collapsed AI Identified Data sections to <output>.rawdata.js; the whole file is loaded '
+             'the first time any section is expanded'
+    )
     
     args = parser.parse_args()
     
@@ -1925,18 +1948,27 @@ def main():
     
     # Generate HTML
     # 生成 HTML
+    raw_data_path = raw_data_script_path(output_path) if args.lazy_raw_data else None
+    raw_data_sections = {} if args.lazy_raw_data else None
     html_content = generate_static_gallery_html(
         spreadsheet_id,
         sheet_name,
         images_dir,
         args.client_id,
-        api_key
+        api_key,
+        args.variant,
+        raw_data_path.name if raw_data_path else None,
+        raw_data_sections
     )
     
     # Save to file
     # 保存到文件
     output_path.write_text(html_content, encoding='utf-8')
     print(f"[OK] Generated static HTML: {output_path.resolve()}")
+    if raw_data_path:
+        # Deploy it next to the HTML file / 与 HTML 文件一起部署
+        write_raw_data_script(raw_data_path, raw_data_sections)
+        print(f"[OK] Wrote AI Identified Data sections: {raw_data_path.resolve()}")
     print(f"\n[IMPORTANT] OAuth 2.0 Configuration:")
     print(f"[IMPORTANT] OAuth 2.0 配置：")
     print(f"  - For local development: Add http://localhost and http://127.0.0.1 to authorized JavaScript origins")
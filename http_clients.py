@@ -0,0 +1,143 @@
+# http_clients.py
+"""
+HTTP client pools for download_images.
+
+The food-log API and the image CDN get separate httpx clients, each with
+its own connection pool and keep-alive limits (optionally HTTP/2, which
+multiplexes requests over one TLS connection per host). The session
+headers are set once on the API client instead of being rebuilt for every
+request.
+
+Every request carries httpcore's "trace" extension, so ConnectionStats can
+count new TCP connections and TLS handshakes against requests served on
+reused connections.
+"""
+import importlib.util
+
+import httpx
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class ConnectionStats:
+    """Requests vs. new connections / TLS handshakes seen by one transport."""
+
+    def __init__(self):
+        self.requests = 0
+        self.http2_requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def on_event(self, name: str, info: dict):
+        if name.endswith(".send_request_headers.started"):
+            self.requests += 1
+            if name.startswith("http2."):
+                self.http2_requests += 1
+        elif name == "connection.connect_tcp.complete":
+            self.connections += 1
+        elif name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def summary(self) -> dict:
+        reused = max(0, self.requests - self.connections)
+        return {
+            "requests": self.requests,
+            "http2_requests": self.http2_requests,
+            "connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_requests": reused,
+            "reuse_rate": round(reused / self.requests, 4) if self.requests else None,
+        }
+
+
+class TracingTransport(httpx.HTTPTransport):
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self.connection_stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self._trace
+        return super().handle_request(request)
+
+    def _trace(self, name: str, info: dict):
+        self.connection_stats.on_event(name, info)
+
+
+class AsyncTracingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self.connection_stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self._trace
+        return await super().handle_async_request(request)
+
+    async def _trace(self, name: str, info: dict):
+        self.connection_stats.on_event(name, info)
+
+
+class DownloadClients:
+    """The API and CDN clients of one download run (httpx.Client, or httpx.AsyncClient
+    with asynchronous=True); use as a (async) context manager.
+
+    Each pool keeps up to its max connections alive for keepalive_expiry
+    seconds. http2=True needs the optional h2 package and falls back to
+    HTTP/1.1 with a warning without it.
+    """
+
+    def __init__(self, api_headers: dict, asynchronous: bool = False, http2: bool = False,
+                 api_connections: int = 10, cdn_connections: int = 10, keepalive_expiry: float = 30.0,
+                 timeout: float = 15):
+        if http2 and not http2_available():
+            print("[WARN] HTTP/2 needs the h2 package (pip install 'httpx[http2]'); using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.api_stats = ConnectionStats()
+        self.cdn_stats = ConnectionStats()
+        client_cls = httpx.AsyncClient if asynchronous else httpx.Client
+        transport_cls = AsyncTracingTransport if asynchronous else TracingTransport
+
+        def make_client(stats: ConnectionStats, connections: int, headers: dict = None):
+            limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections,
+                                  keepalive_expiry=keepalive_expiry)
+            transport = transport_cls(stats, http2=http2, limits=limits)
+            return client_cls(headers=headers, timeout=timeout, transport=transport)
+
+        self.api = make_client(self.api_stats, max(1, api_connections), api_headers)
+        self.cdn = make_client(self.cdn_stats, max(1, cdn_connections))
+
+    def summary(self) -> dict:
+        return {"http2": self.http2, "api": self.api_stats.summary(), "cdn": self.cdn_stats.summary()}
+
+    def report(self):
+        for name, stats in (("api", self.api_stats), ("cdn", self.cdn_stats)):
+            s = stats.summary()
+            if not s["requests"]:
+                continue
+            print(f"[INFO] {name} pool: {s['requests']} requests over {s['connections']} connections "
+                  f"({s['tls_handshakes']} TLS handshakes, {s['reuse_rate']:.1%} reused, "
+                  f"{s['http2_requests']} over HTTP/2)")
+
+    def close(self):
+        self.api.close()
+        self.cdn.close()
+
+    async def aclose(self):
+        await self.api.aclose()
+        await self.cdn.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+        return False
@@ -0,0 +1,157 @@
+# humanize.py
+"""
+Natural-language rendering of parsed JSON cells for the gallery renderers
+(show_foodlog_gallery.py, server_review.py).
+
+humanize_json() walks the value with an explicit stack instead of recursing,
+and writes every piece once into a single list of chunks joined at the end,
+so deeply nested AI payloads neither hit the recursion limit nor copy their
+text again at every level. Where a value continues on the same line or on
+the next one ("key：value" vs. "key：\\n  nested") depends on whether the
+nested text contains a newline; the separator is written as a placeholder
+and filled in once that part is done.
+
+With max_chars set, writing stops at that many characters and
+TRUNCATION_MARKER is appended, so a huge raw AI payload cannot blow up
+render time or card size.
+"""
+from typing import Any, Optional
+
+# Default output cap for gallery cells (characters)
+HUMANIZE_MAX_CHARS = 20000
+TRUNCATION_MARKER = "\n… [truncated / 已截断]"
+
+
+_CONTAINERS = (dict, list, tuple, set)
+
+
+def _nested(value: Any) -> bool:
+    """Whether a value is laid out item by item (a non-empty dict, or a list holding a dict)."""
+    if isinstance(value, dict):
+        return bool(value)
+    if isinstance(value, (list, tuple)):
+        return any(isinstance(x, dict) for x in value)
+    return False
+
+
+def _flat_text(value: Any) -> str:
+    """Text of a value written in one piece: primitives, None, empty and dict-free lists."""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple, set)):
+        # Join with commas / 用逗号连接
+        return "，".join(str(x) for x in value)
+    if isinstance(value, dict):
+        return ""
+    return str(value)
+
+
+def _spans_lines(value: Any) -> bool:
+    """Whether the full text of a nested value contains a newline, without writing it out."""
+    while True:
+        if isinstance(value, dict):
+            if len(value) == 1 and "\n" in str(next(iter(value))).strip():
+                return True
+            items = list(value.values())
+        else:
+            items = list(value)
+        if len(items) != 1:
+            # Two or more items always go on separate lines
+            return len(items) > 1
+        value = items[0]
+        if not _nested(value):
+            return "\n" in _flat_text(value)
+
+
+def humanize_json(obj: Any, *, indent_level: int = 0, max_chars: Optional[int] = None) -> str:
+    """
+    Convert dict/list/primitive types to natural language string.
+    - dict: "key：value" per line, nested values indented on the following lines
+    - list: comma separated; if it contains a dict, one "- 项N: " item per line
+    - other: str()
+    Output is cut at max_chars (no cap if None) and ends with TRUNCATION_MARKER then.
+    """
+    if not _nested(obj):
+        text = _flat_text(obj)
+        if max_chars is not None and len(text) > max_chars:
+            return text[:max_chars] + TRUNCATION_MARKER
+        return text
+
+    limit = max_chars if max_chars is not None else float("inf")
+    parts = []
+    write = parts.append
+    size = 0
+    # Chunks written so far that contain a newline: a value spans several lines if this moved
+    newlines = 0
+    # One frame per nested value being written: (items, is_dict, indent, slot, newlines_before, multi_line,
+    # single_line, value), where slot is the separator between the parent's prefix and this value, filled in once
+    # the value is done ("：\n" or "：" after a key, "\n" or "" after "- 项N: ")
+    is_dict = isinstance(obj, dict)
+    stack = [(enumerate(obj.items() if is_dict else obj), is_dict, "  " * indent_level, None, 0, "", "", obj)]
+    while stack and size <= limit:
+        frame = stack[-1]
+        items, is_dict, indent = frame[0], frame[1], frame[2]
+        if is_dict:
+            multi_line, single_line = "：\n", "："
+        else:
+            multi_line, single_line = "\n", ""
+        line_start = "\n" + indent
+        for n, item in items:
+            if is_dict:
+                k, value = item
+                prefix = (line_start if n else indent) + (k.strip() if type(k) is str else str(k).strip())
+            else:
+                value = item
+                prefix = f"{line_start if n else indent}- 项{n + 1}: "
+            # Inlined _nested / _flat_text: this loop runs once per value
+            if type(value) is str:
+                text = value
+            elif value is None:
+                text = ""
+            elif isinstance(value, dict) or (isinstance(value, (list, tuple))
+                                             and any(isinstance(x, dict) for x in value)):
+                if value:
+                    # Write the nested value first, its separator is filled in afterwards
+                    write(prefix)
+                    # Keys may hold newlines too, not only the line break in front of the item
+                    newlines += "\n" in prefix
+                    size += len(prefix)
+                    child_is_dict = isinstance(value, dict)
+                    stack.append((enumerate(value.items() if child_is_dict else value), child_is_dict,
+                                  indent + "  ", len(parts), newlines, multi_line, single_line, value))
+                    write("")
+                    break
+                text = ""
+            elif isinstance(value, (list, tuple, set)):
+                text = "，".join(str(x) for x in value)
+            else:
+                text = str(value)
+            if "\n" in text:
+                chunk = prefix + multi_line + text
+                newlines += 1
+            else:
+                chunk = prefix + single_line + text
+                newlines += "\n" in prefix
+            write(chunk)
+            size += len(chunk)
+            if size > limit:
+                break
+        else:
+            # All items written: fill in the separator in front of this value
+            stack.pop()
+            slot, newlines_before, multi_line, single_line = frame[3:7]
+            if slot is not None:
+                sep = multi_line if newlines != newlines_before else single_line
+                parts[slot] = sep
+                size += len(sep)
+                newlines += "\n" in sep
+
+    if size <= limit:
+        return "".join(parts)
+    # Cut short: separators still pending are decided from the whole value, so the output stays a
+    # prefix of the uncapped text
+    for frame in stack:
+        slot, _, multi_line, single_line, value = frame[3:]
+        if slot is not None:
+            parts[slot] = multi_line if _spans_lines(value) else single_line
+    return "".join(parts)[:max_chars] + TRUNCATION_MARKER
@@ -0,0 +1,392 @@
+# image_store.py
+"""
+Shared image storage helpers for the downloader and the gallery renderers.
+
+ContentStore keeps every image once under the SHA-256 of its bytes
+(<sha256><ext>), so the same photo showing up under several FoodLogIds or
+in reruns is stored and downloaded only once. Stored names are plain file
+names inside the images directory, so the renderers resolve them exactly
+like the old "{FoodLogId}.jpg" names.
+
+make_derivatives() writes resized JPEG variants (thumb, medium) as
+_derived/<variant>/<name>.jpg and DerivativeManifest records them, so the
+renderers can inline a small variant instead of the full-resolution original.
+
+An images directory is either flat (<name>) or nested (ab/cd/<name>, from
+the MD5 of the name), as recorded in its .layout file. Names in ImgName
+never change; image_path() / find_image() map them to files, so the
+downloader and the renderers work the same with either layout, and
+migrate_layout() converts an existing directory in place.
+"""
+import base64
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is only needed for derivatives
+    Image = None
+
+DERIVED_DIR = "_derived"
+LAYOUT_FILE = ".layout"
+LAYOUTS = ("flat", "nested")
+DERIVATIVE_SIZES = {"thumb": 320, "medium": 1024}
+VARIANTS = ("original", "medium", "thumb")
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+def atomic_write_bytes(path, data: bytes):
+    """Write bytes to path through a temp file + rename, so readers never see a partial file."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with AtomicFileWriter(path.parent) as writer:
+        writer.write(data)
+        writer.commit(path)
+
+
+class AtomicFileWriter:
+    """Stream chunks into a hidden temp file next to the target, hashing as they arrive.
+
+    commit() renames the temp file into place (atomic on the same filesystem);
+    leaving the with-block without committing removes the temp file.
+    write_seconds is the time spent in write(), i.e. on disk rather than network.
+    """
+
+    def __init__(self, directory):
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        self.tmp_path = pathlib.Path(tmp_name)
+        self.size = 0
+        self.write_seconds = 0.0
+        self.file = os.fdopen(fd, "wb")
+        self._sha256 = hashlib.sha256()
+        self._done = False
+
+    def write(self, chunk: bytes):
+        started = time.perf_counter()
+        self.file.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+        self.write_seconds += time.perf_counter() - started
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+    def commit(self, path):
+        self.file.close()
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.tmp_path, path)
+        self._done = True
+
+    def discard(self):
+        self.file.close()
+        if not self._done:
+            self.tmp_path.unlink(missing_ok=True)
+            self._done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+        return False
+
+
+def nested_relpath(name: str) -> str:
+    """ab/cd/<name> from the MD5 of the name: 65536 evenly filled directories."""
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def read_layout(images_dir) -> str:
+    try:
+        layout = (pathlib.Path(images_dir) / LAYOUT_FILE).read_text(encoding="utf-8").strip()
+    except OSError:
+        return "flat"
+    return layout if layout in LAYOUTS else "flat"
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_layout(images_dir: str) -> str:
+    return read_layout(images_dir)
+
+
+def write_layout(images_dir, layout: str):
+    atomic_write_bytes(pathlib.Path(images_dir) / LAYOUT_FILE, layout.encode("utf-8"))
+    _cached_layout.cache_clear()
+
+
+def image_path(images_dir, name: str, layout: str = None) -> pathlib.Path:
+    """Where image `name` lives (or is written) under images_dir's layout."""
+    images_dir = pathlib.Path(images_dir)
+    layout = layout or _cached_layout(os.fspath(images_dir))
+    if layout == "nested":
+        return images_dir / nested_relpath(name)
+    return images_dir / name
+
+
+def find_image(images_dir, name: str) -> pathlib.Path:
+    """Path of an existing image, also checking the other layout (a directory being
+    migrated); if neither exists, the path under the current layout."""
+    path = image_path(images_dir, name)
+    if path.exists():
+        return path
+    layout = "flat" if path.parent != pathlib.Path(images_dir) else "nested"
+    other = image_path(images_dir, name, layout)
+    return other if other.exists() else path
+
+
+def _is_image_file(name: str) -> bool:
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in MIME_TYPES
+
+
+def ensure_layout(images_dir, layout: str):
+    """Use `layout` for images_dir, refusing to switch a directory that already holds images."""
+    images_dir = pathlib.Path(images_dir)
+    current = read_layout(images_dir)
+    if current == layout:
+        return
+    with os.scandir(images_dir) as entries:
+        occupied = any(_is_image_file(e.name) or (e.is_dir() and len(e.name) == 2) for e in entries)
+    if occupied:
+        raise ValueError(f"{images_dir} already uses the {current} layout; "
+                         f"convert it with --migrate-layout {layout} first")
+    write_layout(images_dir, layout)
+
+
+def migrate_layout(images_dir, layout: str) -> int:
+    """Move every image in images_dir into `layout` and return how many files moved.
+
+    The new layout is recorded first and find_image() checks both layouts, so
+    readers keep working during the move and an interrupted migration can
+    simply be run again. Derivatives stay where the manifest points to.
+    """
+    root = pathlib.Path(images_dir)
+    write_layout(root, layout)
+    moved = 0
+    if layout == "nested":
+        with os.scandir(root) as entries:
+            names = [e.name for e in entries if e.is_file() and _is_image_file(e.name)]
+        for name in names:
+            target = image_path(root, name, "nested")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(root / name, target)
+            moved += 1
+        return moved
+
+    def shard_dirs(parent: pathlib.Path):
+        with os.scandir(parent) as entries:
+            return [pathlib.Path(e.path) for e in entries
+                    if e.is_dir() and len(e.name) == 2 and all(c in "0123456789abcdef" for c in e.name)]
+
+    for first in shard_dirs(root):
+        for second in shard_dirs(first):
+            with os.scandir(second) as entries:
+                names = [e.name for e in entries if e.is_file() and _is_image_file(e.name)]
+            for name in names:
+                os.replace(second / name, root / name)
+                moved += 1
+            try:
+                second.rmdir()
+            except OSError:
+                pass
+        try:
+            first.rmdir()
+        except OSError:
+            pass
+    return moved
+
+
+class ContentStore:
+    """Content-addressed image store rooted at the images directory.
+
+    Two append-only indexes live next to the images:
+    - url_index.jsonl: image URL -> stored name, so a URL is fetched at most once
+    - foodlog_index.jsonl: FoodLogId -> stored names (the hashes of its images)
+    """
+
+    URL_INDEX = "url_index.jsonl"
+    FOODLOG_INDEX = "foodlog_index.jsonl"
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.urls = self._load_index(self.URL_INDEX, "url", "name")
+        self.foodlogs = self._load_index(self.FOODLOG_INDEX, "FoodLogId", "names")
+
+    def _load_index(self, filename: str, key: str, value: str) -> dict:
+        index = {}
+        path = self.root / filename
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    index[entry[key]] = entry[value]
+        return index
+
+    def _append_index(self, filename: str, entry: dict):
+        with (self.root / filename).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def lookup_url(self, url: str):
+        """Return the stored name for an already fetched URL, or None."""
+        name = self.urls.get(url)
+        if name and find_image(self.root, name).exists():
+            return name
+        return None
+
+    def put(self, data: bytes, ext: str, url: str = None) -> str:
+        """Store bytes under their hash and return the stored file name."""
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = image_path(self.root, name)
+        if not path.exists():
+            # A CAS file that exists is always complete
+            atomic_write_bytes(path, data)
+        if url is not None:
+            self.record_url(url, name)
+        return name
+
+    def commit(self, writer: AtomicFileWriter, ext: str, url: str = None) -> str:
+        """Move a fully streamed temp file into the store and return its stored name."""
+        name = writer.hexdigest() + ext
+        path = image_path(self.root, name)
+        if path.exists():
+            writer.discard()
+        else:
+            writer.commit(path)
+        if url is not None:
+            self.record_url(url, name)
+        return name
+
+    def record_url(self, url: str, name: str):
+        if self.urls.get(url) != name:
+            self.urls[url] = name
+            self._append_index(self.URL_INDEX, {"url": url, "name": name})
+
+    def record_foodlog(self, fid: str, names: list):
+        if self.foodlogs.get(fid) != names:
+            self.foodlogs[fid] = names
+            self._append_index(self.FOODLOG_INDEX, {"FoodLogId": fid, "names": names})
+
+
+@functools.lru_cache(maxsize=512)
+def _encode_data_uri(path: str, mtime_ns: int, size: int) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    mime = MIME_TYPES.get(ext, "image/jpeg")
+    with open(path, "rb") as f:
+        b64 = base64.b64encode(f.read()).decode("ascii")
+    return f"data:{mime};base64,{b64}"
+
+
+def encode_data_uri(img_path) -> str:
+    """Base64 data URI for an image file, cached by path and modification time.
+
+    Deduplicated images are referenced by many cards under the same stored
+    name, so each one is read and encoded once per process. Raises OSError if
+    the file cannot be read.
+    """
+    st = os.stat(img_path)
+    return _encode_data_uri(os.fspath(img_path), st.st_mtime_ns, st.st_size)
+
+
+def derivatives_available() -> bool:
+    return Image is not None
+
+
+def make_derivatives(images_dir: str, name: str, sizes: dict = None, quality: int = 82) -> dict:
+    """Write resized JPEG variants of images_dir/name and return {variant: relative path}.
+
+    Runs in a worker process. A variant whose bound is not smaller than the
+    original maps to the original file instead of writing an upscaled copy.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required for image derivatives (pip install pillow)")
+    sizes = sizes or DERIVATIVE_SIZES
+    root = pathlib.Path(images_dir)
+    variants = {"original": name}
+    nested = read_layout(root) == "nested"
+    with Image.open(find_image(root, name)) as img:
+        img = ImageOps.exif_transpose(img)
+        for variant, bound in sizes.items():
+            if max(img.size) <= bound:
+                variants[variant] = name
+                continue
+            resized = img.copy()
+            resized.thumbnail((bound, bound))
+            if resized.mode != "RGB":
+                resized = resized.convert("RGB")
+            # The full name, extension included, so x.png and x.webp do not share a derivative
+            derived_name = f"{name}.jpg"
+            if nested:
+                derived_name = nested_relpath(derived_name)
+            rel_path = f"{DERIVED_DIR}/{variant}/{derived_name}"
+            out_file = root / rel_path
+            out_file.parent.mkdir(parents=True, exist_ok=True)
+            with AtomicFileWriter(out_file.parent) as writer:
+                resized.save(writer.file, format="JPEG", quality=quality, optimize=True)
+                writer.commit(out_file)
+            variants[variant] = rel_path
+    return variants
+
+
+class DerivativeManifest:
+    """Append-only derivatives.jsonl in the images directory: image name -> {variant: path}."""
+
+    FILENAME = "derivatives.jsonl"
+
+    def __init__(self, images_dir):
+        self.path = pathlib.Path(images_dir) / self.FILENAME
+        self.entries = {}
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["name"]] = entry["variants"]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def record(self, name: str, variants: dict):
+        self.entries[name] = variants
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps({"name": name, "variants": variants}) + "\n")
+
+    def resolve(self, name: str, variant: str) -> str:
+        """Relative path of the requested variant, falling back to the original name."""
+        return self.entries.get(name, {}).get(variant, name)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_manifest(images_dir: str, mtime_ns: int) -> DerivativeManifest:
+    return DerivativeManifest(images_dir)
+
+
+def resolve_variant(images_dir, name: str, variant: str = "original") -> pathlib.Path:
+    """Path of the requested size variant of an image, or of the original if none was made."""
+    images_dir = pathlib.Path(images_dir)
+    if variant and variant != "original":
+        try:
+            mtime_ns = (images_dir / DerivativeManifest.FILENAME).stat().st_mtime_ns
+        except OSError:
+            return find_image(images_dir, name)
+        rel_path = _load_manifest(os.fspath(images_dir), mtime_ns).resolve(name, variant)
+        if rel_path != name:
+            return images_dir / rel_path
+    return find_image(images_dir, name)
@@ -0,0 +1,61 @@
+# json_codec.py
+"""
+JSON codec for the gallery renderers and the RD feedback API.
+
+Ingredients, RD Comments, RD Feedback and questionnaire cells are parsed for
+every card, so this uses orjson when it is installed (pip install orjson)
+and falls back to the stdlib json module otherwise. Results do not depend
+on the backend:
+- loads() retries with the stdlib parser whatever orjson rejects (NaN and
+  Infinity literals, lone surrogates), and leaves text with 19+ digit runs
+  to it (orjson turns integers beyond 64 bits into floats), so it returns
+  exactly what json.loads does
+- dumps() writes compact UTF-8 text (no ASCII escaping, no spaces after
+  separators) with either backend
+- errors are json.JSONDecodeError (orjson's error subclasses it)
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+JSONDecodeError = json.JSONDecodeError
+
+# Digit runs this long may be integers beyond 64 bits. Found by mapping every digit
+# to "0" with bytes.translate, which is several times faster than a regex search.
+_LONG_DIGITS = b"0" * 19
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+
+def _has_long_digits(data) -> bool:
+    if len(data) < len(_LONG_DIGITS):
+        return False
+    if isinstance(data, str):
+        data = data.encode("utf-8", "surrogatepass")
+    return _LONG_DIGITS in bytes(data).translate(_DIGITS_TO_ZERO)
+
+
+def loads(data):
+    """Parse a JSON str or bytes."""
+    if orjson is not None:
+        if _has_long_digits(data):
+            return json.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Serialize obj to compact JSON text, non-ASCII characters kept as-is."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            # Types orjson does not serialize (e.g. non-str dict keys): let the stdlib decide
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,123 @@
+# metadata_cache.py
+"""
+Persistent SQLite cache for food-log API payloads (GET {API_BASE}/{FoodLogId}).
+
+A food log's data.images rarely changes, so download_images can reuse the raw
+JSON from earlier runs instead of asking the API again:
+- entries younger than the TTL are used without any request
+- older entries are revalidated with If-None-Match / If-Modified-Since when
+  the server sent an ETag / Last-Modified; a 304 refreshes the entry
+- evict() drops stale entries that cannot be revalidated and trims the cache
+  to max_entries, least recently used first
+"""
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+CacheEntry = namedtuple("CacheEntry", ["payload", "etag", "last_modified", "fetched_at"])
+
+
+class MetadataCache:
+    def __init__(self, path, ttl: float = 7 * 24 * 3600, max_entries: int = 500_000, commit_every: int = 200):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._pending = 0
+        # WAL + busy timeout so several download processes can share one cache file
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS payloads ("
+            " fid TEXT PRIMARY KEY,"
+            " body TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS payloads_accessed ON payloads (accessed_at)")
+        self._conn.commit()
+
+    def lookup(self, fid: str):
+        row = self._conn.execute(
+            "SELECT body, etag, last_modified, fetched_at FROM payloads WHERE fid = ?", (fid,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        body, etag, last_modified, fetched_at = row
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            self.misses += 1
+            return None
+        self._conn.execute("UPDATE payloads SET accessed_at = ? WHERE fid = ?", (time.time(), fid))
+        self._maybe_commit()
+        return CacheEntry(payload, etag, last_modified, fetched_at)
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        if time.time() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            return True
+        self.stale += 1
+        return False
+
+    @staticmethod
+    def conditional_headers(entry: CacheEntry) -> dict:
+        headers = {}
+        if entry.etag:
+            headers["if-none-match"] = entry.etag
+        if entry.last_modified:
+            headers["if-modified-since"] = entry.last_modified
+        return headers
+
+    def put(self, fid: str, body: str, etag: str = None, last_modified: str = None):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO payloads (fid, body, etag, last_modified, fetched_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (fid, body, etag, last_modified, now, now),
+        )
+        self._maybe_commit()
+
+    def touch(self, fid: str):
+        """Mark an entry as freshly validated (server answered 304 Not Modified)."""
+        self.revalidated += 1
+        now = time.time()
+        self._conn.execute("UPDATE payloads SET fetched_at = ?, accessed_at = ? WHERE fid = ?", (now, now, fid))
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._conn.commit()
+            self._pending = 0
+
+    def evict(self):
+        # Stale entries without validators can never be reused, only refetched
+        self._conn.execute(
+            "DELETE FROM payloads WHERE fetched_at < ? AND etag IS NULL AND last_modified IS NULL",
+            (time.time() - self.ttl,),
+        )
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM payloads").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM payloads WHERE fid IN"
+                " (SELECT fid FROM payloads ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def summary(self) -> str:
+        return (f"metadata cache: {self.hits} fresh hits, {self.stale} stale "
+                f"({self.revalidated} revalidated with 304), {self.misses} misses")
+
+    def close(self):
+        self.evict()
+        self._conn.close()
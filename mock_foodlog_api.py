@@ -0,0 +1,243 @@
+# mock_foodlog_api.py
+"""
+Local stand-in for the food-log API and its image CDN, for benchmarks and
+dry runs of download_images without touching prod.
+
+Routes:
+- GET /v1/uc/food-log/{FoodLogId}: {"data": {"images": ...}} in every shape
+  extract_links() handles (list of dicts, list of strings, dict, string),
+  picked deterministically from the FoodLogId; sends an ETag and answers
+  If-None-Match with 304
+- GET /img/{name}: deterministic image bytes of --image-size bytes
+- GET /stats: request counters as JSON
+
+Latency, a slow tail (a fraction of image responses delayed by
+--slow-latency), error injection (429 with Retry-After / 503 / truncated
+bodies) and a per-response bandwidth cap are configurable.
+
+Usage:
+    python mock_foodlog_api.py --port 8700 --latency 0.05 --error-rate 0.02
+    python download_images.py --api-base http://127.0.0.1:8700/v1/uc/food-log --csv my.csv
+"""
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/v1/uc/food-log/"
+IMAGE_PREFIX = "/img/"
+WRITE_CHUNK = 16 * 1024
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.0, image_latency: float = None, error_rate: float = 0.0,
+                 truncate_rate: float = 0.0, bandwidth: float = None, image_size: int = 200_000,
+                 shared_rate: float = 0.1, slow_rate: float = 0.0, slow_latency: float = 5.0, seed: int = 0):
+        self.latency = latency
+        self.image_latency = latency if image_latency is None else image_latency
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.bandwidth = bandwidth
+        self.image_size = image_size
+        self.shared_rate = shared_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+
+
+def images_payload(fid: str, base_url: str, shared_rate: float = 0.0):
+    """The data.images value for a FoodLogId, in one of the four shapes extract_links() accepts."""
+    h = zlib.crc32(fid.encode())
+    link = f"{base_url}{IMAGE_PREFIX}{fid}.jpg"
+    if (h >> 8) % 1000 < shared_rate * 1000:
+        # The same photo logged under several FoodLogIds (exercises --dedupe)
+        link = f"{base_url}{IMAGE_PREFIX}shared_{(h >> 20) % 16}.jpg"
+    shape = h % 4
+    if shape == 0:
+        return [{"link": link}, {"link": f"{base_url}{IMAGE_PREFIX}{fid}_1.png"}]
+    if shape == 1:
+        return [link]
+    if shape == 2:
+        return {"link": link}
+    return link
+
+
+def image_bytes(name: str, size: int) -> bytes:
+    """Deterministic pseudo image body: a JPEG-like header followed by filler derived from the name."""
+    seed = zlib.crc32(name.encode()).to_bytes(4, "big")
+    body = b"\xff\xd8\xff\xe0" + seed * (size // 4 + 1)
+    return body[:size]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without TCP_NODELAY delayed ACKs add ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.server.count(path)
+        if path == "/stats":
+            return self._send(200, json.dumps(self.server.snapshot()).encode(), "application/json")
+        if path.startswith(API_PREFIX):
+            return self._food_log(path[len(API_PREFIX):])
+        if path.startswith(IMAGE_PREFIX):
+            return self._image(path[len(IMAGE_PREFIX):])
+        self._send(404, b"not found", "text/plain")
+
+    def _inject_error(self) -> bool:
+        with self.server.lock:
+            roll = self.config.random.random()
+        if roll >= self.config.error_rate:
+            return False
+        if roll < self.config.error_rate / 2:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+        else:
+            self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.count("errors")
+        return True
+
+    def _food_log(self, fid: str):
+        time.sleep(self.config.latency)
+        if self._inject_error():
+            return
+        host = self.headers.get("Host") or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        body = json.dumps({"data": {"images": images_payload(fid, f"http://{host}", self.config.shared_rate)}})
+        etag = f'"{zlib.crc32(body.encode()):08x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send(200, body.encode(), "application/json", {"ETag": etag})
+
+    def _image(self, name: str):
+        with self.server.lock:
+            slow = self.config.random.random() < self.config.slow_rate
+        if slow:
+            self.server.count("slow")
+        time.sleep(self.config.slow_latency if slow else self.config.image_latency)
+        if self._inject_error():
+            return
+        body = image_bytes(name, self.config.image_size)
+        with self.server.lock:
+            truncate = self.config.random.random() < self.config.truncate_rate
+        if truncate:
+            # Promise the full length, send half and hang up
+            self.server.count("truncated")
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self._send(200, body, "image/jpeg")
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not self.config.bandwidth:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), WRITE_CHUNK):
+            chunk = body[start:start + WRITE_CHUNK]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.config.bandwidth)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops SYNs under high client concurrency (1 s retransmit stalls)
+    request_queue_size = 256
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def count(self, key: str):
+        if key.startswith(API_PREFIX):
+            key = "food-log"
+        elif key.startswith(IMAGE_PREFIX):
+            key = "image"
+        with self.lock:
+            self.counters[key] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX.rstrip('/')}"
+
+
+def start_mock_server(config: MockConfig = None, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Start the mock server on a background thread (port 0 picks a free port); call shutdown() to stop."""
+    server = MockServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each food-log response")
+    parser.add_argument("--image-latency", type=float, default=None,
+                        help="Seconds before each image response (default: same as --latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with 429 (Retry-After: 1) or 503")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="Fraction of image responses cut off halfway")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Per-response bandwidth cap in bytes/s")
+    parser.add_argument("--image-size", type=int, default=200_000, help="Image body size in bytes (default: 200000)")
+    parser.add_argument("--shared-rate", type=float, default=0.1,
+                        help="Fraction of food logs whose image URL is shared with others (default: 0.1)")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="Fraction of image responses delayed by --slow-latency (tail latency)")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Delay of slow image responses (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for error injection")
+
+
+def mock_config_from_args(args) -> MockConfig:
+    return MockConfig(latency=args.latency, image_latency=args.image_latency, error_rate=args.error_rate,
+                      truncate_rate=args.truncate_rate, bandwidth=args.bandwidth, image_size=args.image_size,
+                      shared_rate=args.shared_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                      seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the food-log API and image CDN")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8700, help="Port (default: 8700)")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), mock_config_from_args(args))
+    print(f"[INFO] Mock food-log API on {server.api_base}  (use --api-base with download_images.py)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
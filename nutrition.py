@@ -0,0 +1,139 @@
+# nutrition.py
+"""
+Per-meal nutrition totals for the gallery renderers (show_foodlog_gallery.py,
+server_review.py).
+
+Each distinct Ingredients cell is parsed once into a NumPy matrix of
+ingredients x NUTRIENTS (grams), kept in an LRU cache so the server does not
+parse it again on every gallery request. A whole column is then summed in one
+vectorized pass: the matrices of all distinct cells are stacked and added up
+per cell, and the totals are indexed back to every row.
+
+kcal is estimated from the macronutrients (4 kcal/g protein and carb,
+9 kcal/g fat). kcalPer100g is not used: portions are free text
+("2 large", "1 cup"), so there is no weight to scale it by.
+"""
+import functools
+import math
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+import json_codec
+
+NUTRIENTS = ("PROTEIN", "FAT", "CARB", "SUGAR", "FIBER", "SODIUM")
+# kcal per gram of each nutrient (Atwater factors; sugar and fiber are part of carb)
+KCAL_PER_GRAM = np.array([4.0, 9.0, 4.0, 0.0, 0.0, 0.0])
+NUTRITION_LABEL = "Nutrition Totals"
+# Upper bound of cached Ingredients matrices (a few hundred bytes each, plus the cell text)
+NUTRITION_CACHE_SIZE = 16384
+
+_COLUMNS = {name: i for i, name in enumerate(NUTRIENTS)}
+_EMPTY = np.zeros((0, len(NUTRIENTS)))
+_EMPTY.setflags(write=False)
+
+
+def _grams(value: Any) -> float:
+    """A "gram" entry as a number (0 if missing or not numeric)."""
+    try:
+        grams = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return grams if math.isfinite(grams) else 0.0
+
+
+def _cell_text(value: Any) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value).strip()
+
+
+@functools.lru_cache(maxsize=NUTRITION_CACHE_SIZE)
+def ingredient_matrix(text: str) -> np.ndarray:
+    """Grams of every NUTRIENTS entry, one row per ingredient that lists at least one of them.
+
+    The result is read-only (it is shared through the cache). Cells that are
+    not JSON, or hold no known nutrient, give a 0-row matrix.
+    """
+    if not text.startswith(("[", "{")):
+        return _EMPTY
+    try:
+        obj = json_codec.loads(text)
+    except Exception:
+        return _EMPTY
+    ingredients = [obj] if isinstance(obj, dict) else obj if isinstance(obj, list) else []
+    rows = []
+    for ingredient in ingredients:
+        if not isinstance(ingredient, dict):
+            continue
+        nutrition = ingredient.get("nutrition")
+        if not isinstance(nutrition, list):
+            continue
+        row = [0.0] * len(NUTRIENTS)
+        known = False
+        for item in nutrition:
+            if isinstance(item, dict):
+                column = _COLUMNS.get(str(item.get("nutrition", "")).strip().upper())
+                if column is not None:
+                    row[column] += _grams(item.get("gram"))
+                    known = True
+        if known:
+            rows.append(row)
+    if not rows:
+        return _EMPTY
+    matrix = np.array(rows, dtype=float)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def nutrition_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters of ingredient_matrix()."""
+    info = ingredient_matrix.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
+def _cell_totals(cells: list) -> tuple:
+    """(codes, totals, counts) per distinct cell; row i of the column is distinct cell codes[i]."""
+    codes, uniques = pd.factorize(np.array([_cell_text(cell) for cell in cells], dtype=object))
+    matrices = [ingredient_matrix(text) for text in uniques]
+    counts = np.array([len(matrix) for matrix in matrices], dtype=np.int64)
+    totals = np.zeros((len(uniques), len(NUTRIENTS)))
+    if counts.sum():
+        # One pass over the ingredients of all distinct cells, each added to its cell's row
+        np.add.at(totals, np.repeat(np.arange(len(uniques)), counts), np.concatenate(matrices))
+    return codes, totals, counts
+
+
+def meal_totals(cells: list) -> tuple:
+    """Totals of a whole Ingredients column.
+
+    Returns (totals, kcal, counts): totals[i] holds the grams of each NUTRIENTS
+    entry for row i, kcal[i] the estimated kcal and counts[i] how many of its
+    ingredients list nutrients (0 means there is nothing to show).
+    """
+    codes, totals, counts = _cell_totals(cells)
+    totals = totals[codes]
+    return totals, totals @ KCAL_PER_GRAM, counts[codes]
+
+
+def summary_text(totals: np.ndarray, kcal: float, count: int) -> str:
+    """Two-line summary of one meal: grams per nutrient, then the kcal estimate."""
+    grams = ", ".join(f"{name}: {round(float(value), 2):g}g" for name, value in zip(NUTRIENTS, totals))
+    plural = "" if count == 1 else "s"
+    return f"{grams}\nEstimated: {round(float(kcal)):d} kcal (protein/fat/carb, {count} ingredient{plural})"
+
+
+def meal_summaries(cells: list) -> List[str]:
+    """summary_text() of every row of an Ingredients column ("" for rows without nutrient data)."""
+    codes, totals, counts = _cell_totals(cells)
+    kcal = totals @ KCAL_PER_GRAM
+    # Formatted once per distinct cell, then indexed by row
+    texts = [summary_text(totals[code], kcal[code], count) if count else ""
+             for code, count in enumerate(counts.tolist())]
+    return [texts[code] for code in codes.tolist()]
+
+
+def meal_summary(cell: Any) -> str:
+    """summary_text() of a single Ingredients cell ("" without nutrient data)."""
+    return meal_summaries([cell])[0]
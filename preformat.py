@@ -0,0 +1,43 @@
+# preformat.py
+"""
+Column-wise pre-formatting for the gallery renderers.
+
+Rendering through df.iterrows() builds a pandas Series for every row and
+formats each cell inside build_card_html. Here a whole column is formatted
+at once instead: its values are taken out as a plain list and normalized,
+identical cells are grouped with pandas.factorize so each distinct cell is
+formatted once, and the result is a plain list the card renderer indexes
+by row position.
+"""
+import numpy as np
+import pandas as pd
+
+
+def format_column(values: list, formatter, normalize) -> tuple:
+    """Format one column: normalize(value) for every cell, then formatter(text) once per distinct text.
+
+    Returns (formatted, errors): formatted[i] is the text for row position i
+    ("" where the formatter raised) and errors maps those positions to the
+    exception, so only the affected rows' cards fail.
+    """
+    texts = np.array([normalize(value) for value in values], dtype=object)
+    codes, uniques = pd.factorize(texts)
+    formatted = np.empty(len(uniques), dtype=object)
+    failed = {}
+    for code, text in enumerate(uniques):
+        try:
+            formatted[code] = formatter(text)
+        except Exception as e:
+            formatted[code] = ""
+            failed[code] = e
+    errors = {}
+    if failed:
+        errors = {pos: failed[code] for pos, code in enumerate(codes.tolist()) if code in failed}
+    return formatted[codes].tolist(), errors
+
+
+def column_values(df: pd.DataFrame, name: str, default=None) -> list:
+    """The column as a plain list, or `default` for every row if the column is missing."""
+    if name in df.columns:
+        return df[name].tolist()
+    return [default] * len(df)
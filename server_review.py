@@ -14,26 +14,42 @@ This server provides:
 3. 静态HTML文件服务（向后兼容）
 """
 import argparse
-import base64
+import functools
 import json
 import re
 import sys
 import html as html_module
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterable, List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Tuple
 
 import pandas as pd
 from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 
+from image_store import VARIANTS, encode_data_uri, resolve_variant
+from card_templates import FEEDBACK_CARD, FEEDBACK_ITEM, NO_IMAGES, field_html, image_html, render_card_html
+import json_codec
+from preformat import column_values, format_column
+from humanize import HUMANIZE_MAX_CHARS, humanize_json
+from nutrition import NUTRITION_LABEL, meal_summaries, meal_summary, nutrition_cache_stats
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for local development
 
-# Global variables for CSV, HTML paths, and images directory
+# Global variables for CSV, HTML paths, images directory and image size variant
 csv_path = None
 html_dir = None
 images_dir = None
+image_variant = "original"
+# Lazy AI Identified Data: sections are left out of the cards and served by /api/raw-data/<key>, where the key is
+# the section's position in the last gallery render (FoodLogIds may repeat or be empty)
+lazy_raw_data = False
+raw_data_sections: Dict[str, str] = {}
+
+# Where the page loads lazy sections from: the server endpoint, or a side script next to a saved page
+RAW_DATA_API = {"url": "/api/raw-data/"}
+RAW_DATA_PLACEHOLDER = '<div class="ai-raw-data-placeholder">Loading…</div>'
 
 # ============================================================================
 # Gallery generation functions (from show_foodlog_gallery.py)
@@ -45,38 +61,6 @@ def looks_like_json(s: str) -> bool:
     return (s.startswith("{") and s.endswith("}")) or (s.startswith("[") and s.endswith("]"))
 
 
-def humanize_json(obj: Any, *, indent_level: int = 0) -> str:
-    """Convert dict/list/primitive types to natural language string."""
-    indent = "  " * indent_level
-    if obj is None:
-        return ""
-    if isinstance(obj, dict):
-        lines = []
-        for k, v in obj.items():
-            k_str = str(k).strip()
-            v_str = humanize_json(v, indent_level=indent_level + 1)
-            if "\n" in v_str:
-                lines.append(f"{indent}{k_str}：\n{v_str}")
-            else:
-                lines.append(f"{indent}{k_str}：{v_str}")
-        return "\n".join(lines)
-    if isinstance(obj, (list, tuple, set)):
-        if not obj:
-            return ""
-        if any(isinstance(x, dict) for x in obj):
-            out_lines = []
-            for i, x in enumerate(obj, 1):
-                x_str = humanize_json(x, indent_level=indent_level + 1)
-                prefix = f"{indent}- 项{i}: "
-                if "\n" in x_str:
-                    out_lines.append(prefix + "\n" + x_str)
-                else:
-                    out_lines.append(prefix + x_str)
-            return "\n".join(out_lines)
-        return "，".join(str(x) for x in obj)
-    return str(obj)
-
-
 def format_rd_comments(s: Any) -> str:
     """Format RD Comments to show only 'text' and 'commentedAt' fields."""
     if s is None:
@@ -88,7 +72,7 @@ def format_rd_comments(s: Any) -> str:
             return ""
         if looks_like_json(s_strip):
             try:
-                obj = json.loads(s_strip)
+                obj = json_codec.loads(s_strip)
             except Exception:
                 return s_strip
         else:
@@ -132,7 +116,7 @@ def format_ingredients(s: Any) -> str:
             return ""
         if looks_like_json(s_strip):
             try:
-                obj = json.loads(s_strip)
+                obj = json_codec.loads(s_strip)
             except Exception:
                 return s_strip
         else:
@@ -193,51 +177,107 @@ def format_ingredients(s: Any) -> str:
 
 
 def format_field_value(value: Any, field_name: str) -> str:
-    """Format a field value based on its content and field name."""
+    """Format a field value based on its content and field name (see resolve_formatter)."""
+    return resolve_formatter(field_name)(value)
+
+
+def cell_text(value: Any) -> str:
+    """Normalize a cell to stripped text ("" for None)."""
     if value is None:
         return ""
     if not isinstance(value, str):
         value = str(value)
-    value = value.strip()
-    if not value:
-        return ""
-    if field_name.lower() in ['rd comments', 'rd_comments']:
-        return format_rd_comments(value)
-    elif field_name.lower() in ['ingredients']:
-        return format_ingredients(value)
-    elif field_name.lower() in ['aiinsight', 'insight']:
-        return value
-    elif field_name.lower() in ['aititle', 'mealtitle']:
-        return value
-    elif field_name.lower() in ['description']:
-        return value
-    # Special handling for AI Identify Raw Data - don't use humanize_json to avoid adding indentation
-    # 特殊处理AI Identify Raw Data - 不使用humanize_json以避免添加缩进
-    elif field_name.lower() in ['aiidentifyrawdata', 'ai_identify_raw_data'] or ('identify' in field_name.lower() and 'raw' in field_name.lower()):
-        return value  # Return as-is without JSON formatting
-    if looks_like_json(value):
+    return value.strip()
+
+
+def format_plain_value(value: Any) -> str:
+    return cell_text(value)
+
+
+def format_json_value(value: Any) -> str:
+    """Humanize cells that look like JSON, keep other text as-is."""
+    value = cell_text(value)
+    if value and looks_like_json(value):
         try:
-            obj = json.loads(value)
-            return humanize_json(obj)
+            obj = json_codec.loads(value)
+            return humanize_json(obj, max_chars=HUMANIZE_MAX_CHARS)
         except Exception:
             return value
     return value
 
 
+# Upper bound of cached (column, cell value) results
+FORMAT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def cached_format(column: str, value: str) -> str:
+    """Format an RD Comments or Ingredients cell, memoized on (column, value).
+
+    The gallery is regenerated from the CSV on every request, and exports repeat
+    the same cells a lot ("[]", the same thumbs-up comment), so each distinct
+    cell is parsed and formatted once per server process (LRU-bounded).
+    """
+    if column == 'ingredients':
+        return format_ingredients(value)
+    return format_rd_comments(value)
+
+
+def format_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters of cached_format()."""
+    info = cached_format.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
+def format_rd_comments_value(value: Any) -> str:
+    value = cell_text(value)
+    return cached_format('rd comments', value) if value else ""
+
+
+def format_ingredients_value(value: Any) -> str:
+    value = cell_text(value)
+    return cached_format('ingredients', value) if value else ""
+
+
+# Formatter registry: lower-cased column name -> cell formatter
+# 格式化注册表：小写列名 -> 单元格格式化函数
+FIELD_FORMATTERS: Dict[str, Callable[[Any], str]] = {
+    'rd comments': format_rd_comments_value,
+    'rd_comments': format_rd_comments_value,
+    'ingredients': format_ingredients_value,
+    'aiinsight': format_plain_value,
+    'insight': format_plain_value,
+    'aititle': format_plain_value,
+    'mealtitle': format_plain_value,
+    'description': format_plain_value,
+}
+
+# Columns whose formatted value is HTML and must not be escaped
+HTML_FIELDS = {'ingredients'}
+
+
+def is_raw_data_field(field_name: str) -> bool:
+    """AI Identify Raw Data column (matched by name, or containing both 'identify' and 'raw')."""
+    name = field_name.lower()
+    return name in ['aiidentifyrawdata', 'ai_identify_raw_data'] or ('identify' in name and 'raw' in name)
+
+
+def resolve_formatter(field_name: str) -> Callable[[Any], str]:
+    """Cell formatter for a column: a registered special field, else JSON-or-text."""
+    formatter = FIELD_FORMATTERS.get(field_name.lower())
+    if formatter is not None:
+        return formatter
+    # Special handling for AI Identify Raw Data - don't use humanize_json to avoid adding indentation
+    # 特殊处理AI Identify Raw Data - 不使用humanize_json以避免添加缩进
+    if is_raw_data_field(field_name):
+        return format_plain_value
+    return format_json_value
+
+
 def read_image_as_data_uri(img_path: Path) -> str:
     """Convert local image to data URI."""
     try:
-        ext = img_path.suffix.lower()
-        mime = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".gif": "image/gif",
-            ".webp": "image/webp",
-        }.get(ext, "image/jpeg")
-        data = img_path.read_bytes()
-        b64 = base64.b64encode(data).decode("ascii")
-        return f"data:{mime};base64,{b64}"
+        return encode_data_uri(img_path)
     except Exception:
         return ""
 
@@ -266,7 +306,61 @@ def format_field_name(field_name: str) -> str:
     return formatted
 
 
-def _build_collapsible_raw_data(raw_data_info: dict, foodlog_id: str, additional_fields: list = None) -> str:
+# Where a column goes on the card / 列在卡片上的位置
+ROLE_FIELD = "field"        # Regular field / 普通字段
+ROLE_AI_FIELD = "ai"        # Ai* field shown with a readable label / 以可读标签显示的 Ai* 字段
+ROLE_RAW_DATA = "raw_data"  # AI Identify Raw Data, collapsible / 可折叠的 AI Identify Raw Data
+ROLE_RAW_EXTRA = "raw_extra"  # Shown inside the collapsible section / 显示在可折叠部分中
+
+# Fields that should be in AI Generated Content (at the end)
+# 应该放在AI Generated Content中的字段（靠后位置）
+AI_CONTENT_FIELDS = {'FoodLogLabels', 'MicroAction', 'ActionFamily', 'BestAnchor'}
+# Fields shown as "none" when empty / 为空时显示 "none" 的字段
+NONE_IF_EMPTY_FIELDS = {'FoodLogLabels', 'MicroAction', 'ActionFamily'}
+# Order of the fields in the collapsible section / 可折叠部分中字段的顺序
+RAW_EXTRA_ORDER = {'FoodLogLabels': 0, 'MicroAction': 1, 'ActionFamily': 2, 'BestAnchor': 3}
+
+
+class ColumnFormatter(NamedTuple):
+    """Everything a card needs to render one column, resolved once per DataFrame.
+    卡片渲染某一列所需的全部信息，每个 DataFrame 只解析一次。
+    """
+    name: str
+    label: str
+    format: Callable[[Any], str]
+    escape_html: bool
+    role: str
+    none_if_empty: bool
+    order: int
+
+
+def compile_formatters(display_columns: List[str]) -> List[ColumnFormatter]:
+    """Resolve formatter, label, escaping policy and card section of every displayed column (ImgName excluded).
+    Pass the result to build_card_html(formatters=...) so per-cell work is a single call.
+    为每个显示列解析格式化函数、标签、转义策略和卡片位置（不含 ImgName）。
+    """
+    formatters = []
+    for col in display_columns:
+        if col == "ImgName":
+            continue
+        # Check if field starts with "Ai" (case-insensitive)
+        # 检查字段是否以"Ai"开头（不区分大小写）
+        if col.startswith("Ai") or col.startswith("ai"):
+            role = ROLE_RAW_DATA if is_raw_data_field(col) else ROLE_AI_FIELD
+            label = format_field_name(col)
+        elif col in AI_CONTENT_FIELDS:
+            role = ROLE_RAW_EXTRA
+            label = format_field_name(col)
+        else:
+            role = ROLE_FIELD
+            label = col
+        formatters.append(ColumnFormatter(col, label, resolve_formatter(col), col.lower() not in HTML_FIELDS,
+                                          role, col in NONE_IF_EMPTY_FIELDS, RAW_EXTRA_ORDER.get(col, 999)))
+    return formatters
+
+
+def _build_collapsible_raw_data(raw_data_info: dict, foodlog_id: str, additional_fields: list = None,
+                                raw_data_sink: dict = None) -> str:
     """Build collapsible HTML for AI Identify Raw Data field.
     为AI Identify Raw Data字段构建可折叠的HTML。
     
@@ -274,6 +368,9 @@ def _build_collapsible_raw_data(raw_data_info: dict, foodlog_id: str, additional
         raw_data_info: Dictionary with 'label', 'value', and optionally 'allow_html'
         foodlog_id: Unique identifier for the food log
         additional_fields: List of tuples (label, value) for additional fields to include
+        raw_data_sink: Lazy mode: the content is stored in raw_data_sink under the next free key
+            (the section's position, "0", "1", ...) and the card only holds a placeholder, loaded by
+            toggleRawData() on first expand
     """
     if not raw_data_info and not additional_fields:
         return ""
@@ -314,149 +411,136 @@ def _build_collapsible_raw_data(raw_data_info: dict, foodlog_id: str, additional
     
     unique_id = f"raw-data-{html_module.escape(foodlog_id)}"
     combined_content = "".join(content_parts)
+    lazy_attr = ""
+    if raw_data_sink is not None:
+        # Keep the content out of the page; toggleRawData() loads it by its key when first expanded.
+        # Keyed per card, not by FoodLogId, which may repeat or be empty
+        # 内容不放入页面；toggleRawData() 首次展开时按键加载（每张卡片一个键，FoodLogId 可能重复或为空）
+        key = str(len(raw_data_sink))
+        raw_data_sink[key] = combined_content
+        combined_content = RAW_DATA_PLACEHOLDER
+        unique_id = f"raw-data-{key}"
+        lazy_attr = f' data-raw-data="{key}"'
     
     return f"""<div class="ai-raw-data-container">
         <button type="button" class="ai-raw-data-toggle" onclick="toggleRawData('{unique_id}')">
             <span class="toggle-icon collapsed" id="toggle-icon-{unique_id}">▼</span>
             AI Identified Data
         </button>
-        <div class="ai-raw-data-content" id="{unique_id}">
+        <div class="ai-raw-data-content" id="{unique_id}"{lazy_attr}>
             <div class="ai-raw-data-scroll">{combined_content}</div>
         </div>
     </div>"""
 
 
-def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx: Any = None) -> str:
-    """Build HTML card for a single food log entry with dynamic columns."""
+def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx: Any = None,
+                    variant: str = "original", formatters: List[ColumnFormatter] = None,
+                    raw_data_sink: dict = None) -> str:
+    """Build HTML card for a single food log entry with dynamic columns.
+
+    variant picks the inlined image size (original, medium or thumb) when
+    download_images --derivatives produced resized copies. formatters is
+    compile_formatters(display_columns), computed once per DataFrame by the
+    caller (compiled here if omitted). With raw_data_sink the AI Identified
+    Data section is loaded lazily (see _build_collapsible_raw_data).
+    """
+    if formatters is None:
+        formatters = compile_formatters(display_columns)
+    values = [column.format(row[column.name] if column.name in row.index else "") for column in formatters]
+    nutrition = meal_summary(row.get("Ingredients")) if "Ingredients" in display_columns else ""
+    return render_card(values, formatters, images_dir, variant, foodlog_id_value=row.get("FoodLogId"),
+                       imgnames_value=row.get("ImgName", ""), rd_feedback_value=row.get("RD Feedback"),
+                       row_idx=row_idx, nutrition_summary=nutrition, raw_data_sink=raw_data_sink)
+
+
+def render_card(values: List[str], formatters: List[ColumnFormatter], images_dir: Path,
+                variant: str = "original", foodlog_id_value: Any = None, imgnames_value: Any = "",
+                rd_feedback_value: Any = None, row_idx: Any = None, nutrition_summary: str = "",
+                raw_data_sink: dict = None) -> str:
+    """Build the card HTML from already formatted values (values[i] belongs to formatters[i]).
+
+    Shared by build_card_html (one pandas row) and PreformattedCards
+    (column-wise pre-formatted frame). nutrition_summary is the per-meal
+    totals block from nutrition.py, shown after the regular fields.
+    raw_data_sink is passed on to _build_collapsible_raw_data.
+    """
     # Get foodlog_id first (needed for various parts of the card)
     # 首先获取foodlog_id（卡片多个部分需要）
-    foodlog_id = ""
-    if "FoodLogId" in row.index:
-        foodlog_id_val = row["FoodLogId"]
-        foodlog_id = str(foodlog_id_val) if pd.notna(foodlog_id_val) else ""
+    foodlog_id = str(foodlog_id_value) if pd.notna(foodlog_id_value) else ""
     if not foodlog_id and row_idx is not None:
         foodlog_id = str(row_idx)
     
-    raw_imgnames = str(row.get("ImgName", "") or "").strip()
+    raw_imgnames = str(imgnames_value or "").strip()
     img_names: Iterable[str] = [x.strip() for x in raw_imgnames.split(";") if x.strip()] if raw_imgnames else []
     
     img_tags = []
     if img_names:
         for name in img_names:
-            img_path = images_dir / name
-            data_uri = read_image_as_data_uri(img_path)
-            if data_uri:
-                img_tags.append(f'<img src="{data_uri}" alt="{html_module.escape(name)}" />')
-            else:
-                img_tags.append(f'<div class="img-missing">缺失：{html_module.escape(name)}</div>')
+            img_path = resolve_variant(images_dir, name, variant)
+            img_tags.append(image_html(name, read_image_as_data_uri(img_path)))
     else:
-        img_tags.append('<div class="img-missing">未提供图片文件名</div>')
-    
-    def para(label: str, text: str, escape_html: bool = True) -> str:
-        if not text:
-            return ""
-        if escape_html:
-            safe = html_module.escape(text).replace("\n", "<br/>")
-        else:
-            safe = text.replace("\n", "<br/>")
-        return f'<div class="field"><div class="label">{html_module.escape(label)}</div><div class="value">{safe}</div></div>'
+        img_tags.append(NO_IMAGES)
     
     # Separate AI fields from other fields
     # 分离AI字段和其他字段
     ai_raw_data_field = None
     other_fields = []
+    additional_raw_data_fields = []  # (order, label, value) to include in collapsible raw data section
     
-    # Fields that should be in AI Generated Content (at the end)
-    # 应该放在AI Generated Content中的字段（靠后位置）
-    ai_content_fields = {'FoodLogLabels', 'MicroAction', 'ActionFamily', 'BestAnchor'}
-    additional_raw_data_fields = []  # Fields to include in collapsible raw data section
-    
-    for col in display_columns:
-        if col == "ImgName":
-            continue
-        value = row[col] if col in row.index else ""
-        formatted_value = format_field_value(value, col)
+    for column, formatted_value in zip(formatters, values):
         
         # Special handling for FoodLogLabels, MicroAction and ActionFamily - show "none" if empty
         # 特殊处理 FoodLogLabels, MicroAction 和 ActionFamily - 如果为空则显示 "none"
-        if col in {'FoodLogLabels', 'MicroAction', 'ActionFamily'}:
-            if not formatted_value:
-                formatted_value = "none"
+        if column.none_if_empty and not formatted_value:
+            formatted_value = "none"
         
         if not formatted_value:
             continue
         
-        # Check if field starts with "Ai" (case-insensitive)
-        # 检查字段是否以"Ai"开头（不区分大小写）
-        if col.startswith("Ai") or col.startswith("ai"):
-            formatted_label = format_field_name(col)
-            allow_html = col.lower() in ['ingredients']
-            
+        if column.role == ROLE_RAW_DATA:
             # Special handling for AI Identify Raw Data - make it collapsible
             # 特殊处理AI Identify Raw Data - 使其可折叠
-            if col.lower() in ['aiidentifyrawdata', 'ai_identify_raw_data'] or 'identify' in col.lower() and 'raw' in col.lower():
-                ai_raw_data_field = {
-                    'label': formatted_label,
-                    'value': formatted_value,
-                    'allow_html': allow_html,
-                    'foodlog_id': foodlog_id
-                }
-            else:
-                # Add AI fields directly to other_fields (no blue box)
-                # 直接将AI字段添加到other_fields（不使用蓝框）
-                other_fields.append(para(formatted_label, formatted_value, escape_html=not allow_html))
-        elif col == 'FoodLogLabels':
-            # Add FoodLogLabels to collapsible raw data section (before MicroAction)
-            # 将 FoodLogLabels 添加到可折叠的原始数据部分（在 MicroAction 之前）
-            formatted_label = format_field_name(col)
-            additional_raw_data_fields.append((formatted_label, formatted_value))
-        elif col in {'MicroAction', 'ActionFamily', 'BestAnchor'}:
-            # Collect these fields to include in collapsible raw data section
-            # 收集这些字段以包含在可折叠的原始数据部分
-            formatted_label = format_field_name(col)
-            additional_raw_data_fields.append((formatted_label, formatted_value))
-        elif col in ai_content_fields:
-            # Other fields in ai_content_fields (shouldn't happen now, but keep for safety)
-            # ai_content_fields 中的其他字段（现在不应该发生，但保留作为安全措施）
-            allow_html = col.lower() in ['ingredients']
-            other_fields.append(para(col, formatted_value, escape_html=not allow_html))
+            ai_raw_data_field = {
+                'label': column.label,
+                'value': formatted_value,
+                'allow_html': not column.escape_html,
+                'foodlog_id': foodlog_id
+            }
+        elif column.role == ROLE_RAW_EXTRA:
+            # FoodLogLabels, MicroAction, ActionFamily and BestAnchor go to the collapsible raw data section
+            # FoodLogLabels, MicroAction, ActionFamily 和 BestAnchor 放入可折叠的原始数据部分
+            additional_raw_data_fields.append((column.order, column.label, formatted_value))
         else:
-            allow_html = col.lower() in ['ingredients']
-            other_fields.append(para(col, formatted_value, escape_html=not allow_html))
+            # AI fields are added directly to other_fields (no blue box)
+            # 直接将AI字段添加到other_fields（不使用蓝框）
+            other_fields.append(field_html(column.label, formatted_value, escape_html=column.escape_html))
+    
+    if nutrition_summary:
+        # Summed PROTEIN/FAT/CARB/... of the Ingredients column
+        # Ingredients 列的营养素合计
+        other_fields.append(field_html(NUTRITION_LABEL, nutrition_summary))
     
-    # Sort additional_raw_data_fields to ensure correct order: FoodLogLabels, then MicroAction, ActionFamily, BestAnchor
-    # 对 additional_raw_data_fields 进行排序以确保正确顺序：FoodLogLabels，然后是 MicroAction, ActionFamily, BestAnchor
-    # Use formatted field names for sorting (format_field_name converts "FoodLogLabels" -> "Food Log Labels")
-    # 使用格式化后的字段名进行排序（format_field_name 将 "FoodLogLabels" 转换为 "Food Log Labels"）
-    field_order = {
-        format_field_name('FoodLogLabels'): 0,
-        format_field_name('MicroAction'): 1,
-        format_field_name('ActionFamily'): 2,
-        format_field_name('BestAnchor'): 3
-    }
-    if additional_raw_data_fields:
-        additional_raw_data_fields.sort(key=lambda x: field_order.get(x[0], 999))
+    # Keep the order FoodLogLabels, MicroAction, ActionFamily, BestAnchor (stable sort)
+    # 保持顺序：FoodLogLabels，然后是 MicroAction, ActionFamily, BestAnchor（稳定排序）
+    additional_raw_data_fields.sort(key=lambda x: x[0])
+    additional_raw_data_fields = [(label, value) for _, label, value in additional_raw_data_fields]
     
     # Add AI Identify Raw Data as collapsible field (if exists), including additional fields
     # 添加AI Identify Raw Data作为可折叠字段（如果存在），包括额外字段
     if ai_raw_data_field or additional_raw_data_fields:
-        other_fields.append(_build_collapsible_raw_data(ai_raw_data_field, foodlog_id, additional_raw_data_fields))
-    
-    # Combine other fields
-    # 组合其他字段
-    field_html = other_fields
+        other_fields.append(_build_collapsible_raw_data(ai_raw_data_field, foodlog_id, additional_raw_data_fields,
+                                                        raw_data_sink))
     
     # Check if there are existing feedbacks to display
     existing_feedbacks_html = ""
-    if "RD Feedback" in row.index:
-        rd_feedback_value = row["RD Feedback"]
+    if rd_feedback_value is not None:
         if pd.notna(rd_feedback_value) and str(rd_feedback_value).strip():
             try:
                 feedback_str = str(rd_feedback_value).strip()
                 if feedback_str.startswith('['):
-                    feedback_list = json.loads(feedback_str)
+                    feedback_list = json_codec.loads(feedback_str)
                 elif feedback_str.startswith('{'):
-                    feedback_list = [json.loads(feedback_str)]
+                    feedback_list = [json_codec.loads(feedback_str)]
                 else:
                     feedback_list = []
                 
@@ -479,8 +563,13 @@ def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx:
                         
                         # Check if feedback is questionnaire format (JSON)
                         # 检查反馈是否为问卷格式（JSON）
+                        # Only a JSON object can be a questionnaire; plain text skips the parse (and its exception)
+                        # 只有 JSON 对象可能是问卷；纯文本跳过解析（以及解析异常）
                         try:
-                            questionnaire_data = json.loads(feedback_text) if isinstance(feedback_text, str) else feedback_text
+                            if isinstance(feedback_text, str):
+                                questionnaire_data = json_codec.loads(feedback_text) if feedback_text.lstrip().startswith('{') else None
+                            else:
+                                questionnaire_data = feedback_text
                             if isinstance(questionnaire_data, dict) and ('q1_most_important' in questionnaire_data or 'q1_clinically_appropriate' in questionnaire_data):
                                 # Format questionnaire data
                                 # 格式化问卷数据
@@ -524,109 +613,73 @@ def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx:
                                 # Regular text feedback
                                 # 常规文本反馈
                                 escaped_feedback = html_module.escape(feedback_text).replace("\n", "<br/>")
-                        except (json.JSONDecodeError, TypeError):
+                        except (json_codec.JSONDecodeError, TypeError):
                             # Not JSON, treat as regular text
                             # 不是 JSON，作为常规文本处理
                             escaped_feedback = html_module.escape(feedback_text).replace("\n", "<br/>")
                         
-                        feedback_items.append(
-                            f'<div class="review-display-item">'
-                            f'<div class="review-display-header">RD Feedback:</div>'
-                            f'<div class="review-display-content">{escaped_feedback}</div>'
-                            f'<div class="review-display-meta">By: {escaped_name} | {timestamp}</div>'
-                            f'</div>'
-                        )
+                        feedback_items.append(FEEDBACK_ITEM.render(
+                            {"content": escaped_feedback, "name": escaped_name, "timestamp": timestamp}))
                 
                 if feedback_items:
                     existing_feedbacks_html = ''.join(feedback_items)
-            except (json.JSONDecodeError, ValueError, Exception):
+            except (json_codec.JSONDecodeError, ValueError, Exception):
                 # If parsing fails, don't show anything
                 pass
     
-    review_form = f"""
-        <div class="review-form">
-            <div class="review-form-title">Feedback</div>
-            <div class="review-form-hint">For labeling the quality of AI-generated content</div>
-            <form class="rd-feedback-form" data-foodlog-id="{html_module.escape(foodlog_id)}">
-                <div class="form-group">
-                    <label for="rd-name-{html_module.escape(foodlog_id)}">RD Name:</label>
-                    <input type="text" id="rd-name-{html_module.escape(foodlog_id)}" name="rd_name" class="form-input" required />
-                </div>
-                
-                <div class="form-group">
-                    <div class="question-item">
-                        <div class="question-text">The insight correctly identifies and focuses on the most important thing about this meal.<span class="required-asterisk">*</span></div>
-                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
-                        <div class="rating-group">
-                            <label><input type="radio" name="q1_most_important" value="1" required> 1</label>
-                            <label><input type="radio" name="q1_most_important" value="2" required> 2</label>
-                            <label><input type="radio" name="q1_most_important" value="3" required> 3</label>
-                            <label><input type="radio" name="q1_most_important" value="4" required> 4</label>
-                            <label><input type="radio" name="q1_most_important" value="5" required> 5</label>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="form-group">
-                    <div class="question-item">
-                        <div class="question-text">The suggested action (if any) makes sense as a secondary step for this meal and its timing.<span class="required-asterisk">*</span></div>
-                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
-                        <div class="rating-group">
-                            <label><input type="radio" name="q2_action_makes_sense" value="1" required> 1</label>
-                            <label><input type="radio" name="q2_action_makes_sense" value="2" required> 2</label>
-                            <label><input type="radio" name="q2_action_makes_sense" value="3" required> 3</label>
-                            <label><input type="radio" name="q2_action_makes_sense" value="4" required> 4</label>
-                            <label><input type="radio" name="q2_action_makes_sense" value="5" required> 5</label>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="form-group">
-                    <div class="question-item">
-                        <div class="question-text">This insight is clinically appropriate, safe, patient-friendly and something I would feel comfortable sending to a patient.<span class="required-asterisk">*</span></div>
-                        <div class="question-hint">Rate: 1–5 (Strongly disagree → Strongly agree)</div>
-                        <div class="rating-group">
-                            <label><input type="radio" name="q3_clinically_appropriate" value="1" required> 1</label>
-                            <label><input type="radio" name="q3_clinically_appropriate" value="2" required> 2</label>
-                            <label><input type="radio" name="q3_clinically_appropriate" value="3" required> 3</label>
-                            <label><input type="radio" name="q3_clinically_appropriate" value="4" required> 4</label>
-                            <label><input type="radio" name="q3_clinically_appropriate" value="5" required> 5</label>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="form-group">
-                    <label for="q4_what_worked-{html_module.escape(foodlog_id)}">What worked well here? (optional)</label>
-                    <textarea id="q4_what_worked-{html_module.escape(foodlog_id)}" name="q4_what_worked" class="form-textarea" rows="2" placeholder="Short text"></textarea>
-                </div>
-                
-                <div class="form-group">
-                    <label for="q5_what_felt_off-{html_module.escape(foodlog_id)}">What felt off or risky? (if you rated anything neutral and below, please add more details) (optional)</label>
-                    <textarea id="q5_what_felt_off-{html_module.escape(foodlog_id)}" name="q5_what_felt_off" class="form-textarea" rows="2" placeholder="Short text"></textarea>
-                </div>
-                
-                <button type="submit" class="submit-btn">Submit</button>
-                <div class="form-status"></div>
-            </form>
-            <div class="review-display" id="review-display-{html_module.escape(foodlog_id)}">{existing_feedbacks_html}</div>
-        </div>
-    """
-    
-    return f"""
-    <div class="card" data-foodlog-id="{html_module.escape(foodlog_id)}">
-        <div class="images">
-            {''.join(img_tags)}
-        </div>
-        <div class="meta">
-            {''.join(field_html)}
-        </div>
-        {review_form}
-    </div>
+    # The questionnaire form and card markup live in card_templates (FoodLogId escaped once)
+    # 问卷表单和卡片标记位于 card_templates（FoodLogId 只转义一次）
+    return render_card_html(FEEDBACK_CARD, foodlog_id, img_tags, other_fields, existing_feedbacks_html)
+
+
+class PreformattedCards:
+    """Column-wise pre-formatting stage ahead of card rendering.
+
+    Every displayed column is formatted as a whole (preformat.format_column:
+    each distinct cell once) into plain lists, and card_html(i) only indexes
+    them, so rendering a frame needs no df.iterrows() and no pandas Series
+    per row.
+    按列整体预格式化，card_html(i) 只需按位置索引。
     """
 
+    def __init__(self, df: pd.DataFrame, display_columns: List[str], formatters: List[ColumnFormatter] = None):
+        self.formatters = formatters if formatters is not None else compile_formatters(display_columns)
+        self.index = df.index.tolist()
+        self.errors = {}
+        columns = []
+        for column in self.formatters:
+            formatted, errors = format_column(column_values(df, column.name, ""), column.format, cell_text)
+            columns.append(formatted)
+            for pos, error in errors.items():
+                self.errors.setdefault(pos, error)
+        self.rows = list(zip(*columns)) if columns else [()] * len(df)
+        self.foodlog_ids = column_values(df, "FoodLogId")
+        self.imgnames = column_values(df, "ImgName", "")
+        self.rd_feedback = column_values(df, "RD Feedback")
+        # Per-meal nutrition totals, summed for the whole column at once (matrices cached across requests)
+        self.nutrition = (meal_summaries(column_values(df, "Ingredients", "")) if "Ingredients" in display_columns
+                          else [""] * len(df))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def card_html(self, pos: int, images_dir: Path, variant: str = "original", raw_data_sink: dict = None) -> str:
+        """Card of the row at position `pos`; raises the formatter error if one of its cells failed."""
+        if pos in self.errors:
+            raise self.errors[pos]
+        return render_card(self.rows[pos], self.formatters, images_dir, variant,
+                           foodlog_id_value=self.foodlog_ids[pos], imgnames_value=self.imgnames[pos],
+                           rd_feedback_value=self.rd_feedback[pos], row_idx=self.index[pos],
+                           nutrition_summary=self.nutrition[pos], raw_data_sink=raw_data_sink)
 
-def build_html(doc_cards: str, title: str = "FoodLog Gallery") -> str:
-    """Build complete HTML document with card grid layout."""
+
+def build_html(doc_cards: str, title: str = "FoodLog Gallery", raw_data_source: dict = None) -> str:
+    """Build complete HTML document with card grid layout.
+
+    raw_data_source tells toggleRawData() where lazy AI Identified Data
+    sections come from: RAW_DATA_API, or {"script": "<page>.rawdata.js"}
+    (see write_raw_data_script); None when the cards hold their sections.
+    """
     # Get the full HTML template from show_foodlog_gallery.py
     # For brevity, I'll include the essential parts
     return f"""<!DOCTYPE html>
@@ -849,6 +902,11 @@ h1 {{
   color: var(--text);
   margin-bottom: 6px;
 }}
+.ai-raw-data-placeholder {{
+  font-size: 11px;
+  color: var(--muted);
+  font-style: italic;
+}}
 .ai-raw-data-value {{
   font-size: 11px;
   color: var(--text);
@@ -1014,6 +1072,59 @@ function escapeHtml(text) {{
     return div.innerHTML;
 }}
 
+// Lazy AI Identified Data: null, {{"url": ...}} (server endpoint) or {{"script": ...}} (side file)
+const RAW_DATA_SOURCE = {json_codec.dumps(raw_data_source)};
+let rawDataScript = null;
+
+function fetchRawData(key) {{
+    if (RAW_DATA_SOURCE.url) {{
+        return fetch(RAW_DATA_SOURCE.url + encodeURIComponent(key)).then(function(response) {{
+            if (!response.ok) {{
+                throw new Error('HTTP ' + response.status);
+            }}
+            return response.json();
+        }}).then(function(result) {{
+            return result.html;
+        }});
+    }}
+    // The side file sets window.RAW_DATA_SECTIONS (all sections of the page); loaded once, as a script so it
+    // also works from file://
+    if (!rawDataScript) {{
+        rawDataScript = new Promise(function(resolve, reject) {{
+            const script = document.createElement('script');
+            script.src = RAW_DATA_SOURCE.script;
+            script.charset = 'utf-8';
+            script.onload = function() {{ resolve(window.RAW_DATA_SECTIONS || {{}}); }};
+            script.onerror = function() {{
+                rawDataScript = null;
+                reject(new Error('Failed to load ' + RAW_DATA_SOURCE.script));
+            }};
+            document.head.appendChild(script);
+        }});
+    }}
+    return rawDataScript.then(function(sections) {{
+        return sections[key] || '';
+    }});
+}}
+
+function loadRawData(content) {{
+    const key = content.getAttribute('data-raw-data');
+    if (key === null || !RAW_DATA_SOURCE || content.dataset.loading) {{
+        return;
+    }}
+    content.dataset.loading = '1';
+    const scroll = content.querySelector('.ai-raw-data-scroll');
+    fetchRawData(key).then(function(html) {{
+        scroll.innerHTML = html;
+        content.removeAttribute('data-raw-data');
+    }}).catch(function(error) {{
+        console.error('[ERROR] Failed to load AI Identified Data:', error);
+        scroll.innerHTML = '<div class="ai-raw-data-placeholder">Failed to load: ' + escapeHtml(error.message) + '</div>';
+    }}).finally(function() {{
+        delete content.dataset.loading;
+    }});
+}}
+
 function toggleRawData(id) {{
     const content = document.getElementById(id);
     if (!content) {{
@@ -1029,6 +1140,7 @@ function toggleRawData(id) {{
         content.classList.remove('expanded');
         icon.classList.add('collapsed');
     }} else {{
+        loadRawData(content);
         content.classList.add('expanded');
         icon.classList.remove('collapsed');
     }}
@@ -1130,9 +1242,14 @@ document.addEventListener('DOMContentLoaded', function() {{
 """
 
 
-def generate_gallery_html() -> str:
-    """Generate HTML gallery from current CSV data."""
-    global csv_path, images_dir
+def generate_gallery_html(raw_data_source: dict = None) -> str:
+    """Generate HTML gallery from current CSV data.
+
+    With raw_data_source (--lazy-raw-data) the AI Identified Data sections are
+    kept out of the cards and stored in raw_data_sections, served by
+    /api/raw-data/<key> or written next to a saved page.
+    """
+    global csv_path, images_dir, image_variant, raw_data_sections
     
     try:
         df = pd.read_csv(csv_path)
@@ -1141,19 +1258,33 @@ def generate_gallery_html() -> str:
             return f"<html><body><h1>Error</h1><p>CSV file does not have ImgName column</p></body></html>"
         
         display_columns = get_display_columns(df)
+        cards = PreformattedCards(df, display_columns)
         cards_html = []
+        sections = {} if raw_data_source else None
         
-        for idx, row in df.iterrows():
+        for pos in range(len(cards)):
             try:
-                cards_html.append(build_card_html(row, images_dir, display_columns, row_idx=idx))
+                cards_html.append(cards.card_html(pos, images_dir, variant=image_variant, raw_data_sink=sections))
             except Exception as e:
                 continue
         
-        return build_html("".join(cards_html), title="FoodLog Gallery - RD Feedback")
+        if sections is not None:
+            raw_data_sections = sections
+        return build_html("".join(cards_html), title="FoodLog Gallery - RD Feedback", raw_data_source=raw_data_source)
     except Exception as e:
         return f"<html><body><h1>Error</h1><p>Failed to generate gallery: {str(e)}</p></body></html>"
 
 
+def raw_data_script_path(html_path: Path) -> Path:
+    """Side file holding the lazy AI Identified Data sections of a saved page (gallery.html -> gallery.rawdata.js)."""
+    return html_path.with_name(html_path.stem + ".rawdata.js")
+
+
+def write_raw_data_script(path: Path, sections: Dict[str, str]) -> None:
+    """Write the sections as a script setting window.RAW_DATA_SECTIONS (loaded by the page on first expand)."""
+    path.write_text(f"window.RAW_DATA_SECTIONS = {json_codec.dumps(sections)};\n", encoding="utf-8")
+
+
 # ============================================================================
 # Flask Routes
 # ============================================================================
@@ -1194,11 +1325,11 @@ def add_review_to_csv(foodlog_id: str, rd_name: str, rd_feedback: str) -> Tuple[
                 feedback_str = str(current_feedback).strip()
                 if feedback_str.startswith('['):
                     # It's already a list
-                    feedback_list = json.loads(feedback_str)
+                    feedback_list = json_codec.loads(feedback_str)
                 elif feedback_str.startswith('{'):
                     # It's a single object, convert to list
-                    feedback_list = [json.loads(feedback_str)]
-            except (json.JSONDecodeError, ValueError):
+                    feedback_list = [json_codec.loads(feedback_str)]
+            except (json_codec.JSONDecodeError, ValueError):
                 # If parsing fails, start with empty list
                 feedback_list = []
         
@@ -1248,11 +1379,26 @@ def add_review():
         return jsonify({'success': False, 'error': f'Server error: {str(e)}'}), 500
 
 
+@app.route('/api/format-cache-stats', methods=['GET'])
+def format_cache_stats_route():
+    """Hit/miss counters of the RD Comments / Ingredients formatting cache (and of the nutrition matrices)."""
+    return jsonify({**format_cache_stats(), "nutrition": nutrition_cache_stats()})
+
+
+@app.route('/api/raw-data/<key>', methods=['GET'])
+def raw_data_route(key):
+    """AI Identified Data section of one card (--lazy-raw-data), as rendered by the last gallery request."""
+    section = raw_data_sections.get(key)
+    if section is None:
+        return jsonify({'success': False, 'error': f'No AI Identified Data section: {key}'}), 404
+    return jsonify({'success': True, 'html': section})
+
+
 @app.route('/gallery')
 @app.route('/')
 def index():
     """Serve dynamically generated HTML gallery (real-time from CSV)."""
-    html_content = generate_gallery_html()
+    html_content = generate_gallery_html(RAW_DATA_API if lazy_raw_data else None)
     return Response(html_content, mimetype='text/html')
 
 
@@ -1279,7 +1425,7 @@ def serve_static(filename):
 
 def main():
     """Main function to start the Flask server."""
-    global csv_path, html_dir, images_dir
+    global csv_path, html_dir, images_dir, image_variant, lazy_raw_data
     
     parser = argparse.ArgumentParser(
         description="Start Flask server for RD feedback submission with dynamic HTML generation"
@@ -1294,6 +1440,18 @@ def main():
         default='./images',
         help='Images directory (default: ./images)'
     )
+    parser.add_argument(
+        '--variant',
+        choices=VARIANTS,
+        default='original',
+        help='Image size to embed: original, medium or thumb (needs download_images --derivatives)'
+    )
+    parser.add_argument(
+        '--lazy-raw-data',
+        action='store_true',
+        help='Load the collapsed AI Identified Data sections on first expand instead of inlining them in every card '
+             '(from the server; the saved gallery.html loads all of them at once from gallery.rawdata.js)'
+    )
     parser.add_argument(
         '--html-dir',
         default='.',
@@ -1321,6 +1479,8 @@ def main():
     csv_path = Path(args.csv)
     images_dir = Path(args.images)
     html_dir = Path(args.html_dir)
+    image_variant = args.variant
+    lazy_raw_data = args.lazy_raw_data
     
     if not csv_path.exists():
         print(f"[ERROR] CSV file does not exist: {csv_path}", file=sys.stderr)
@@ -1335,10 +1495,18 @@ def main():
     # Generate and save gallery.html file
     # 生成并保存 gallery.html 文件
     try:
-        html_content = generate_gallery_html()
         gallery_html_path = Path("gallery.html")
+        raw_data_path = raw_data_script_path(gallery_html_path)
+        html_content = generate_gallery_html({"script": raw_data_path.name} if lazy_raw_data else None)
         gallery_html_path.write_text(html_content, encoding="utf-8")
         print(f"[INFO] Saved gallery.html: {gallery_html_path.resolve()}")
+        if lazy_raw_data:
+            write_raw_data_script(raw_data_path, raw_data_sections)
+            print(f"[INFO] Saved AI Identified Data sections: {raw_data_path.resolve()}")
+        cache = format_cache_stats()
+        print(f"[INFO] Format cache: {cache['hits']} hits, {cache['misses']} misses")
+        cache = nutrition_cache_stats()
+        print(f"[INFO] Nutrition cache: {cache['hits']} hits, {cache['misses']} misses")
     except Exception as e:
         print(f"[WARN] Failed to save gallery.html: {e}", file=sys.stderr)
     
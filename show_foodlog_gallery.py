@@ -28,17 +28,23 @@ Optional columns / 可选列:
 - System columns (MemberId, FoodLogId) are excluded / 系统列（MemberId, FoodLogId）被排除
 """
 import argparse
-import base64
-import json
+import functools
 import os
 import sys
 import html
 import webbrowser
 from pathlib import Path
-from typing import Any, Iterable, Dict, List
+from typing import Any, Callable, Iterable, Dict, List, NamedTuple
 
 import pandas as pd
 
+from image_store import VARIANTS, encode_data_uri, resolve_variant
+from preformat import column_values, format_column
+from humanize import HUMANIZE_MAX_CHARS, humanize_json
+from nutrition import NUTRITION_LABEL, meal_summaries, meal_summary, nutrition_cache_stats
+from card_templates import NO_IMAGES, REVIEW_CARD, field_html, image_html, render_card_html
+import json_codec
+
 
 def looks_like_json(s: str) -> bool:
     """
@@ -61,63 +67,6 @@ def looks_like_json(s: str) -> bool:
     return (s.startswith("{") and s.endswith("}")) or (s.startswith("[") and s.endswith("]"))
 
 
-def humanize_json(obj: Any, *, indent_level: int = 0) -> str:
-    """
-    Convert dict/list/primitive types to natural language string.
-    将字典/列表/原子类型转为自然语言字符串。
-    
-    This function recursively converts JSON objects into human-readable text format.
-    It handles nested structures and provides proper indentation for readability.
-    
-    这个函数递归地将JSON对象转换为人类可读的文本格式。
-    它处理嵌套结构并提供适当的缩进以提高可读性。
-    
-    Args:
-        obj (Any): The object to convert (dict, list, or primitive) / 要转换的对象（字典、列表或原始类型）
-        indent_level (int): Current indentation level for nested structures / 嵌套结构的当前缩进级别
-        
-    Returns:
-        str: Human-readable text representation / 人类可读的文本表示
-        
-    Examples / 示例:
-        - dict: "key: value" for each item / 逐项 "键：值"
-        - list: comma separated; if contains dict, show as multi-line items / 逗号分隔；若包含 dict，则转为分行的项目列表
-        - other: convert to str / 其他: 直接转 str
-    """
-    indent = "  " * indent_level
-    if obj is None:
-        return ""
-    if isinstance(obj, dict):
-        lines = []
-        for k, v in obj.items():
-            k_str = str(k).strip()
-            v_str = humanize_json(v, indent_level=indent_level + 1)
-            if "\n" in v_str:
-                lines.append(f"{indent}{k_str}：\n{v_str}")
-            else:
-                lines.append(f"{indent}{k_str}：{v_str}")
-        return "\n".join(lines)
-    if isinstance(obj, (list, tuple, set)):
-        if not obj:
-            return ""
-        # If list contains dicts, show as multi-line items
-        # 如果列表里是字典，分行展示每一项
-        if any(isinstance(x, dict) for x in obj):
-            out_lines = []
-            for i, x in enumerate(obj, 1):
-                x_str = humanize_json(x, indent_level=indent_level + 1)
-                prefix = f"{indent}- 项{i}: "
-                if "\n" in x_str:
-                    out_lines.append(prefix + "\n" + x_str)
-                else:
-                    out_lines.append(prefix + x_str)
-            return "\n".join(out_lines)
-        # Otherwise join with commas / 否则用顿号/逗号连接
-        return "，".join(str(x) for x in obj)
-    # Primitive types / 原子类型
-    return str(obj)
-
-
 def format_field_value(value: Any, field_name: str) -> str:
     """
     Format a field value based on its content and field name.
@@ -140,44 +89,131 @@ def format_field_value(value: Any, field_name: str) -> str:
     Returns:
         str: Formatted field value / 格式化的字段值
     """
+    # The per-column choice is made by resolve_formatter(); renderers compile it once per DataFrame
+    # 按列选择格式化函数由 resolve_formatter() 完成；渲染时每个 DataFrame 只解析一次
+    return resolve_formatter(field_name)(value)
+
+
+def cell_text(value: Any) -> str:
+    """
+    Normalize a cell to stripped text ("" for None).
+    把单元格规范化为去除首尾空白的文本（None 为 ""）。
+    """
     if value is None:
         return ""
-    
-    # Convert to string if not already
+    # Convert to string if not already / 如果不是字符串则转换
     if not isinstance(value, str):
         value = str(value)
-    
-    value = value.strip()
-    if not value:
-        return ""
-    
-    # Special handling for known field types
-    # 对已知字段类型的特殊处理
-    if field_name.lower() in ['rd comments', 'rd_comments']:
-        return format_rd_comments(value)
-    elif field_name.lower() in ['ingredients']:
-        return format_ingredients(value)
-    elif field_name.lower() in ['aiinsight', 'insight']:
-        return value  # Keep as-is for insights
-    elif field_name.lower() in ['aititle', 'mealtitle']:
-        return value  # Keep as-is for titles
-    elif field_name.lower() in ['description']:
-        return value  # Keep as-is for descriptions
-    
-    # Check if it looks like JSON and try to parse
-    # 检查是否看起来像JSON并尝试解析
-    if looks_like_json(value):
+    return value.strip()
+
+
+def format_plain_value(value: Any) -> str:
+    """Keep the text as-is (insights, titles, descriptions). / 原样保留文本（洞察、标题、描述）。"""
+    return cell_text(value)
+
+
+def format_json_value(value: Any) -> str:
+    """
+    Humanize cells that look like JSON, keep other text as-is.
+    看起来像JSON的单元格转为自然语言，其他文本原样保留。
+    """
+    value = cell_text(value)
+    # Check if it looks like JSON and try to parse / 检查是否看起来像JSON并尝试解析
+    if value and looks_like_json(value):
         try:
-            obj = json.loads(value)
-            return humanize_json(obj)
+            obj = json_codec.loads(value)
+            return humanize_json(obj, max_chars=HUMANIZE_MAX_CHARS)
         except Exception:
-            # If JSON parsing fails, return as-is
-            # 如果JSON解析失败，原样返回
+            # If JSON parsing fails, return as-is / 如果JSON解析失败，原样返回
             return value
-    
     return value
 
 
+# Upper bound of cached (column, cell value) results / 缓存的 (列, 单元格值) 结果数量上限
+FORMAT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def cached_format(column: str, value: str) -> str:
+    """
+    Format an RD Comments or Ingredients cell, memoized on (column, value).
+    格式化 RD Comments 或 Ingredients 单元格，按 (列, 值) 缓存结果。
+
+    Exports repeat the same cells a lot ("[]", the same thumbs-up comment), so these
+    are parsed and formatted once; the LRU bound keeps memory flat on large galleries.
+    导出数据中相同单元格大量重复（"[]"、相同的点赞评论），因此只解析和格式化一次；
+    LRU 上限保证大画廊的内存占用不会增长。
+    """
+    if column == 'ingredients':
+        return format_ingredients(value)
+    return format_rd_comments(value)
+
+
+def format_cache_stats() -> Dict[str, int]:
+    """
+    Hit/miss counters of cached_format(). / cached_format() 的命中/未命中计数。
+    """
+    info = cached_format.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
+def format_rd_comments_value(value: Any) -> str:
+    value = cell_text(value)
+    return cached_format('rd comments', value) if value else ""
+
+
+def format_ingredients_value(value: Any) -> str:
+    value = cell_text(value)
+    return cached_format('ingredients', value) if value else ""
+
+
+# Formatter registry: lower-cased column name -> cell formatter / 格式化注册表：小写列名 -> 单元格格式化函数
+FIELD_FORMATTERS: Dict[str, Callable[[Any], str]] = {
+    'rd comments': format_rd_comments_value,
+    'rd_comments': format_rd_comments_value,
+    'ingredients': format_ingredients_value,
+    'aiinsight': format_plain_value,  # Keep as-is for insights / 洞察原样保留
+    'insight': format_plain_value,
+    'aititle': format_plain_value,  # Keep as-is for titles / 标题原样保留
+    'mealtitle': format_plain_value,
+    'description': format_plain_value,  # Keep as-is for descriptions / 描述原样保留
+}
+
+# Columns whose formatted value is HTML and must not be escaped / 格式化结果为HTML、不能转义的列
+HTML_FIELDS = {'ingredients'}
+
+
+def resolve_formatter(field_name: str) -> Callable[[Any], str]:
+    """
+    Cell formatter for a column: a registered special field, else JSON-or-text.
+    返回某列的单元格格式化函数：已注册的特殊字段，否则为 JSON 或纯文本。
+    """
+    return FIELD_FORMATTERS.get(field_name.lower(), format_json_value)
+
+
+class ColumnFormatter(NamedTuple):
+    """
+    Everything a card needs to render one column, resolved once per DataFrame.
+    卡片渲染某一列所需的全部信息，每个 DataFrame 只解析一次。
+    """
+    name: str
+    label: str
+    format: Callable[[Any], str]
+    escape_html: bool
+
+
+def compile_formatters(display_columns: List[str]) -> List[ColumnFormatter]:
+    """
+    Resolve formatter, label and escaping policy for every displayed column (ImgName excluded).
+    为每个显示列解析格式化函数、标签和转义策略（不含 ImgName）。
+
+    Pass the result to build_card_html(formatters=...) so per-cell work is a single call.
+    把结果传给 build_card_html(formatters=...)，每个单元格只需一次直接调用。
+    """
+    return [ColumnFormatter(col, col, resolve_formatter(col), col.lower() not in HTML_FIELDS)
+            for col in display_columns if col != "ImgName"]
+
+
 def format_rd_comments(s: Any) -> str:
     """
     Format RD Comments to show only 'text' and 'commentedAt' fields.
@@ -211,7 +247,7 @@ def format_rd_comments(s: Any) -> str:
             return ""
         if looks_like_json(s_strip):
             try:
-                obj = json.loads(s_strip)
+                obj = json_codec.loads(s_strip)
             except Exception:
                 return s_strip
         else:
@@ -285,7 +321,7 @@ def format_ingredients(s: Any) -> str:
             return ""
         if looks_like_json(s_strip):
             try:
-                obj = json.loads(s_strip)
+                obj = json_codec.loads(s_strip)
             except Exception:
                 return s_strip
         else:
@@ -396,17 +432,8 @@ def read_image_as_data_uri(img_path: Path) -> str:
         - .webp: image/webp
     """
     try:
-        ext = img_path.suffix.lower()
-        mime = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".gif": "image/gif",
-            ".webp": "image/webp",
-        }.get(ext, "image/jpeg")
-        data = img_path.read_bytes()
-        b64 = base64.b64encode(data).decode("ascii")
-        return f"data:{mime};base64,{b64}"
+        # Cached by path + mtime, so deduplicated images are encoded once / 按路径和修改时间缓存，去重后的图片只编码一次
+        return encode_data_uri(img_path)
     except Exception:
         # If cannot read, return empty string, will show "image missing" / 读不到就返回空串，后续会显示"图片缺失"
         return ""
@@ -434,7 +461,8 @@ def get_display_columns(df: pd.DataFrame) -> List[str]:
     return display_columns
 
 
-def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx: Any = None) -> str:
+def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx: Any = None,
+                    variant: str = "original", formatters: List[ColumnFormatter] = None) -> str:
     """
     Build HTML card for a single food log entry with dynamic columns.
     为单个食物记录构建HTML卡片，支持动态列。
@@ -449,13 +477,38 @@ def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx:
         row: Pandas DataFrame row containing food log data / 包含食物记录数据的Pandas DataFrame行
         images_dir (Path): Directory containing the image files / 包含图片文件的目录
         display_columns (List[str]): List of columns to display / 要显示的列列表
+        variant (str): Image size variant to inline: original, medium or thumb / 内嵌图片的尺寸：original、medium 或 thumb
+        formatters (List[ColumnFormatter]): compile_formatters(display_columns), computed once per DataFrame by the caller / 调用方按 DataFrame 预先计算的 compile_formatters(display_columns)
         
     Returns:
         str: Complete HTML card markup / 完整的HTML卡片标记
     """
+    # ImgName is skipped (handled in render_card); HTML fields like Ingredients are not escaped
+    # 跳过 ImgName（在 render_card 中处理）；Ingredients 等HTML字段不转义
+    if formatters is None:
+        formatters = compile_formatters(display_columns)
+    values = [column.format(row[column.name] if column.name in row.index else "") for column in formatters]
+    nutrition = meal_summary(row.get("Ingredients")) if "Ingredients" in display_columns else ""
+    return render_card(values, formatters, images_dir, variant, foodlog_id_value=row.get("FoodLogId"),
+                       imgnames_value=row.get("ImgName", ""), row_idx=row_idx, nutrition_summary=nutrition)
+
+
+def render_card(values: List[str], formatters: List[ColumnFormatter], images_dir: Path,
+                variant: str = "original", foodlog_id_value: Any = None, imgnames_value: Any = "",
+                row_idx: Any = None, nutrition_summary: str = "") -> str:
+    """
+    Build the card HTML from already formatted values (values[i] belongs to formatters[i]).
+    用已格式化的值构建卡片HTML（values[i] 对应 formatters[i]）。
+
+    nutrition_summary is the per-meal totals block from nutrition.py, shown after the fields.
+    nutrition_summary 为 nutrition.py 计算的每餐营养合计，显示在字段之后。
+
+    Shared by build_card_html (one pandas row) and PreformattedCards (column-wise pre-formatted frame).
+    由 build_card_html（单个 pandas 行）和 PreformattedCards（按列预格式化的数据）共用。
+    """
     # Handle images first (ImgName is required)
     # 首先处理图片（ImgName是必需的）
-    raw_imgnames = str(row.get("ImgName", "") or "").strip()
+    raw_imgnames = str(imgnames_value or "").strip()
     img_names: Iterable[str] = [x.strip() for x in raw_imgnames.split(";") if x.strip()] if raw_imgnames else []
 
     # Process each image: convert to data URI or show missing placeholder
@@ -463,108 +516,85 @@ def build_card_html(row, images_dir: Path, display_columns: List[str], row_idx:
     img_tags = []
     if img_names:
         for name in img_names:
-            img_path = images_dir / name
-            data_uri = read_image_as_data_uri(img_path)
-            if data_uri:
-                # Successfully loaded image, create img tag with data URI
-                # 成功加载图片，创建带data URI的img标签
-                img_tags.append(f'<img src="{data_uri}" alt="{html.escape(name)}" />')
-            else:
-                # Image file not found or failed to load, show missing placeholder
-                # 图片文件未找到或加载失败，显示缺失占位符
-                img_tags.append(f'<div class="img-missing">缺失：{html.escape(name)}</div>')
+            # Use the resized variant from download_images --derivatives if one exists
+            # 如果 download_images --derivatives 生成了缩放版本则使用它
+            img_path = resolve_variant(images_dir, name, variant)
+            # Image tag with data URI, or a missing placeholder if the file failed to load
+            # 带data URI的img标签；图片加载失败时显示缺失占位符
+            img_tags.append(image_html(name, read_image_as_data_uri(img_path)))
     else:
         # No image names provided in CSV
         # CSV中未提供图片名称
-        img_tags.append('<div class="img-missing">未提供图片文件名</div>')
-
-    def para(label: str, text: str, escape_html: bool = True) -> str:
-        """
-        Helper to create a field div with label and value.
-        创建带标签和值的字段div的辅助函数。
-        
-        Args:
-            label (str): Field label / 字段标签
-            text (str): Field value / 字段值
-            escape_html (bool): Whether to escape HTML in the value / 是否转义值中的HTML
-            
-        Returns:
-            str: HTML div element / HTML div元素
-        """
-        if not text:
-            return ""
-        if escape_html:
-            # Escape HTML characters and convert newlines to <br/> tags
-            # 转义HTML字符并将换行符转换为<br/>标签
-            safe = html.escape(text).replace("\n", "<br/>")
-        else:
-            # Don't escape HTML, but still convert newlines to <br/>
-            # 不转义HTML，但仍将换行符转换为<br/>
-            safe = text.replace("\n", "<br/>")
-        return f'<div class="field"><div class="label">{html.escape(label)}</div><div class="value">{safe}</div></div>'
+        img_tags.append(NO_IMAGES)
 
     # Generate field HTML for all display columns
     # 为所有显示列生成字段HTML
-    field_html = []
-    for col in display_columns:
-        if col == "ImgName":
-            continue  # Skip ImgName as it's handled separately
-        
-        value = row[col] if col in row.index else ""
-        formatted_value = format_field_value(value, col)
-        
-        # Determine if this field should allow HTML (like Ingredients)
-        # 确定此字段是否应允许HTML（如Ingredients）
-        allow_html = col.lower() in ['ingredients']
-        
+    fields = []
+    for column, formatted_value in zip(formatters, values):
         if formatted_value:
-            field_html.append(para(col, formatted_value, escape_html=not allow_html))
+            fields.append(field_html(column.label, formatted_value, escape_html=column.escape_html))
+    if nutrition_summary:
+        # Summed PROTEIN/FAT/CARB/... of the Ingredients column / Ingredients 列的营养素合计
+        fields.append(field_html(NUTRITION_LABEL, nutrition_summary))
 
     # Get FoodLogId for form identification (use index if FoodLogId not available)
     # 获取FoodLogId用于表单标识（如果FoodLogId不可用，使用索引）
-    foodlog_id = ""
-    if "FoodLogId" in row.index:
-        foodlog_id_val = row["FoodLogId"]
-        foodlog_id = str(foodlog_id_val) if pd.notna(foodlog_id_val) else ""
+    foodlog_id = str(foodlog_id_value) if pd.notna(foodlog_id_value) else ""
     if not foodlog_id and row_idx is not None:
         # Fallback: use row index as identifier
         # 备用方案：使用行索引作为标识符
         foodlog_id = str(row_idx)
 
-    # Add review form
-    # 添加review表单（用于标注AI生成内容的质量）
-    review_form = f"""
-        <div class="review-form">
-            <div class="review-form-title">Add RD Review</div>
-            <div class="review-form-hint">For labeling the quality of AI-generated content</div>
-            <form class="rd-review-form" data-foodlog-id="{html.escape(foodlog_id)}">
-                <div class="form-group">
-                    <label for="rd-name-{html.escape(foodlog_id)}">RD Name:</label>
-                    <input type="text" id="rd-name-{html.escape(foodlog_id)}" name="rd_name" class="form-input" required />
-                </div>
-                <div class="form-group">
-                    <label for="rd-review-{html.escape(foodlog_id)}">Review (AI Content Quality Assessment):</label>
-                    <textarea id="rd-review-{html.escape(foodlog_id)}" name="rd_review" class="form-textarea" rows="3" placeholder="Please assess the quality of AI-generated content..." required></textarea>
-                </div>
-                <button type="submit" class="submit-btn">Submit</button>
-                <div class="form-status"></div>
-            </form>
-            <div class="review-display" id="review-display-{html.escape(foodlog_id)}"></div>
-        </div>
-    """
-
-    return f"""
-    <div class="card" data-foodlog-id="{html.escape(foodlog_id)}">
-        <div class="images">
-            {''.join(img_tags)}
-        </div>
-        <div class="meta">
-            {''.join(field_html)}
-        </div>
-        {review_form}
-    </div>
+    # Add review form (precompiled in card_templates, FoodLogId escaped once)
+    # 添加review表单（预编译于 card_templates，FoodLogId 只转义一次）
+    return render_card_html(REVIEW_CARD, foodlog_id, img_tags, fields)
+
+
+class PreformattedCards:
+    """
+    Column-wise pre-formatting stage ahead of card rendering.
+    卡片渲染之前的按列预格式化阶段。
+
+    Every displayed column is formatted as a whole (preformat.format_column: each distinct
+    cell once) into plain lists, and card_html(i) only indexes them, so rendering a frame
+    needs no df.iterrows() and no pandas Series per row.
+
+    每个显示列整体格式化（preformat.format_column：相同单元格只格式化一次）为普通列表，
+    card_html(i) 只需按位置索引，渲染整个表时不再需要 df.iterrows() 和逐行的 pandas Series。
     """
 
+    def __init__(self, df: pd.DataFrame, display_columns: List[str], formatters: List[ColumnFormatter] = None):
+        self.formatters = formatters if formatters is not None else compile_formatters(display_columns)
+        self.index = df.index.tolist()
+        self.errors = {}
+        columns = []
+        for column in self.formatters:
+            formatted, errors = format_column(column_values(df, column.name, ""), column.format, cell_text)
+            columns.append(formatted)
+            for pos, error in errors.items():
+                self.errors.setdefault(pos, error)
+        # One tuple of formatted values per row / 每行一个格式化值元组
+        self.rows = list(zip(*columns)) if columns else [()] * len(df)
+        self.foodlog_ids = column_values(df, "FoodLogId")
+        self.imgnames = column_values(df, "ImgName", "")
+        # Per-meal nutrition totals, summed for the whole column at once / 每餐营养合计，整列一次性计算
+        self.nutrition = (meal_summaries(column_values(df, "Ingredients", "")) if "Ingredients" in display_columns
+                          else [""] * len(df))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def card_html(self, pos: int, images_dir: Path, variant: str = "original") -> str:
+        """
+        Card of the row at position `pos`; raises the formatter error if one of its cells failed.
+        位置 pos 处记录的卡片；若其某个单元格格式化失败则抛出该错误。
+        """
+        if pos in self.errors:
+            raise self.errors[pos]
+        return render_card(self.rows[pos], self.formatters, images_dir, variant,
+                           foodlog_id_value=self.foodlog_ids[pos], imgnames_value=self.imgnames[pos],
+                           row_idx=self.index[pos], nutrition_summary=self.nutrition[pos])
+
 
 def build_html(doc_cards: str, title: str = "FoodLog Gallery") -> str:
     """
@@ -831,6 +861,118 @@ document.addEventListener('DOMContentLoaded', function() {{
 """
 
 
+# Marker split out of build_html() to get the document around the cards / 从 build_html() 中切分出卡片前后文档的标记
+CARDS_MARKER = "<!--foodlog-cards-->"
+
+
+def build_html_parts(title: str = "FoodLog Gallery") -> tuple:
+    """
+    Split the gallery document into the HTML before and after the cards.
+    把画廊文档拆成卡片之前和之后的两段HTML。
+
+    Args:
+        title (str): Page title / 页面标题
+
+    Returns:
+        tuple: (head, tail) strings; head + cards + tail == build_html(cards, title) / (head, tail) 两段字符串
+    """
+    head, tail = build_html(CARDS_MARKER, title=title).split(CARDS_MARKER)
+    return head, tail
+
+
+class GalleryStreamWriter:
+    """
+    Append cards to the gallery HTML as rows become ready, instead of building it at the end.
+    在记录就绪时逐张追加卡片到画廊HTML，而不是最后一次性生成。
+
+    Used by download_images.py --gallery-out: every downloaded row is rendered with
+    build_card_html() right away and flushed, so the page can be opened (and reviewed)
+    while the export is still running. With page_size > 0 the gallery is split into
+    <out>-0001.html, <out>-0002.html, ... and each page is complete (styles, review form
+    script) as soon as it holds page_size cards.
+
+    供 download_images.py --gallery-out 使用：每条下载完成的记录立即通过 build_card_html()
+    渲染并刷新到文件，导出仍在运行时即可打开页面审阅。page_size > 0 时画廊按页拆分为
+    <out>-0001.html、<out>-0002.html ……，每页满 page_size 张卡片后即为完整页面。
+    """
+
+    def __init__(self, out_html: Path, images_dir: Path, title: str = "FoodLog Gallery",
+                 variant: str = "original", page_size: int = 0):
+        self.out_html = Path(out_html)
+        self.images_dir = Path(images_dir)
+        self.variant = variant
+        self.page_size = page_size
+        self.head, self.tail = build_html_parts(title)
+        self.display_columns = None
+        self.formatters = None
+        self.pages = []
+        self.cards = 0
+        self.page_cards = 0
+        self.file = None
+
+    def page_path(self, number: int) -> Path:
+        if not self.page_size:
+            return self.out_html
+        return self.out_html.with_name(f"{self.out_html.stem}-{number:04d}{self.out_html.suffix}")
+
+    def _open_page(self):
+        path = self.page_path(len(self.pages) + 1)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.pages.append(path)
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write(self.head)
+        self.file.flush()
+        self.page_cards = 0
+
+    def _close_page(self):
+        self.file.write(self.tail)
+        self.file.close()
+        self.file = None
+        if self.page_size:
+            print(f"[OK] Gallery page ready / 画廊页已生成：{self.pages[-1]} ({self.page_cards} cards / 张卡片)")
+
+    def add(self, df: pd.DataFrame, idx: Any) -> bool:
+        """
+        Render row `idx` of df (ImgName already set) and append it to the current page.
+        渲染 df 的第 idx 行（ImgName 已填好）并追加到当前页。
+
+        Returns:
+            bool: False if the card could not be rendered / 渲染失败时返回 False
+        """
+        if self.display_columns is None:
+            self.display_columns = get_display_columns(df)
+            self.formatters = compile_formatters(self.display_columns)
+        try:
+            card = build_card_html(df.loc[idx], self.images_dir, self.display_columns, row_idx=idx,
+                                   variant=self.variant, formatters=self.formatters)
+        except Exception as e:
+            # A card that fails to render must not stop the download / 单张卡片渲染失败不应中断下载
+            print(f"[WARN] Failed to render a record / 渲染某条记录失败：{e}", file=sys.stderr)
+            return False
+        if self.file is None:
+            self._open_page()
+        self.file.write(card)
+        # Flush every card so a browser opening the file sees it / 每张卡片都刷新，浏览器打开即可看到
+        self.file.flush()
+        self.cards += 1
+        self.page_cards += 1
+        if self.page_size and self.page_cards >= self.page_size:
+            self._close_page()
+        return True
+
+    def close(self):
+        """
+        Finish the last page (writes an empty gallery if no card was added).
+        结束最后一页（没有卡片时也写出空画廊）。
+        """
+        if self.file is None and not self.pages:
+            self._open_page()
+        if self.file is not None:
+            self._close_page()
+        target = self.out_html if not self.page_size else f"{len(self.pages)} pages / 页 ({self.page_path(1)} ...)"
+        print(f"[OK] Generated / 已生成：{target} (Total / 共 {self.cards} 条)")
+
+
 def main():
     """
     Main function to generate HTML gallery from CSV food log data.
@@ -843,6 +985,7 @@ def main():
     parser.add_argument("--images", default="./images", help="Images directory (default: ./images) / 图片目录（默认 ./images）")
     parser.add_argument("--out", default="gallery_flexible.html", help="Output HTML filename (default: gallery_flexible.html) / 输出 HTML 文件名（默认 gallery_flexible.html）")
     parser.add_argument("--title", default="FoodLog Gallery - Flexible", help="HTML page title / HTML 页面标题")
+    parser.add_argument("--variant", choices=VARIANTS, default="original", help="Image size to embed (thumb/medium need download_images --derivatives) / 内嵌图片尺寸（thumb/medium 需先运行 download_images --derivatives）")
     parser.add_argument("--open", action="store_true", help="Automatically open in default browser after generation / 生成后自动在默认浏览器打开")
     args = parser.parse_args()
 
@@ -872,12 +1015,15 @@ def main():
     display_columns = get_display_columns(df)
     print(f"[INFO] Display columns / 显示列：{display_columns}")
 
+    # Format whole columns once, then render cards by position / 先按列整体格式化，再按位置渲染卡片
+    cards = PreformattedCards(df, display_columns)
+
     # Generate all cards / 生成所有卡片
     cards_html = []
     total = len(df)
-    for idx, row in df.iterrows():
+    for pos in range(len(cards)):
         try:
-            cards_html.append(build_card_html(row, images_dir, display_columns, row_idx=idx))
+            cards_html.append(cards.card_html(pos, images_dir, variant=args.variant))
         except Exception as e:
             # Continue even if single record fails / 即使单条失败也不中断
             print(f"[WARN] Failed to render a record / 渲染某条记录失败：{e}", file=sys.stderr)
@@ -886,6 +1032,10 @@ def main():
     doc = build_html("".join(cards_html), title=args.title)
     out_html.write_text(doc, encoding="utf-8")
     print(f"[OK] Generated / 已生成：{out_html.resolve()} (Total / 共 {total} 条)")
+    cache = format_cache_stats()
+    print(f"[INFO] Format cache / 格式化缓存：{cache['hits']} hits / 命中, {cache['misses']} misses / 未命中")
+    cache = nutrition_cache_stats()
+    print(f"[INFO] Nutrition cache / 营养缓存：{cache['hits']} hits / 命中, {cache['misses']} misses / 未命中")
 
     # Open in browser if requested / 如果请求则在浏览器中打开
     if args.open: